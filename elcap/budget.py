@@ -0,0 +1,190 @@
+import ast
+import __builtin__
+import sys
+
+import hotpatch
+import mutator
+
+# Name of the builtin holding the Budget that the instrumented loops check.
+BUDGET_NAME = '__elcap_budget__'
+
+# Prefix of the local counters of the instrumented loops. The trailing
+# underscores keep them from being mangled inside classes.
+COUNTER_PREFIX = '__elcap_loop_'
+
+# Frames allowed above twice the deepest stack of the original tests, which
+# also covers the frames of the suites running the tests.
+DEPTH_MARGIN = 100
+
+
+class BudgetExceeded(BaseException):
+    """Raised when a loop of a mutant exceeds its budget of iterations.
+
+    It is not an Exception, so the handlers of the code under test do not
+    swallow it.
+    """
+
+
+class Budget(object):
+    """The iterations and stack depth a mutant is allowed before it is
+    considered to hang.
+
+    Attributes:
+      loops: the iterations allowed each time an instrumented loop runs.
+      depth: the frames allowed above the start of the tests.
+    """
+
+    def __init__(self, loops, depth):
+        self.loops = loops
+        self.depth = depth
+
+    def exceeded(self):
+        """Called by an instrumented loop that ran out of iterations."""
+        raise BudgetExceeded('loop exceeded %d iterations' % self.loops)
+
+    def install(self):
+        """Makes the budget visible to the instrumented code."""
+        setattr(__builtin__, BUDGET_NAME, self)
+
+    def uninstall(self):
+        if getattr(__builtin__, BUDGET_NAME, None) is self:
+            delattr(__builtin__, BUDGET_NAME)
+
+    def run(self, function, *args):
+        """Calls the function with the recursion limit lowered to the depth
+        budget, and returns its result."""
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(min(recursion_limit,
+                                  recursion_depth() + self.depth))
+        try:
+            return function(*args)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+
+class DepthGauge(object):
+    """Measures the deepest stack the tests reach, through a profile hook.
+
+    The depth is counted from the frame starting the gauge, so it does not
+    depend on the frames of the runner.
+    """
+
+    def __init__(self):
+        self.max_depth = 0
+        self._depth = 0
+
+    def start(self):
+        # The profile hook sees start return to its caller.
+        self._depth = 1
+        sys.setprofile(self._profile)
+
+    def stop(self):
+        sys.setprofile(None)
+
+    def budget(self, loops):
+        """Returns the Budget calibrated on the measured depth."""
+        return Budget(loops, 2 * self.max_depth + DEPTH_MARGIN)
+
+    def _profile(self, frame, event, arg):  # pylint: disable=W0613
+        if event == 'call':
+            self._depth += 1
+            if self._depth > self.max_depth:
+                self.max_depth = self._depth
+        elif event == 'return':
+            self._depth -= 1
+
+
+class LoopInstrumenter(ast.NodeTransformer):
+    """Counts down the iterations of the loops of a function.
+
+    Each loop gets a local counter, set to the budget when the loop starts,
+    checked and decremented at the start of each iteration, so the check
+    costs a few local operations per iteration.
+    """
+
+    def __init__(self):
+        self.loops = 0
+
+    def visit_ClassDef(self, node):
+        # The statements of a class body would define class attributes.
+        return node
+
+    def visit_For(self, node):
+        return self._instrument(node)
+
+    def visit_While(self, node):
+        return self._instrument(node)
+
+    def _instrument(self, node):
+        self.generic_visit(node)
+        self.loops += 1
+        counter = '%s%d__' % (COUNTER_PREFIX, self.loops)
+        budget = ast.Name(BUDGET_NAME, ast.Load())
+        start = ast.Assign([ast.Name(counter, ast.Store())],
+                           ast.Attribute(budget, 'loops', ast.Load()))
+        count = ast.AugAssign(ast.Name(counter, ast.Store()), ast.Sub(),
+                              ast.Num(1))
+        check = ast.If(
+                ast.UnaryOp(ast.Not(), ast.Name(counter, ast.Load())),
+                [ast.Expr(ast.Call(ast.Attribute(budget, 'exceeded',
+                                                 ast.Load()),
+                                   [], [], None, None))], [])
+        node.body = [check, count] + node.body
+        for statement in (start, count, check):
+            ast.copy_location(statement, node)
+            ast.fix_missing_locations(statement)
+        return [start, node]
+
+
+def instrument(tree, path):
+    """Instruments the loops of the function enclosing the path, in place.
+
+    Returns:
+      The tree. The loops at module level are left as they are.
+    """
+    enclosing = hotpatch.enclosing_function(tree, path)
+    if enclosing is not None:
+        _, function = enclosing
+        instrumenter = LoopInstrumenter()
+        function.body = [statement for node in function.body
+                         for statement in _as_list(instrumenter.visit(node))]
+    return tree
+
+
+def mutant_tree(code, site, instrumented):
+    """Returns the tree of the mutant of the site, with the loops of its
+    function instrumented when asked."""
+    tree = mutator.mutate(code, site)
+    if instrumented:
+        instrument(tree, site.path)
+    return tree
+
+
+def is_hang(err):
+    """Returns whether the exc_info of a test error is an exceeded budget,
+    or the recursion limit the budget lowered."""
+    if err is None:
+        return False
+    exc_class, exc_value = err[0], err[1]
+    if issubclass(exc_class, BudgetExceeded):
+        return True
+    return (issubclass(exc_class, RuntimeError) and
+            'maximum recursion depth' in str(exc_value))
+
+
+def recursion_depth():
+    """Returns the depth of the caller as counted by the recursion limit.
+
+    The limit also counts the calls made through C, such as the calls of the
+    test suites, so the depth is found by recursing until the limit.
+    """
+    def probe(depth):
+        try:
+            return probe(depth + 1)
+        except RuntimeError:
+            return depth
+    return sys.getrecursionlimit() - probe(1)
+
+
+def _as_list(node):
+    return node if isinstance(node, list) else [node]
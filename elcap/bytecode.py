@@ -0,0 +1,317 @@
+# Disabling naming convention check.
+# pylint: disable=C0103
+
+import __future__
+import ast
+from collections import defaultdict
+from collections import namedtuple
+import dis
+import types
+
+import mutator
+
+ARITHMETIC_OPCODES = {ast.Add: ('BINARY_ADD',),
+                      ast.Sub: ('BINARY_SUBTRACT',),
+                      ast.Mult: ('BINARY_MULTIPLY',),
+                      ast.Div: ('BINARY_DIVIDE', 'BINARY_TRUE_DIVIDE'),
+                      ast.FloorDiv: ('BINARY_FLOOR_DIVIDE',),
+                      ast.Mod: ('BINARY_MODULO',),
+                      ast.LShift: ('BINARY_LSHIFT',),
+                      ast.RShift: ('BINARY_RSHIFT',),
+                      ast.BitAnd: ('BINARY_AND',),
+                      ast.BitOr: ('BINARY_OR',),
+                      ast.BitXor: ('BINARY_XOR',),
+                      ast.Pow: ('BINARY_POWER',)}
+
+COMPARISON_OPERATORS = {ast.Eq: '==',
+                        ast.NotEq: '!=',
+                        ast.Gt: '>',
+                        ast.GtE: '>=',
+                        ast.Lt: '<',
+                        ast.LtE: '<=',
+                        ast.In: 'in',
+                        ast.NotIn: 'not in',
+                        ast.Is: 'is',
+                        ast.IsNot: 'is not'}
+
+LOGICAL_OPCODES = {ast.And: 'JUMP_IF_FALSE_OR_POP',
+                   ast.Or: 'JUMP_IF_TRUE_OR_POP'}
+
+NUMBER_TYPES = (int, long, float, complex)
+
+
+def _opcode_mapping(mapping, opcodes):
+    """Translates a mapping between AST operators to one between opcodes."""
+    result = {}
+    for source, target in mapping.iteritems():
+        for opname in opcodes[source]:
+            result[dis.opmap[opname]] = dis.opmap[opcodes[target][0]]
+    return result
+
+ARITHMETIC_MAPPING = _opcode_mapping(mutator.ArithmeticMutator.mapping,
+                                     ARITHMETIC_OPCODES)
+COMPARISON_MAPPING = dict(
+        (dis.cmp_op.index(COMPARISON_OPERATORS[source]),
+         dis.cmp_op.index(COMPARISON_OPERATORS[target]))
+        for source, target in mutator.ComparisonMutator.mapping.iteritems())
+LOGICAL_MAPPING = dict(
+        (dis.opmap[LOGICAL_OPCODES[source]], dis.opmap[LOGICAL_OPCODES[target]])
+        for source, target in mutator.LogicalMutator.mapping.iteritems())
+
+
+class BytecodeSite(namedtuple('BytecodeSite',
+                              'line offset code_path mutator position '
+                              'replacement')):
+    """An instruction of a compiled module that a mutator is able to modify.
+
+    Attributes:
+      line: line number of the instruction.
+      offset: offset of the instruction in its code object.
+      code_path: tuple of co_consts indexes leading from the module code to
+          the code object holding the instruction.
+      mutator: the mutator class whose semantics the mutation follows.
+      position: ordinal of the site among the sites of the mutator.
+      replacement: tuple (kind, value) describing the mutation, where kind is
+          one of 'opcode', 'arg', 'const' or 'name'.
+    """
+    __slots__ = ()
+
+
+def instructions(code):
+    """Yields the (offset, opcode, arg, extended) instructions of the code.
+
+    extended is True when the argument of the instruction needs an
+    EXTENDED_ARG prefix.
+    """
+    co_code = code.co_code
+    extended_arg = 0
+    offset = 0
+    while offset < len(co_code):
+        opcode = ord(co_code[offset])
+        if opcode < dis.HAVE_ARGUMENT:
+            yield offset, opcode, None, False
+            offset += 1
+            continue
+        arg = (ord(co_code[offset + 1]) | ord(co_code[offset + 2]) << 8 |
+               extended_arg)
+        if opcode == dis.EXTENDED_ARG:
+            extended_arg = arg << 16
+        else:
+            yield offset, opcode, arg, extended_arg != 0
+            extended_arg = 0
+        offset += 3
+
+
+def walk_code(code, code_path=()):
+    """Yields the (code_path, code) pairs of the code and its nested code."""
+    yield code_path, code
+    for index, const in enumerate(code.co_consts):
+        if isinstance(const, types.CodeType):
+            for nested in walk_code(const, code_path + (index,)):
+                yield nested
+
+
+def nested_code(code, code_path):
+    """Returns the code object nested in code through the code_path."""
+    for index in code_path:
+        code = code.co_consts[index]
+    return code
+
+
+def get_literals(tree):
+    """Returns a mapping from line number to the literals in that line."""
+    literals = defaultdict(set)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Num):
+            literals[node.lineno].add((type(node.n), node.n))
+        elif isinstance(node, ast.Str):
+            literals[node.lineno].add((type(node.s), node.s))
+    return literals
+
+
+def arithmetic_rule(code, opcode, arg, literals):  # pylint: disable=W0613
+    if opcode not in ARITHMETIC_MAPPING:
+        return None
+    new_opcode = ARITHMETIC_MAPPING[opcode]
+    if (new_opcode == dis.opmap['BINARY_DIVIDE'] and
+        code.co_flags & __future__.division.compiler_flag):
+        new_opcode = dis.opmap['BINARY_TRUE_DIVIDE']
+    return 'opcode', new_opcode
+
+
+def comparison_rule(code, opcode, arg, literals):  # pylint: disable=W0613
+    if opcode == dis.opmap['COMPARE_OP'] and arg in COMPARISON_MAPPING:
+        return 'arg', COMPARISON_MAPPING[arg]
+    return None
+
+
+def logical_rule(code, opcode, arg, literals):  # pylint: disable=W0613
+    if opcode in LOGICAL_MAPPING:
+        return 'opcode', LOGICAL_MAPPING[opcode]
+    return None
+
+
+def number_rule(code, opcode, arg, literals):
+    if opcode != dis.opmap['LOAD_CONST']:
+        return None
+    value = code.co_consts[arg]
+    # Constants without a literal in the line were created by the compiler,
+    # like folded expressions or the level of an import.
+    if (isinstance(value, NUMBER_TYPES) and not isinstance(value, bool) and
+        (type(value), value) in literals):
+        return 'const', value + 1
+    return None
+
+
+def string_rule(code, opcode, arg, literals):
+    if opcode != dis.opmap['LOAD_CONST']:
+        return None
+    value = code.co_consts[arg]
+    if isinstance(value, basestring) and (type(value), value) in literals:
+        return 'const', 'XX' + value
+    return None
+
+
+def boolean_rule(code, opcode, arg, literals):  # pylint: disable=W0613
+    if opcode not in (dis.opmap['LOAD_NAME'], dis.opmap['LOAD_GLOBAL']):
+        return None
+    name = code.co_names[arg]
+    if name in mutator.BooleanMutator.mapping:
+        return 'name', mutator.BooleanMutator.mapping[name]
+    return None
+
+# Mutators supported by this engine and the function returning the
+# replacement of an instruction, if the mutator modifies it.
+RULES = {mutator.ArithmeticMutator: arithmetic_rule,
+         mutator.ComparisonMutator: comparison_rule,
+         mutator.LogicalMutator: logical_rule,
+         mutator.NumberMutator: number_rule,
+         mutator.StringMutator: string_rule,
+         mutator.BooleanMutator: boolean_rule}
+
+
+def index_sites(mutator_classes, module_code, literals):
+    """Returns the BytecodeSites of the module code.
+
+    Mutator classes without a rule in RULES are ignored.
+    """
+    rules = [(mutator_class, RULES[mutator_class])
+             for mutator_class in mutator_classes if mutator_class in RULES]
+    positions = defaultdict(int)
+    sites = []
+    for code_path, code in walk_code(module_code):
+        line_starts = dict(dis.findlinestarts(code))
+        line = code.co_firstlineno
+        for offset, opcode, arg, extended in instructions(code):
+            line = line_starts.get(offset, line)
+            # Mutations must not change the size of the instruction.
+            if extended or len(code.co_consts) >= 0xFFFF:
+                continue
+            for mutator_class, rule in rules:
+                replacement = rule(code, opcode, arg, literals[line])
+                if replacement is not None:
+                    positions[mutator_class] += 1
+                    sites.append(BytecodeSite(line, offset, code_path,
+                                              mutator_class,
+                                              positions[mutator_class],
+                                              replacement))
+    return sites
+
+
+def locate_logical(tree, sites):
+    """Replaces the LogicalMutator sites of the lines whose and/or cannot all
+    be located in the bytecode by the MutationSites of the AST.
+
+    The jumps of an and/or are only located in the value of an expression.
+    In a condition, the peephole optimizer merges them with the jumps of the
+    test into POP_JUMP_IF_FALSE/TRUE, which cannot be swapped alone. The
+    lines where the number of jumps found differs from the one of the and/or
+    operands run the mutants of the AST instead, so no site is dropped.
+
+    Returns:
+      The sites, with the MutationSites of those lines at the end.
+    """
+    expected = defaultdict(int)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.BoolOp):
+            expected[node.lineno] += len(node.values) - 1
+    found = defaultdict(int)
+    for site in sites:
+        if site.mutator is mutator.LogicalMutator:
+            found[site.line] += 1
+    lines = set(line for line in set(expected) | set(found)
+                if expected[line] != found[line])
+    if not lines:
+        return sites
+    return ([site for site in sites
+             if site.mutator is not mutator.LogicalMutator or
+             site.line not in lines] +
+            [site for site in mutator.index_sites([mutator.LogicalMutator()],
+                                                  tree)
+             if site.line in lines])
+
+
+def mutation_sites(mutator_classes, code, filename, line_filter):
+    """Returns the sites of the code whose lines pass the filter.
+
+    They are BytecodeSites, but for the and/or that locate_logical cannot
+    find in the bytecode, which are MutationSites.
+    """
+    code_lines = code.split('\n')
+    tree = ast.parse(code)
+    module_code = compile(tree, filename, 'exec')
+    sites = index_sites(mutator_classes, module_code, get_literals(tree))
+    if mutator.LogicalMutator in mutator_classes:
+        sites = locate_logical(tree, sites)
+    return [site for site in sites
+            if line_filter(code_lines[site.line - 1], site.line)]
+
+
+def copy_code(code, **kwargs):
+    """Returns a copy of the code object with the given fields replaced."""
+    fields = ['co_argcount', 'co_nlocals', 'co_stacksize', 'co_flags',
+              'co_code', 'co_consts', 'co_names', 'co_varnames',
+              'co_filename', 'co_name', 'co_firstlineno', 'co_lnotab',
+              'co_freevars', 'co_cellvars']
+    return types.CodeType(*[kwargs.get(field, getattr(code, field))
+                            for field in fields])
+
+
+def mutate_code(code, site):
+    """Returns the code object holding the site with its mutation applied."""
+    kind, value = site.replacement
+    co_code = list(code.co_code)
+    consts = code.co_consts
+    names = code.co_names
+    arg = None
+    if kind == 'opcode':
+        co_code[site.offset] = chr(value)
+    elif kind == 'arg':
+        arg = value
+    elif kind == 'const':
+        consts = consts + (value,)
+        arg = len(consts) - 1
+    elif kind == 'name':
+        if value not in names:
+            names = names + (value,)
+        arg = names.index(value)
+    if arg is not None:
+        co_code[site.offset + 1] = chr(arg & 0xFF)
+        co_code[site.offset + 2] = chr(arg >> 8)
+    return copy_code(code, co_code=''.join(co_code), co_consts=consts,
+                     co_names=names)
+
+
+def mutate(module_code, site, code_path=None):
+    """Returns a copy of the module code with the mutation of site applied.
+
+    The code objects enclosing the site are copied with the mutated code in
+    their co_consts. No source is parsed nor compiled.
+    """
+    if code_path is None:
+        code_path = site.code_path
+    if not code_path:
+        return mutate_code(module_code, site)
+    consts = list(module_code.co_consts)
+    consts[code_path[0]] = mutate(consts[code_path[0]], site, code_path[1:])
+    return copy_code(module_code, co_consts=tuple(consts))
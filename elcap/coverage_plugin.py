@@ -8,10 +8,13 @@ import nose.util
 class TestCoverage(Plugin):
     """
     Activate a by test coverage report using Ned Batchelder's coverage module.
+
+    When a budget.DepthGauge is given, it measures the stack of the tests too.
     """
 
-    def __init__(self):
+    def __init__(self, depth_gauge=None):
         super(TestCoverage, self).__init__()
+        self.depth_gauge = depth_gauge
         self.coverage_info = defaultdict(lambda: defaultdict(set))
         self.time_info = defaultdict(float)
         self._cover_instance = None
@@ -37,11 +40,15 @@ class TestCoverage(Plugin):
 
     def beforeTest(self, test):  # pylint: disable=C0103,W0613
         self.cover_instance.start()
+        if self.depth_gauge:
+            self.depth_gauge.start()
         self._start_time = time.time()
 
     def afterTest(self, test):  # pylint: disable=C0103
         test_name = make_name(test.address())
         self.time_info[test_name] = time.time() - self._start_time
+        if self.depth_gauge:
+            self.depth_gauge.stop()
         self.cover_instance.stop()
         self.cover_instance.save()
         for covered_filename in self.cover_instance.data.measured_files():
@@ -0,0 +1,285 @@
+from collections import deque
+import errno
+import importlib
+import json
+import os
+import select
+import socket
+import time
+
+import mutator
+
+# Prefix replacing the root directory of the checkout in the filenames and
+# test names sent over the network, as the checkouts of the workers may be
+# anywhere.
+ROOT_PREFIX = '<root>/'
+
+# Times a mutant is given to a worker before being recorded as crashed, when
+# the workers running it are lost.
+MAX_LOSSES = 2
+
+# Seconds a worker may take beyond the time limit of a mutant before it is
+# considered lost, which covers importing the file and its tests.
+LOSS_TIMEOUT = 60.0
+
+
+def parse_address(address):
+    """Returns the (host, port) pair of a HOST:PORT string."""
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def relative_name(name, root):
+    """Returns the filename or test name with the root directory replaced by
+    ROOT_PREFIX."""
+    prefix = os.path.join(root, '')
+    if name.startswith(prefix):
+        return ROOT_PREFIX + name[len(prefix):]
+    return name
+
+
+def absolute_name(name, root):
+    """Returns the filename or test name given by relative_name, in the
+    checkout at root."""
+    if name.startswith(ROOT_PREFIX):
+        return os.path.join(root, name[len(ROOT_PREFIX):])
+    return name
+
+
+def encode_site(site):
+    """Returns a MutationSite as a JSON serializable list."""
+    return [site.line, site.col_offset, site.path,
+            '%s.%s' % (site.mutator.__module__, site.mutator.__name__),
+            site.position]
+
+
+def decode_site(data):
+    """Returns the MutationSite encoded by encode_site."""
+    line, col_offset, path, mutator_name, position = data
+    module_name, class_name = mutator_name.rsplit('.', 1)
+    mutator_class = getattr(importlib.import_module(module_name), class_name)
+    return mutator.MutationSite(
+            line, col_offset,
+            tuple((str(field), index) for field, index in path),
+            mutator_class, position)
+
+
+class Connection(object):
+    """A socket exchanging JSON messages, one per line."""
+
+    def __init__(self, sock):
+        self.socket = sock
+        self._buffer = ''
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def send(self, message):
+        self.socket.sendall(json.dumps(message) + '\n')
+
+    def receive(self):
+        """Blocks until a message is received.
+
+        Returns:
+          The message, or None if the connection was closed.
+        """
+        while '\n' not in self._buffer:
+            data = self.socket.recv(65536)
+            if not data:
+                return None
+            self._buffer += data
+        line, self._buffer = self._buffer.split('\n', 1)
+        return json.loads(line)
+
+    def read_available(self):
+        """Reads the data available without blocking.
+
+        Returns:
+          The list of the complete messages received, or None if the
+          connection was closed.
+        """
+        data = self.socket.recv(65536)
+        if not data:
+            return None
+        self._buffer += data
+        lines = self._buffer.split('\n')
+        self._buffer = lines.pop()
+        return [json.loads(line) for line in lines]
+
+    def close(self):
+        self.socket.close()
+
+
+def connect(address):
+    """Returns a Connection to the coordinator at a HOST:PORT address."""
+    return Connection(socket.create_connection(parse_address(address)))
+
+
+class WorkerError(Exception):
+    """Raised when a worker reports that it failed outside of the tests of a
+    mutant, with the traceback of the worker."""
+
+
+class Coordinator(object):
+    """Serves the mutants to workers connecting over TCP, and collects their
+    results.
+
+    A worker sends {'ready': name} when it connects, and then
+    {'result': {'id': ..., 'outcome': ..., 'detail': ...}} for each item. The
+    coordinator answers each of these messages with {'item': item}, where the
+    item has at least an 'id' and a 'file', or with {'done': True} once
+    there is nothing left to run. The first item of a file a worker gets
+    comes with the 'file_info' of the file.
+
+    The items given to a worker that disconnects, or that does not answer
+    within their 'deadline' plus LOSS_TIMEOUT, are given to the next worker,
+    until they were lost MAX_LOSSES times. A worker failing to run an item
+    sends {'error': traceback} before leaving, which stops the serving with
+    a WorkerError.
+    """
+
+    def __init__(self, address, items, file_info):
+        """
+        Args:
+          address: the HOST:PORT address to listen on. Port 0 picks a free
+              port.
+          items: mapping from item id to item, in the order they are served.
+          file_info: mapping from the 'file' of the items to the information
+              the workers need about it.
+        """
+        self.address = parse_address(address)
+        self.items = items
+        self.file_info = file_info
+        self.listener = None
+
+    def bind(self):
+        """Starts listening, and returns the (host, port) pair listened on."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(16)
+        return self.listener.getsockname()
+
+    def serve(self, record):
+        """Serves the items until all of them have a result.
+
+        Args:
+          record: function called with the item id, the outcome and the
+              detail of each result, or with None as the outcome for the
+              items lost MAX_LOSSES times. The serving stops early when it
+              returns False.
+        Returns:
+          False if record stopped the serving, True otherwise.
+        Raises:
+          WorkerError: a worker failed outside of the tests of a mutant.
+        """
+        if self.listener is None:
+            self.bind()
+        queue = deque(self.items)
+        losses = dict.fromkeys(self.items, 0)
+        # The item each connection runs, and the time it must be done by.
+        in_flight = {}
+        files_sent = {}
+        idle = set()
+        connections = []
+
+        def assign(connection):
+            if not queue:
+                if in_flight:
+                    idle.add(connection)
+                else:
+                    finish(connection)
+                return
+            item_id = queue.popleft()
+            item = self.items[item_id]
+            message = {'item': item}
+            if item['file'] not in files_sent[connection]:
+                files_sent[connection].add(item['file'])
+                message['file_info'] = self.file_info[item['file']]
+            in_flight[connection] = item_id, (time.time() + item['deadline'] +
+                                              LOSS_TIMEOUT)
+            try:
+                connection.send(message)
+            except socket.error:
+                lose(connection)
+
+        def finish(connection):
+            try:
+                connection.send({'done': True})
+            except socket.error:
+                pass
+            drop(connection)
+
+        def drop(connection):
+            connection.close()
+            connections.remove(connection)
+            idle.discard(connection)
+
+        def lose(connection):
+            drop(connection)
+            item_id, _ = in_flight.pop(connection, (None, None))
+            if item_id is None:
+                return True
+            losses[item_id] += 1
+            if losses[item_id] >= MAX_LOSSES:
+                return record(item_id, None,
+                              'lost %d workers' % losses[item_id])
+            queue.appendleft(item_id)
+            for idle_connection in list(idle):
+                idle.discard(idle_connection)
+                assign(idle_connection)
+            return True
+
+        try:
+            while queue or in_flight:
+                now = time.time()
+                timeout = None
+                if in_flight:
+                    timeout = max(min(deadline for _, deadline in
+                                      in_flight.itervalues()) - now, 0)
+                try:
+                    readable = select.select([self.listener] + connections,
+                                             [], [], timeout)[0]
+                except select.error as error:
+                    if error.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for ready in readable:
+                    if ready is self.listener:
+                        sock, _ = self.listener.accept()
+                        connection = Connection(sock)
+                        connections.append(connection)
+                        files_sent[connection] = set()
+                        continue
+                    try:
+                        messages = ready.read_available()
+                    except socket.error:
+                        messages = None
+                    if messages is None:
+                        if not lose(ready):
+                            return False
+                        continue
+                    for message in messages:
+                        if 'error' in message:
+                            raise WorkerError(message['error'])
+                        if 'result' in message:
+                            result = message['result']
+                            if in_flight.get(ready, (None,))[0] != \
+                                    result['id']:
+                                continue
+                            del in_flight[ready]
+                            if not record(result['id'], result['outcome'],
+                                          result['detail']):
+                                return False
+                        if ready not in in_flight:
+                            assign(ready)
+                for connection, (_, deadline) in in_flight.items():
+                    if deadline < time.time():
+                        if not lose(connection):
+                            return False
+            return True
+        finally:
+            for connection in list(connections):
+                finish(connection)
+            self.listener.close()
+            self.listener = None
@@ -0,0 +1,108 @@
+import ast
+import hashlib
+import marshal
+
+import bytecode
+import hotpatch
+import mutator
+
+# Reasons to prune a mutant.
+EQUIVALENT = 'equivalent'
+DUPLICATE = 'duplicate'
+SUBSUMED = 'subsumed'
+
+
+def fingerprint(code_object):
+    """Returns a hash of the marshalled code object."""
+    return hashlib.sha1(marshal.dumps(code_object)).hexdigest()
+
+
+class MutantPruner(object):
+    """Detects mutants that compile to the same code as another version.
+
+    A mutant whose code is identical to the original code cannot be killed
+    (trivial compiler equivalence), for instance a mutated docstring under -OO
+    or a constant the compiler folds away. A mutant whose code is identical to
+    the one of a previous mutant would get the same result.
+
+    The smallest compiled unit holding the site is compared: the function
+    enclosing it when there is one, otherwise the whole module. The
+    fingerprints of the units may be given in known_fingerprints, a mapping
+    from site to the value of fingerprints, to avoid compiling the mutants.
+    """
+
+    def __init__(self, code, filename, known_fingerprints=None):
+        self.code = code
+        self.filename = filename
+        self.tree = ast.parse(code)
+        self.module_code = compile(self.tree, filename, 'exec')
+        self.known_fingerprints = known_fingerprints or {}
+        self.seen = set()
+        self.original_fingerprints = {}
+
+    def _compile_unit(self, site, module_code=None):
+        """Returns the key, original code and mutant code of the site unit."""
+        if module_code is not None:
+            names = hotpatch.function_names(self.tree, site.path)
+            if names:
+                function_code = hotpatch.find_code(module_code, names)
+                if function_code is not None:
+                    return (tuple(names),
+                            hotpatch.find_code(self.module_code, names),
+                            function_code)
+            else:
+                return (), self.module_code, module_code
+        if isinstance(site, bytecode.BytecodeSite):
+            return (site.code_path,
+                    bytecode.nested_code(self.module_code, site.code_path),
+                    bytecode.nested_code(
+                            bytecode.mutate(self.module_code, site),
+                            site.code_path))
+        function_mutant = hotpatch.function_mutant(self.code, site,
+                                                   self.filename)
+        if function_mutant:
+            names, function_code = function_mutant
+            return (tuple(names),
+                    hotpatch.find_code(self.module_code, names),
+                    function_code)
+        return ((), self.module_code,
+                compile(mutator.mutate(self.code, site), self.filename,
+                        'exec'))
+
+    def fingerprints(self, site, module_code=None):
+        """Returns the fingerprints of the unit holding the site.
+
+        Args:
+          site: the site of the mutant.
+          module_code: the module code of the mutant when the caller already
+              compiled it, which the unit is taken from instead of compiling
+              it again.
+        Returns:
+          A tuple (key, original, mutant) with the key of the unit and the
+          fingerprints of its original and mutated code, or None if the mutant
+          does not compile.
+        """
+        if site in self.known_fingerprints:
+            return self.known_fingerprints[site]
+        try:
+            key, original_code, mutated_code = self._compile_unit(
+                    site, module_code)
+        except (SyntaxError, TypeError, ValueError):
+            return None
+        if key not in self.original_fingerprints:
+            self.original_fingerprints[key] = fingerprint(original_code)
+        return (key, self.original_fingerprints[key],
+                fingerprint(mutated_code))
+
+    def check(self, site):
+        """Returns the reason to prune the mutant of the site, or None."""
+        fingerprints = self.fingerprints(site)
+        if fingerprints is None:
+            return None
+        key, original_fingerprint, mutant_fingerprint = fingerprints
+        if mutant_fingerprint == original_fingerprint:
+            return EQUIVALENT
+        if (key, mutant_fingerprint) in self.seen:
+            return DUPLICATE
+        self.seen.add((key, mutant_fingerprint))
+        return None
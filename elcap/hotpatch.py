@@ -0,0 +1,139 @@
+import ast
+import types
+
+import mutator
+
+
+def function_mutant(code, site, filename):
+    """Compiles only the function that encloses a mutation site.
+
+    Args:
+      code: the source code of the module.
+      site: the MutationSite to mutate.
+      filename: the filename of the module.
+    Returns:
+      The result of function_code for the mutated tree, or None.
+    """
+    return function_code(mutator.mutate(code, site), site.path, filename)
+
+
+def enclosing_function(tree, path):
+    """Returns the function of the tree whose body contains the path.
+
+    Returns:
+      A tuple (classes, function) with the ClassDef nodes enclosing the
+      function and its FunctionDef node. None is returned when the node is not
+      in the body of a function defined at module or class level.
+    """
+    node = tree
+    classes = []
+    for step, (field, index) in enumerate(path):
+        if field != 'body' or not isinstance(node, (ast.Module, ast.ClassDef)):
+            return None
+        child = node.body[index]
+        if isinstance(child, ast.ClassDef):
+            classes.append(child)
+            node = child
+        elif (isinstance(child, ast.FunctionDef) and
+              step + 1 < len(path) and path[step + 1][0] == 'body'):
+            return classes, child
+        else:
+            return None
+    return None
+
+
+def function_names(tree, path):
+    """Returns the attribute names leading from the module to the function
+    enclosing the path (e.g. ['Class', 'method']), or None."""
+    enclosing = enclosing_function(tree, path)
+    if enclosing is None:
+        return None
+    classes, function = enclosing
+    return [class_node.name for class_node in classes] + [function.name]
+
+
+def function_code(tree, path, filename):
+    """Compiles only the function of the tree that encloses the path.
+
+    Args:
+      tree: the tree of the module.
+      path: the path of a node, as in MutationSite.
+      filename: the filename of the module.
+    Returns:
+      A tuple (names, function_code), where names is the list of attribute
+      names leading from the module to the function (e.g. ['Class', 'method'])
+      and function_code is the code object of the function. None is returned
+      when the node is not in the body of a function defined at module or
+      class level, or when the function does not compile.
+    """
+    enclosing = enclosing_function(tree, path)
+    if enclosing is None:
+        return None
+    classes, function = enclosing
+
+    # The function is compiled inside shells of its classes, so private names
+    # get mangled as in the original module.
+    shell = function
+    for class_node in reversed(classes):
+        shell = ast.copy_location(
+                ast.ClassDef(class_node.name, [], [shell], []), class_node)
+    future_imports = [stmt for stmt in tree.body
+                      if isinstance(stmt, ast.ImportFrom) and
+                         stmt.module == '__future__']
+    names = [class_node.name for class_node in classes] + [function.name]
+    try:
+        module_code = compile(ast.Module(future_imports + [shell]), filename,
+                              'exec')
+    except SyntaxError:
+        return None
+    return names, find_code(module_code, names)
+
+
+def find_code(code_object, names):
+    """Returns the code object nested in code_object through the given names."""
+    for name in names:
+        for const in code_object.co_consts:
+            if isinstance(const, types.CodeType) and const.co_name == name:
+                code_object = const
+                break
+        else:
+            return None
+    return code_object
+
+
+def get_function(module, names):
+    """Returns the function defined in the module under the given names.
+
+    Static and class methods are unwrapped. None is returned when the object
+    is not a plain function, for instance when a decorator replaced it.
+    """
+    obj = module
+    for name in names:
+        obj = getattr(obj, '__dict__', {}).get(name)
+    if isinstance(obj, (staticmethod, classmethod)):
+        obj = obj.__func__
+    if isinstance(obj, types.FunctionType):
+        return obj
+    return None
+
+
+def can_patch(function, function_code):
+    """Returns whether function_code can replace the code of the function.
+
+    The function must have been created from the same definition, which is
+    checked by comparing the name, filename and first line of their code.
+    """
+    if function is None or function_code is None:
+        return False
+    original_code = function.func_code
+    return (original_code.co_name == function_code.co_name and
+            original_code.co_filename == function_code.co_filename and
+            original_code.co_firstlineno == function_code.co_firstlineno and
+            original_code.co_freevars == function_code.co_freevars)
+
+
+def swap_code(function, function_code):
+    """Replaces the code of the function and returns the previous one."""
+    original_code = function.func_code
+    function.func_code = function_code
+    return original_code
@@ -1,3 +1,5 @@
+import __builtin__
+from collections import defaultdict
 import os
 import sys
 import imp
@@ -15,6 +17,7 @@ class ModuleImporter(object):
     def __init__(self):
         self.module_name = None
         self.module_code = None
+        self.module_globals = None
         self.install()
 
     def install(self):
@@ -27,10 +30,22 @@ class ModuleImporter(object):
         if self in sys.meta_path:
             sys.meta_path.remove(self)
 
-    def register(self, module_name, module_code):
-        """Register a module to be loaded with this importer."""
+    def register(self, module_name, module_code, module_globals=None):
+        """Register a module to be loaded with this importer.
+
+        Args:
+          module_name: the full name of the module.
+          module_code: the code object to execute when loading the module.
+          module_globals: optional dict of globals set before executing the
+              code.
+        """
         self.module_name = module_name
         self.module_code = module_code
+        self.module_globals = module_globals
+
+    def unregister(self):
+        """Stops replacing the registered module."""
+        self.register(None, None)
 
     def find_module(self, module_name, path=None):  # pylint: disable=W0613
         """Returns self when the module registered is requested."""
@@ -56,10 +71,100 @@ class ModuleImporter(object):
         package = get_package(module_name, is_package)
         if package:
             mod.__package__ = package
+        if self.module_globals:
+            mod.__dict__.update(self.module_globals)
         exec self.module_code in mod.__dict__  # pylint: disable=W0122
         return mod
 
 
+class ImportGraph(object):
+    """Records which modules import which while it is installed.
+
+    The graph is built by replacing __import__, so it sees every import
+    statement, including the "from module import name" ones that copy values
+    out of the imported module. It is used to unload a module along with the
+    modules that hold references to it, and nothing else.
+    """
+
+    def __init__(self):
+        self.imported_by = defaultdict(set)
+        self.modules = set()
+        self._original_import = None
+
+    def install(self):
+        """Starts recording the imports."""
+        if self._original_import is None:
+            self._original_import = __builtin__.__import__
+            __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        """Stops recording the imports."""
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=None,
+                level=-1):  # pylint: disable=W0622
+        module = self._original_import(name, globals, locals, fromlist, level)
+        importer_name = globals.get('__name__') if globals else None
+        if importer_name:
+            self._record(importer_name, globals, name, fromlist, level)
+        return module
+
+    def _record(self, importer_name, importer_globals, name, fromlist, level):
+        """Adds the edges from the importing module to the imported ones."""
+        package = importer_globals.get('__package__')
+        if package is None:
+            if '__path__' in importer_globals:
+                package = importer_name
+            else:
+                package = importer_name.rpartition('.')[0]
+        candidates = []
+        if level != 0 and package:
+            # Relative imports, implicit ones included, are tried first.
+            base = package.rsplit('.', max(level, 1) - 1)[0]
+            candidates.append('%s.%s' % (base, name) if name else base)
+        if level <= 0:
+            candidates.append(name)
+        for full_name in candidates:
+            if sys.modules.get(full_name) is None:
+                continue
+            parts = full_name.split('.')
+            imported = ['.'.join(parts[:depth])
+                        for depth in range(1, len(parts) + 1)]
+            imported.extend('%s.%s' % (full_name, item)
+                            for item in fromlist or () if item != '*')
+            self.modules.add(importer_name)
+            for imported_name in imported:
+                if (imported_name != importer_name and
+                    sys.modules.get(imported_name) is not None):
+                    self.imported_by[imported_name].add(importer_name)
+                    self.modules.add(imported_name)
+            break
+
+    def dependents(self, module_name):
+        """Returns the module and the loaded modules that import it directly
+        or indirectly, or that are submodules of any of them."""
+        found = set()
+        pending = [module_name]
+        while pending:
+            name = pending.pop()
+            if name in found:
+                continue
+            found.add(name)
+            pending.extend(self.imported_by.get(name, ()))
+            prefix = name + '.'
+            pending.extend(loaded_name
+                           for loaded_name, module in sys.modules.items()
+                           if loaded_name.startswith(prefix) and module)
+        return found
+
+
+def format_exception(error):
+    """Returns the type and message of an exception in a single line."""
+    return ('%s: %s' % (type(error).__name__, error)).strip().rstrip(':')
+
+
 def get_package(module_name, is_package):
     """Returns a string representing the package to which the file belongs."""
     if is_package:
@@ -0,0 +1,121 @@
+import optparse
+import os
+import sys
+from unittest.runner import _WritelnDecorator
+
+import distributed
+import plugins
+import results
+
+
+def merge(filenames, stream, root):
+    """Merges the result files of the shards of a run, and writes the summary
+    of the run and the mutants that survived.
+
+    The mutants run by several shards are counted once, and the shards that
+    are missing or were interrupted are reported.
+
+    Args:
+      filenames: the result files written by the shards.
+      stream: the stream to write to.
+      root: the directory of the checkout to read the mutated sources from.
+    Returns:
+      True if every mutant of the run has a result.
+    """
+    mutants = {}
+    infos = []
+    duplicates = 0
+    for filename in filenames:
+        info, records = results.load_results(filename)
+        infos.append(info)
+        for record in records:
+            if 'root' in info:
+                record['file'] = distributed.relative_name(record['file'],
+                                                           info['root'])
+            key = (record['file'], record['line'], record['mutator'],
+                   record['position'])
+            if key in mutants:
+                duplicates += 1
+            else:
+                mutants[key] = record
+
+    survivors = sorted((key for key, record in mutants.iteritems()
+                        if record['outcome'] == plugins.SURVIVED),
+                       key=lambda key: (key[0], key[1], key[3]))
+    sources = {}
+    for key in survivors:
+        source_filename, line, mutator_name, position = key
+        filename = distributed.absolute_name(source_filename, root)
+        if filename not in sources:
+            sources[filename] = None
+            if os.path.exists(filename):
+                sources[filename] = plugins.get_lines(filename)
+        message = 'Mutation survived at %s:%d (%s) using mutator %s:' % (
+                filename, line, position, mutator_name)
+        if sources[filename] is not None:
+            message += '\n\t%s' % sources[filename][line - 1].strip()
+        stream.writeln('\n' + message)
+
+    kills = {}
+    for record in mutants.itervalues():
+        kills[record['outcome']] = kills.get(record['outcome'], 0) + 1
+    stream.writeln('-' * 70)
+    plugins.write_summary(
+            stream, len(mutants), len(survivors),
+            max([info.get('files', 0) for info in infos] + [0]),
+            max([info.get('elapsed', 0.0) for info in infos] + [0.0]),
+            kills, ([info['pruned'] for info in infos if 'pruned' in info] or
+                    [{}])[0])
+
+    complete = True
+    if duplicates:
+        stream.writeln('Warning: %d mutations were run by several shards' %
+                       duplicates)
+    shards = set(info['shards'] for info in infos if 'shards' in info)
+    for count in sorted(shards):
+        missing = (set(range(1, count + 1)) -
+                   set(info['shard'] for info in infos
+                       if info.get('shards') == count))
+        if missing:
+            complete = False
+            stream.writeln('Warning: missing shards %s of %d' % (
+                    ', '.join(str(shard) for shard in sorted(missing)),
+                    count))
+    interrupted = len([info for info in infos if 'elapsed' not in info])
+    if interrupted:
+        complete = False
+        stream.writeln('Warning: %d of the runs were interrupted' %
+                       interrupted)
+    total = max([info.get('mutations', 0) for info in infos] + [0])
+    if len(mutants) < total:
+        complete = False
+        stream.writeln('Warning: %d of the %d mutations have no result' %
+                       (total - len(mutants), total))
+    return complete
+
+
+def main(argv=None):
+    """Merges the result files given on the command line.
+
+    Returns:
+      The exit status: 0 if every mutant of the run has a result.
+    """
+    parser = optparse.OptionParser(
+            usage='%prog [options] RESULTS_FILE...',
+            description='Merge the results of the shards of a mutation run, '
+                        'written by --mutations-shard or '
+                        '--mutations-results.')
+    parser.add_option('--root', action='store', default='.',
+                      help='Directory of the checkout the mutated sources '
+                           'are read from (default: the current directory).')
+    options, filenames = parser.parse_args(argv)
+    if not filenames:
+        parser.error('no results file given')
+    if merge(filenames, _WritelnDecorator(sys.stdout),
+             os.path.abspath(options.root)):
+        return 0
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,12 +2,77 @@
 # pylint: disable=C0103,R0201
 
 import ast
+from collections import defaultdict
+from collections import namedtuple
 import importlib
 import inspect
 
+# Name of the module global holding the id of the active mutant of a schema.
+ACTIVE_MUTANT = '__elcap_mutant__'
+
+
+# Outcome of the relational operators, and of the conditions replaced by a
+# constant, when the left operand is lower than, equal to and greater than the
+# right one.
+RELATIONAL_OUTCOMES = {ast.Lt: (True, False, False),
+                       ast.LtE: (True, True, False),
+                       ast.Eq: (False, True, False),
+                       ast.NotEq: (True, False, True),
+                       ast.Gt: (False, False, True),
+                       ast.GtE: (False, True, True),
+                       'True': (True, True, True),
+                       'False': (False, False, False)}
+
+# Outcome of the bitwise operators for each pair of bits, which also holds for
+# the elements of sets.
+BITWISE_OUTCOMES = {ast.BitAnd: (0, 0, 0, 1),
+                    ast.BitOr: (0, 1, 1, 1),
+                    ast.BitXor: (0, 1, 1, 0)}
+
+
+def subsumption_table(outcomes):
+    """Derives the subsumption relations of a family of operators.
+
+    A mutant is only killed by the inputs on which its outcome differs from
+    the original one. When those inputs include all the inputs killing
+    another mutant, killing the other mutant also kills it.
+
+    Args:
+      outcomes: mapping from each operator to its outcomes on the same inputs.
+    Returns:
+      A mapping from each original operator to a mapping from a replacement to
+      the set of replacements subsuming it.
+    """
+    def differences(original, replacement):
+        return set(index for index, (a, b) in
+                   enumerate(zip(outcomes[original], outcomes[replacement]))
+                   if a != b)
+
+    table = {}
+    for original in outcomes:
+        if isinstance(original, str):
+            continue
+        table[original] = {}
+        for replacement in outcomes:
+            killing_inputs = differences(original, replacement)
+            table[original][replacement] = set(
+                    other for other in outcomes
+                    if other not in (original, replacement) and
+                       differences(original, other) < killing_inputs)
+    return table
+
 
 class BaseMutator(ast.NodeTransformer):
-    """Base class for all user defined mutators."""
+    """Base class for all user defined mutators.
+
+    The visit_ methods must return a new node instead of modifying the given
+    one, as they are also used to find out which nodes can be mutated.
+
+    Mutators replacing an operator may declare in subsumption, as returned by
+    subsumption_table, which of their replacements are subsumed by others.
+    Their mutants are dropped when a subsuming mutant of the same node exists.
+    """
+    subsumption = {}
 
 
 #TODO: improve LineMutator to also allows entities in which we look for the
@@ -36,6 +101,7 @@ class ArithmeticMutator(BaseMutator):
                ast.BitOr: ast.BitAnd,
                ast.BitXor: ast.BitAnd,
                ast.Pow: ast.Mult}
+    subsumption = subsumption_table(BITWISE_OUTCOMES)
 
     def visit_BinOp(self, node):
         return ast.BinOp(node.left, self.mapping[type(node.op)](), node.right)
@@ -52,6 +118,7 @@ class ComparisonMutator(BaseMutator):
                ast.NotIn: ast.In,
                ast.Is: ast.IsNot,
                ast.IsNot: ast.Is}
+    subsumption = subsumption_table(RELATIONAL_OUTCOMES)
 
     def visit_Compare(self, node):
         return ast.Compare(node.left,
@@ -92,63 +159,289 @@ class BooleanMutator(BaseMutator):
         return node
 
 
-class LineMutator(ast.NodeTransformer):
+class MutationSite(namedtuple('MutationSite',
+                               'line col_offset path mutator position')):
+    """A node of a module that a mutator is able to modify.
+
+    Attributes:
+      line: line number of the node.
+      col_offset: column offset of the node.
+      path: tuple of (field, index) pairs leading from the module to the node.
+          index is None when the field holds a single node.
+      mutator: the mutator class that modifies the node.
+      position: ordinal of the node among all the nodes the mutator visits.
+    """
+    __slots__ = ()
+
+
+def walk(node, path=()):
+    """Yields the (path, node) pairs of a tree in the order NodeVisitor uses."""
+    yield path, node
+    for field, value in ast.iter_fields(node):
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                if isinstance(item, ast.AST):
+                    for child in walk(item, path + ((field, index),)):
+                        yield child
+        elif isinstance(value, ast.AST):
+            for child in walk(value, path + ((field, None),)):
+                yield child
+
+
+def index_sites(mutators, tree):
+    """Returns the MutationSites of the tree for the given mutator instances.
+
+    The tree is traversed only once. Each node is dispatched to the visit_
+    methods of all the mutators handling its type, so the sites are ordered by
+    their position in the tree and then by the order of the mutators.
+    """
+    dispatch_table = defaultdict(list)
+    for index, mutator in enumerate(mutators):
+        for name in dir(mutator):
+            if name.startswith('visit_'):
+                dispatch_table[name[len('visit_'):]].append(
+                        (index, getattr(mutator, name)))
+    sites = []
+    positions = [0] * len(mutators)
+    line, col_offset = 0, 0
+    for path, node in walk(tree):
+        # Nodes without location inherit the one of the previous node.
+        line = getattr(node, 'lineno', line)
+        col_offset = getattr(node, 'col_offset', col_offset)
+        for index, visitor in dispatch_table.get(node.__class__.__name__, ()):
+            positions[index] += 1
+            if visitor(node) is not node:
+                sites.append(MutationSite(line, col_offset, path,
+                                          mutators[index].__class__,
+                                          positions[index]))
+    return sites
+
+
+def get_node(tree, path):
+    """Returns the parent, the field and the index of the node at path."""
+    parent = tree
+    for field, index in path[:-1]:
+        parent = getattr(parent, field)
+        if index is not None:
+            parent = parent[index]
+    field, index = path[-1]
+    return parent, field, index
+
+
+def mutate_node(node, site):
+    """Returns the node modified by the mutator of the site."""
+    return ast.copy_location(site.mutator().visit(node), node)
+
+
+def mutate(code, site):
+    """Returns a new tree of the code with the mutation of site applied.
+
+    The nodes created by the mutator get the location of their parent, so
+    that the tree compiles whatever the mutator sets.
+    """
+    tree = ast.parse(code)
+    parent, field, index = get_node(tree, site.path)
+    node = getattr(parent, field)
+    if index is not None:
+        node = node[index]
+    modified_node = mutate_node(node, site)
+    if index is None:
+        setattr(parent, field, modified_node)
+    else:
+        getattr(parent, field)[index] = modified_node
+    return ast.fix_missing_locations(tree)
+
+
+def mutation_operators(node, modified_node):
+    """Returns the original and the replacement operator of a mutation.
+
+    Conditions replaced by True or False have the name of the constant as
+    replacement. None is returned when the mutation does anything else than
+    replacing the operator of the node.
+    """
+    if isinstance(node, (ast.BinOp, ast.BoolOp, ast.UnaryOp)):
+        original = type(node.op)
+    elif isinstance(node, ast.Compare) and len(node.ops) == 1:
+        original = type(node.ops[0])
+    else:
+        return None
+    if (isinstance(modified_node, ast.Name) and
+        modified_node.id in ('True', 'False')):
+        return original, modified_node.id
+    if type(modified_node) is not type(node):
+        return None
+    if isinstance(node, ast.Compare):
+        if (len(modified_node.ops) != 1 or
+            modified_node.left is not node.left or
+            modified_node.comparators != node.comparators):
+            return None
+        return original, type(modified_node.ops[0])
+    operands = [value for field, value in ast.iter_fields(node)
+                if field != 'op']
+    modified_operands = [value for field, value
+                         in ast.iter_fields(modified_node) if field != 'op']
+    if any(a is not b for a, b in zip(operands, modified_operands)):
+        return None
+    return original, type(modified_node.op)
+
+
+def remove_subsumed(code, sites):
+    """Returns the sites whose mutants are not subsumed by another one.
+
+    A mutant is subsumed when the subsumption of its mutator states that
+    another replacement of the operator of the node, made by any of the
+    sites, is killed by a subset of the inputs killing it.
+    """
+    tree = ast.parse(code)
+    sites_by_path = defaultdict(list)
+    for site in sites:
+        sites_by_path[site.path].append(site)
+    subsumed = set()
+    for path, path_sites in sites_by_path.iteritems():
+        if len(path_sites) < 2:
+            continue
+        parent, field, index = get_node(tree, path)
+        node = getattr(parent, field)
+        if index is not None:
+            node = node[index]
+        operators = {}
+        for site in path_sites:
+            operators[site] = mutation_operators(node,
+                                                 site.mutator().visit(node))
+        replacements = set(operator[1] for operator in operators.itervalues()
+                           if operator)
+        for site, operator in operators.iteritems():
+            if not operator:
+                continue
+            original, replacement = operator
+            subsuming = site.mutator.subsumption.get(original, {}).get(
+                    replacement, ())
+            if replacements.intersection(subsuming):
+                subsumed.add(site)
+    return [site for site in sites if site not in subsumed]
+
+
+class LineMutator(object):
+    """Iterates over the mutations a mutator performs on the code.
+
+    Yields tuples (line_no, position, mutated_tree).
+    """
     def __init__(self, mutator, code):
-        super(LineMutator, self).__init__()
-        self.line = 0
-        self.mutator = mutator
         self.code = code.strip()
-        self.found = False
-        self.counter = 1
-        self.current_counter = 0
-        self.add_methods()
-        self.finished = True
-
-    def add_methods(self):
-        visit_methods = [getattr(self.mutator, m)
-                         for m in dir(self.mutator) if m.startswith('visit_')]
-        for visit_method in visit_methods:
-            def visit_helper(node):
-                self.current_counter += 1
-                if self.current_counter == self.counter:
-                    self.finished = False
-                    modified_node = visit_method(node)
-                    if modified_node != node:
-                        self.found = True
-                        if hasattr(node, 'lineno'):
-                            self.line = node.lineno
-                            modified_node.lineno = node.lineno
-                            modified_node.col_offset = node.col_offset
-                    return modified_node
-                return node
-            setattr(self, visit_method.__name__, visit_helper)
+        self.sites = iter(index_sites([mutator], ast.parse(self.code)))
 
     def __iter__(self):
         return self
 
     def next(self):
-        self.found = False
-        self.finished = True
-        self.current_counter = 0
-        node = self.visit(ast.parse(self.code))
-        if self.found:
-            self.counter += 1
-            return self.line, self.counter - 1, node
-        elif not self.finished:
-            self.counter += 1
-            return self.next()
-        else:
-            raise StopIteration
+        site = next(self.sites)
+        return site.line, site.position, mutate(self.code, site)
 
 
-def code_mutator(mutator_classes, code, line_filter):
+def mutation_sites(mutator_classes, code, line_filter):
+    """Returns the MutationSites of the code whose lines pass the filter.
+
+    The code is parsed and traversed once for all the mutator classes.
+    """
     # FIXME: it should probably a generic line split. The source code could have
     # a different line separator than '\n'.
     code_lines = code.split('\n')
-    for mutator_class in mutator_classes:
-        for line_no, pos, m_node in LineMutator(mutator_class(), code):
-            if line_filter(code_lines[line_no - 1], line_no):
-                yield line_no, pos, m_node, mutator_class.__name__
+    mutators = [mutator_class() for mutator_class in mutator_classes]
+    return [site for site in index_sites(mutators, ast.parse(code))
+            if line_filter(code_lines[site.line - 1], site.line)]
+
+
+def code_mutator(mutator_classes, code, line_filter):
+    """Yields the mutations of the code whose lines are accepted by the filter.
+
+    The filter is applied to the index of MutationSites, so mutated trees are
+    only built for the accepted sites.
+    """
+    for site in mutation_sites(mutator_classes, code, line_filter):
+        yield (site.line, site.position, mutate(code, site),
+               site.mutator.__name__)
+
+
+class MutantSchema(namedtuple('MutantSchema', 'tree ids on_call')):
+    """A module in which every mutation is guarded by a switch.
+
+    Attributes:
+      tree: the rewritten tree of the module.
+      ids: mapping from each switchable MutationSite to its mutant id.
+      on_call: set of mutant ids whose code only runs when a function is
+          called, hence they can be switched without reimporting the module.
+    """
+    __slots__ = ()
+
+
+def build_schema(code, sites):
+    """Rewrites the code so every site is a branch on the active mutant id.
+
+    The mutation of a site is only executed when the module global
+    ACTIVE_MUTANT holds the id of the site, so a single compiled module
+    contains all the mutants. Sites that cannot be expressed as a branch, like
+    docstrings or yield statements turned into returns, get no id.
+    """
+    tree = ast.parse(code)
+    docstrings = set(
+            path + (('body', 0), ('value', None)) for path, node in walk(tree)
+            if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef))
+            and node.body and isinstance(node.body[0], ast.Expr)
+            and isinstance(node.body[0].value, ast.Str))
+    sites_by_path = defaultdict(list)
+    for mutant_id, site in enumerate(sites, 1):
+        sites_by_path[site.path].append((mutant_id, site))
+    ids = {}
+    on_call = set()
+
+    def rebuild(node, path, in_function):
+        for field, value in ast.iter_fields(node):
+            child_in_function = in_function or (
+                    field == 'body' and
+                    isinstance(node, (ast.FunctionDef, ast.Lambda)))
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    if isinstance(item, ast.AST):
+                        value[index] = rebuild(item, path + ((field, index),),
+                                               child_in_function)
+            elif isinstance(value, ast.AST):
+                setattr(node, field, rebuild(value, path + ((field, None),),
+                                             child_in_function))
+        guarded_node = node
+        for mutant_id, site in reversed(sites_by_path.get(path, [])):
+            modified_node = mutate_node(node, site)
+            if (path in docstrings or
+                not is_switchable(node, modified_node)):
+                continue
+            guarded_node = guard(mutant_id, modified_node, guarded_node)
+            ids[site] = mutant_id
+            if in_function:
+                on_call.add(mutant_id)
+        return guarded_node
+
+    tree = ast.fix_missing_locations(rebuild(tree, (), False))
+    return MutantSchema(tree, ids, on_call)
+
+
+def is_switchable(node, modified_node):
+    """Returns whether the node and its mutation can be placed in a branch."""
+    if isinstance(node, ast.expr):
+        return (isinstance(modified_node, ast.expr) and
+                isinstance(getattr(node, 'ctx', ast.Load()), ast.Load))
+    # A return with a value is not allowed in the generator that the original
+    # yield defines.
+    return (isinstance(node, ast.stmt) and
+            isinstance(modified_node, ast.stmt) and
+            not isinstance(modified_node, ast.Return))
+
+
+def guard(mutant_id, modified_node, node):
+    """Returns a node running modified_node only when mutant_id is active."""
+    test = ast.Compare(ast.Name(ACTIVE_MUTANT, ast.Load()), [ast.Eq()],
+                       [ast.Num(mutant_id)])
+    if isinstance(node, ast.stmt):
+        return ast.copy_location(ast.If(test, [modified_node], [node]), node)
+    return ast.copy_location(ast.IfExp(test, modified_node, node), node)
 
 
 def discover(modules=None, class_names=None):
@@ -1,27 +1,95 @@
+import ast
+from collections import defaultdict
+from collections import OrderedDict
+import cPickle as pickle
+import functools
+import gc
+import importlib
+import multiprocessing
+import optparse
 import os
+import random
 import re
+import select
+import signal
+import socket
 import sys
 import thread
 import threading
 import time
+import traceback
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 from nose.plugins import Plugin
 from nose.core import TextTestRunner
 from nose.selector import Selector
 import nose.core
+import nose.importer
+import nose.loader
 
 import mutator
 import importer
+import budget
+import bytecode
 import coverage_plugin
+import distributed
+import equivalence
+import hotpatch
+import render
+import results
+import sampling
+import store
+import suite
+
+# Outcomes of running a mutant.
+SURVIVED = 'survived'
+KILLED = 'killed'
+IMPORT_ERROR = 'import error'
+CRASHED = 'crashed'
+TIMEOUT = 'timeout'
+HANG = 'hang'
+OUT_OF_MEMORY = 'out of memory'
+
+# The outcomes killing a mutant other than a failing test, and their summary.
+KILL_SUMMARIES = [(IMPORT_ERROR, 'killed on import without running the tests'),
+                  (CRASHED, 'killed the process running them'),
+                  (TIMEOUT, 'timed out'),
+                  (HANG, 'hung, exceeding a loop or recursion budget'),
+                  (OUT_OF_MEMORY, 'ran out of memory')]
+
+# Seconds a process running a mutant is given to exit after SIGTERM, before
+# it is sent SIGKILL.
+KILL_GRACE = 1.0
+
+# Mutants queued for each worker ahead of the ones it runs, so the mutants are
+# handed out as the results come back.
+QUEUE_DEPTH = 2
+
+MEGABYTE = 1024 * 1024
 
 
 class Quiet(Plugin):
-    """Allows to run the tests and discard all the output."""
+    """Allows to run the tests and discard all the output.
+
+    The results are recorded in a KillResult, which only keeps the test
+    killing the mutant.
+    """
+    result = None
 
     def configure(self, options, conf):
         Plugin.configure(self, options, conf)
         self.enabled = True
 
+    def begin(self):
+        self.result = suite.KillResult()
+
+    def prepareTestResult(self, result):  # pylint: disable=C0103,W0613
+        return self.result
+
     def setOutputStream(self, stream):  # pylint: disable=C0103,W0613,R0201
         return NullStream()
 
@@ -74,6 +142,177 @@ class Mutations(Plugin):
                                'Example: BooleanMutator,NumberMutator. An '
                                'empty list implies all Mutators in the defined '
                                'modules will be used.')
+        parser.add_option('--mutations-schemata', action='store_true',
+                          default=False,
+                          dest='mutations_schemata',
+                          help='Compile each source file once with all its '
+                               'mutants behind a runtime switch, instead of '
+                               'compiling and importing every mutant.')
+        parser.add_option('--mutations-engine', action='store',
+                          type='choice', choices=['ast', 'bytecode'],
+                          default='ast',
+                          dest='mutations_engine',
+                          help='Engine used to create the mutants: ast '
+                               'rewrites and compiles the source of each '
+                               'mutant, bytecode modifies the compiled code '
+                               'and only supports the built-in mutators, '
+                               'except FlowMutator and YieldMutator. The '
+                               'and/or of conditions, which the bytecode '
+                               'merges with the test, are mutated on the ast '
+                               '(default: ast).')
+        parser.add_option('--mutations-keep-equivalent', action='store_true',
+                          default=False,
+                          dest='mutations_keep_equivalent',
+                          help='Run the mutants that compile to the same code '
+                               'as the original or as another mutant, '
+                               'instead of pruning them.')
+        parser.add_option('--mutations-keep-subsumed', action='store_true',
+                          default=False,
+                          dest='mutations_keep_subsumed',
+                          help='Run the operator mutants that are killed '
+                               'whenever another mutant of the same node is, '
+                               'instead of pruning them.')
+        parser.add_option('--mutations-sample', action='callback',
+                          type='string', default=(None, None),
+                          callback=parse_callback(sampling.parse_sample),
+                          dest='mutations_sample',
+                          help='Run only a random sample of the mutations, '
+                               'given as a fraction (e.g. 0.1) or as a number '
+                               'of mutations (e.g. 500). The sample is '
+                               'stratified by mutator.')
+        parser.add_option('--mutations-max-per-line', action='store',
+                          type='int', default=None,
+                          dest='mutations_max_per_line',
+                          help='Maximum number of mutations run for each '
+                               'line, chosen at random.')
+        parser.add_option('--mutations-seed', action='store',
+                          type='int', default=0,
+                          dest='mutations_seed',
+                          help='Seed of the random choices of the sample '
+                               '(default: 0).')
+        parser.add_option('--mutations-precision', action='store',
+                          type='float', default=None,
+                          dest='mutations_precision',
+                          help='Run the mutations in random order and stop '
+                               'as soon as the mutation score is known within '
+                               'this margin, e.g. 0.02 for +/- 2%.')
+        parser.add_option('--mutations-confidence', action='store',
+                          type='float', default=0.95,
+                          dest='mutations_confidence',
+                          help='Confidence level of the margin of '
+                               '--mutations-precision (default: 0.95).')
+        parser.add_option('--mutations-shard', action='callback',
+                          type='string', default=None,
+                          callback=parse_callback(sampling.parse_shard),
+                          dest='mutations_shard',
+                          help='Run only the shard I of N of the mutations, '
+                               'given as I/N, and write its results to '
+                               'mutations-shard-I-of-N.jsonl unless '
+                               '--mutations-results is given. The shards '
+                               'run about the same number of tests, and '
+                               'their results are merged with elcap-merge.')
+        parser.add_option('--mutations-store', action='store',
+                          default=None,
+                          dest='mutations_store',
+                          help='Directory where the compiled mutants are '
+                               'kept between runs (default: .elcap in the '
+                               'mutations path).')
+        parser.add_option('--mutations-no-store', action='store_true',
+                          default=False,
+                          dest='mutations_no_store',
+                          help='Compile the mutants on demand instead of '
+                               'compiling them in advance in the store.')
+        parser.add_option('--mutations-processes', action='store',
+                          type='int', default=default_processes(),
+                          dest='mutations_processes',
+                          help='Number of processes running the mutants '
+                               '(default: the number of CPUs).')
+        parser.add_option('--mutations-timing-runs', action='store',
+                          type='int', default=0,
+                          dest='mutations_timing_runs',
+                          help='Time each test this many times without '
+                               'coverage before running the mutations, and '
+                               'base their time limits on the median and '
+                               'spread of these durations instead of the '
+                               'durations measured with coverage (default: '
+                               '0).')
+        parser.add_option('--mutations-timeout-multiplier', action='store',
+                          type='float', default=3.0,
+                          dest='mutations_timeout_multiplier',
+                          help='Times the expected duration of the tests '
+                               'covering a mutation they are allowed to run '
+                               '(default: 3.0).')
+        parser.add_option('--mutations-timeout-floor', action='store',
+                          type='float', default=1.0,
+                          dest='mutations_timeout_floor',
+                          help='Minimum time limit of every mutation, in '
+                               'seconds (default: 1.0).')
+        parser.add_option('--mutations-budgets', action='store_true',
+                          default=False,
+                          dest='mutations_budgets',
+                          help='Count the iterations of the loops of the '
+                               'mutated functions, and lower the recursion '
+                               'limit to twice the depth the original tests '
+                               'reach, so the mutants that hang are killed '
+                               'without waiting for their time limit.')
+        parser.add_option('--mutations-loop-budget', action='store',
+                          type='int', default=1000000,
+                          dest='mutations_loop_budget',
+                          help='Iterations a loop of a mutated function may '
+                               'run with --mutations-budgets (default: '
+                               '1000000).')
+        parser.add_option('--mutations-memory-limit', action='store',
+                          type='int', default=0,
+                          dest='mutations_memory_limit',
+                          help='Megabytes of address space each mutant may '
+                               'allocate, on Linux, when it runs in a '
+                               'separate process. A mutant exceeding them '
+                               'gets a MemoryError (default: 0, no limit).')
+        parser.add_option('--mutations-recycle-after', action='store',
+                          type='int', default=0,
+                          dest='mutations_recycle_after',
+                          help='Replace each process running the mutants '
+                               'after this many mutants (default: 0, '
+                               'never).')
+        parser.add_option('--mutations-recycle-rss', action='store',
+                          type='int', default=0,
+                          dest='mutations_recycle_rss',
+                          help='Replace a process running the mutants once '
+                               'its resident memory exceeds these megabytes, '
+                               'on Linux (default: 0, never).')
+        parser.add_option('--mutations-results', action='store',
+                          dest='mutations_results', metavar='FILE',
+                          help='Write the result of each mutation to FILE, as '
+                               'a JSON line, as soon as it is known.')
+        parser.add_option('--mutations-serve', action='store',
+                          dest='mutations_serve', metavar='HOST:PORT',
+                          help='Run the original tests, and serve the '
+                               'mutations to the workers started with '
+                               '--mutations-worker instead of running them.')
+        parser.add_option('--mutations-worker', action='store',
+                          dest='mutations_worker', metavar='HOST:PORT',
+                          help='Run the mutations served by the coordinator '
+                               'at this address against this checkout, '
+                               'instead of running the tests.')
+        parser.add_option('--mutations-fork', action='store_true',
+                          default=False,
+                          dest='mutations_fork',
+                          help='Import each source file and its tests once, '
+                               'and run every mutant in a child process '
+                               'forked from the process holding them.')
+        parser.add_option('--mutations-unload-all', action='store_true',
+                          default=False,
+                          dest='mutations_unload_all',
+                          help='Unload all the modules imported by the tests '
+                               'before importing a module, instead of only '
+                               'the mutated module and the modules importing '
+                               'it.')
+        parser.add_option('--mutations-reimport', action='store_true',
+                          default=False,
+                          dest='mutations_reimport',
+                          help='Reimport the whole module for every mutant, '
+                               'instead of replacing the code of the mutated '
+                               'function on the loaded module.')
 
     def configure(self, options, config):
         Plugin.configure(self, options, config)
@@ -88,19 +327,81 @@ class Mutations(Plugin):
         self.mutators = options.mutators
         if self.mutators:
             self.mutators.split(',')
+        self.schemata = options.mutations_schemata
+        self.hotpatch = not options.mutations_reimport
+        self.unload_all = options.mutations_unload_all
+        self.engine = options.mutations_engine
+        self.processes = max(options.mutations_processes, 1)
+        self.fork = options.mutations_fork and hasattr(os, 'fork')
+        self.timing_runs = options.mutations_timing_runs
+        self.timeout_multiplier = options.mutations_timeout_multiplier
+        self.timeout_floor = options.mutations_timeout_floor
+        self.budgets = options.mutations_budgets
+        self.loop_budget = options.mutations_loop_budget
+        self.memory_limit = options.mutations_memory_limit
+        self.recycle_after = options.mutations_recycle_after
+        self.recycle_rss = options.mutations_recycle_rss
+        self.results_filename = options.mutations_results
+        self.serve_address = options.mutations_serve
+        self.worker_address = options.mutations_worker
+        self.store_directory = None
+        if not options.mutations_no_store:
+            self.store_directory = (
+                    options.mutations_store or
+                    os.path.join(self.mutations_path, '.elcap'))
+        self.prune = not options.mutations_keep_equivalent
+        self.prune_subsumed = not options.mutations_keep_subsumed
+        self.seed = options.mutations_seed
+        self.precision = options.mutations_precision
+        self.confidence = options.mutations_confidence
+        self.shard = options.mutations_shard
+        self.sampler = None
+        fraction, count = options.mutations_sample
+        if fraction or count or options.mutations_max_per_line:
+            self.sampler = sampling.MutantSampler(
+                    fraction=fraction, count=count,
+                    max_per_line=options.mutations_max_per_line,
+                    seed=options.mutations_seed)
         self.failfast = config.stopOnError
         self.base_modules = sys.modules.keys()
         self.test_selector = Selector(config)
 
     def prepareTestRunner(self, runner):  # pylint: disable=C0103
         return MutationRunner(
-                stream=runner.stream, failfast=self.failfast,
+                stream=runner.stream, verbosity=runner.verbosity,
+                config=runner.config,
+                failfast=self.failfast,
                 base_modules=self.base_modules,
                 mutations_path=self.mutations_path,
                 mutations_exclude=self.mutations_exclude,
                 mutations_exclude_lines=self.mutations_exclude_lines,
                 mutators_modules=self.mutators_modules,
                 mutators=self.mutators,
+                schemata=self.schemata,
+                hotpatch=self.hotpatch,
+                unload_all=self.unload_all,
+                engine=self.engine,
+                processes=self.processes,
+                fork=self.fork,
+                timing_runs=self.timing_runs,
+                timeout_multiplier=self.timeout_multiplier,
+                timeout_floor=self.timeout_floor,
+                budgets=self.budgets,
+                loop_budget=self.loop_budget,
+                memory_limit=self.memory_limit,
+                recycle_after=self.recycle_after,
+                recycle_rss=self.recycle_rss,
+                results_filename=self.results_filename,
+                serve_address=self.serve_address,
+                worker_address=self.worker_address,
+                store_directory=self.store_directory,
+                prune=self.prune,
+                prune_subsumed=self.prune_subsumed,
+                sampler=self.sampler,
+                seed=self.seed,
+                precision=self.precision,
+                confidence=self.confidence,
+                shard=self.shard,
                 test_selector=self.test_selector)
 
 
@@ -113,6 +414,52 @@ class MutationRunner(TextTestRunner):
                                                   None)
         self.mutators_modules = kwargs.pop('mutators_modules', [])
         self.mutators = kwargs.pop('mutators', None)
+        self.schemata = kwargs.pop('schemata', False)
+        self.hotpatch = kwargs.pop('hotpatch', True)
+        self.unload_all = kwargs.pop('unload_all', False)
+        self.import_graph = None
+        self.test_index = None
+        self.prioritizer = suite.TestPrioritizer({})
+        self.trees = {}
+        self.engine = kwargs.pop('engine', 'ast')
+        self.processes = kwargs.pop('processes', 1)
+        self.fork = kwargs.pop('fork', False)
+        self.supervised = False
+        self.timing_runs = kwargs.pop('timing_runs', 0)
+        self.timings = None
+        self.timeout_multiplier = kwargs.pop('timeout_multiplier', 3.0)
+        self.timeout_floor = kwargs.pop('timeout_floor', 1.0)
+        self.load_factor = 1.0
+        self.budgets = kwargs.pop('budgets', False)
+        self.loop_budget = kwargs.pop('loop_budget', 1000000)
+        self.budget = None
+        self.memory_limit = kwargs.pop('memory_limit', 0)
+        self.recycle_after = kwargs.pop('recycle_after', 0)
+        self.recycle_rss = kwargs.pop('recycle_rss', 0)
+        self.results_filename = kwargs.pop('results_filename', None)
+        # Objects with add(source_filename, site, outcome, detail) and close()
+        # methods, given each result as soon as it is recorded.
+        self.sinks = []
+        self.serve_address = kwargs.pop('serve_address', None)
+        self.worker_address = kwargs.pop('worker_address', None)
+        # Time limits imposed on some mutants, by (filename, site).
+        self.time_limits = {}
+        self.store_directory = kwargs.pop('store_directory', None)
+        self.stored = {}
+        self.renderers = {}
+        self.prune = kwargs.pop('prune', True)
+        self.prune_subsumed = kwargs.pop('prune_subsumed', True)
+        self.sampler = kwargs.pop('sampler', None)
+        self.seed = kwargs.pop('seed', 0)
+        self.precision = kwargs.pop('precision', None)
+        self.confidence = kwargs.pop('confidence', 0.95)
+        self.estimator = None
+        # The results of the mutants drawn after one without result yet,
+        # by index, and the index of the next mutant the estimator takes.
+        self.unestimated = {}
+        self.estimated = 0
+        # The (shard, shards) pair of the mutants to run, or None for all.
+        self.shard = kwargs.pop('shard', None)
         self.test_selector = kwargs.pop('test_selector', None)
         self.base_modules = kwargs.pop('base_modules', [])
         super(MutationRunner, self).__init__(**kwargs)
@@ -120,6 +467,25 @@ class MutationRunner(TextTestRunner):
         #nose.core.TextTestRunner hides some fields of unittest.TextTestRunner
         self.failfast = failfast
 
+    def _reset_results(self):
+        """Clears the totals and the results of the mutants."""
+        self.total_mutations = 0
+        self.total_mutations_alive = 0
+        self.total_pruned = {equivalence.EQUIVALENT: 0,
+                             equivalence.DUPLICATE: 0,
+                             equivalence.SUBSUMED: 0}
+        self.sampled = defaultdict(int)
+        self.killed = defaultdict(int)
+        self.kill_details = defaultdict(list)
+
+    def _make_loader(self):
+        """Returns a MutantLoader with a new ModuleImporter."""
+        return MutantLoader(importer.ModuleImporter(), self.base_modules,
+                            schemata=self.schemata, hotpatch=self.hotpatch,
+                            engine=self.engine,
+                            import_graph=self.import_graph,
+                            budgets=self.budgets)
+
     def want_mutation(self, filename):
         # FIXME?: I don't like much checking if the file exists and
         # get_source_mapping is already checking that.
@@ -131,70 +497,809 @@ class MutationRunner(TextTestRunner):
                not (self.mutations_exclude and
                     self.mutations_exclude.search(filename)))
 
-    def _run_mutated_tests(self, source_filename, test_coverage, args):
-        self.stream.write('%s: ' % source_filename)
-        with open(source_filename) as fd:
-            code = fd.read()
-        code_lines = code.split('\n')
-        #code_lines = get_lines(source_filename)
-        #code = '\n'.join(code_lines)
-        quiet = Quiet()
+    def _prune(self, code, source_filename, sites):
+        """Removes the equivalent and duplicated mutants from sites."""
+        known_fingerprints = None
+        if source_filename in self.stored:
+            known_fingerprints = self.stored[source_filename].fingerprints()
+        pruner = equivalence.MutantPruner(code, source_filename,
+                                          known_fingerprints)
+        kept_sites = []
+        for site in sites:
+            reason = pruner.check(site)
+            if reason:
+                self.total_pruned[reason] += 1
+            else:
+                kept_sites.append(site)
+        return kept_sites
 
+    def _mutation_sites(self, source_filename, code, test_coverage):
+        """Returns the sites of the source file that will be mutated."""
         def line_filter(line, line_no):
             return (len(test_coverage.coverage_info[source_filename][line_no]) != 0
                    and not self.mutations_exclude_lines.search(line))
 
-        #TODO: add a way to specify custom mutators.
-        print self.mutators_modules, self.mutators
-        mutators = mutator.discover(self.mutators_modules, self.mutators)
-        for line_no, pos, m_node, mutator_name  in mutator.code_mutator(
-                mutators, code, line_filter):
-            self.total_mutations += 1
-            unload_modules(exclude=self.base_modules)
-
-            self.module_importer.register(
-                    self.module_source_mapping[source_filename],
-                    compile(m_node, source_filename, 'exec'))
-
-            tests_set = test_coverage.coverage_info[source_filename][line_no]
-            total_time = get_total_time(tests_set, test_coverage.time_info)
-            time_multiplier = 3.0
-            # TODO: return another default object to be able to catch it.
-            success = timeout(1 + total_time * time_multiplier,
-                              False,
-                              nose.core.run,
-                              defaultTest=','.join(tests_set),
-                              argv=args + ['-x'],
-                              addplugins=[quiet])
-
-            if success:
+        if self.engine == 'bytecode':
+            sites = bytecode.mutation_sites(self.mutator_classes, code,
+                                            source_filename, line_filter)
+            ast_sites = len([site for site in sites
+                             if isinstance(site, mutator.MutationSite)])
+            if ast_sites:
+                self.stream.writeln(
+                        'Warning: %d and/or mutations of %s are not located '
+                        'in the bytecode, running them on the AST.' %
+                        (ast_sites, source_filename))
+        else:
+            sites = mutator.mutation_sites(self.mutator_classes, code,
+                                           line_filter)
+        if self.prune:
+            sites = self._prune(code, source_filename, sites)
+        if self.prune_subsumed and self.engine != 'bytecode':
+            kept_sites = mutator.remove_subsumed(code, sites)
+            self.total_pruned[equivalence.SUBSUMED] += (len(sites) -
+                                                        len(kept_sites))
+            sites = kept_sites
+        return sites
+
+    def _test_mutant(self, source_filename, site, test_coverage, args):
+        """Runs the tests covering the site against its mutant.
+
+        Returns:
+          A tuple (outcome, detail), where detail is the name of the test
+          killing the mutant, or describes how it was killed when it was not
+          by the tests.
+        """
+        if self.fork:
+            outcome, detail = self._fork_mutant(source_filename, site,
+                                                test_coverage, args)
+        else:
+            soft_limit = None
+            if self.supervised and self.memory_limit:
+                soft_limit = limit_address_space(self.memory_limit)
+            try:
+                outcome, detail = self._run_tests(source_filename, site,
+                                                  test_coverage, args)
+            finally:
+                if soft_limit is not None:
+                    restore_address_space(soft_limit)
+        if outcome == KILLED and detail:
+            self.prioritizer.record(self._kill_keys(source_filename, site),
+                                    detail)
+        return outcome, detail
+
+    def _kill_keys(self, source_filename, site):
+        """Returns the keys of the line and of the function of a site, under
+        which the tests killing its mutant are recorded."""
+        if isinstance(site, mutator.MutationSite):
+            if source_filename in self.stored:
+                names = self.stored[source_filename].mutants[site].names
+            else:
+                if source_filename not in self.trees:
+                    self.trees[source_filename] = ast.parse(
+                            self.sources[source_filename])
+                names = hotpatch.function_names(self.trees[source_filename],
+                                                site.path)
+            function = names and tuple(names)
+        else:
+            function = site.code_path
+        return ((source_filename, site.line),
+                function and (source_filename, function))
+
+    def _run_tests(self, source_filename, site, test_coverage, args):
+        """Loads the mutant of the site in this process and runs the tests
+        covering it, as _test_mutant.
+
+        The mutants applied to the loaded module are run against the tests
+        collected for it, and the others by a new nose run, which imports the
+        tests again. The tests run in the order of the TestPrioritizer.
+        """
+        try:
+            restore = self.mutant_loader.load(site)
+        except MutantImportError as error:
+            return IMPORT_ERROR, str(error)
+
+        test_names = self.prioritizer.order(
+                test_coverage.coverage_info[source_filename][site.line],
+                self._kill_keys(source_filename, site))
+        test_index = restore and self._test_index(source_filename)
+        if test_index and test_index.covers(test_names):
+            run_tests = functools.partial(test_index.run, test_names)
+        else:
+            run_tests = functools.partial(self._run_nose, test_names, args)
+        if self.budget:
+            run_tests = functools.partial(self.budget.run, run_tests)
+        try:
+            if self.supervised:
+                # The process running the tests is killed on timeout.
+                result = run_tests()
+            else:
+                result = timeout(self._time_limit(source_filename, site,
+                                                  test_coverage),
+                                 None, run_tests)
+        finally:
+            if restore:
+                restore()
+        if result is None:
+            return TIMEOUT, None
+        if result.wasSuccessful():
+            return SURVIVED, None
+        if result.hung:
+            return HANG, result.killer
+        if result.out_of_memory:
+            return OUT_OF_MEMORY, result.killer
+        return KILLED, result.killer
+
+    def _time_limit(self, source_filename, site, test_coverage):
+        """Returns the seconds the tests covering the site may run against its
+        mutant.
+
+        The expected duration of each test is taken from the timing pass when
+        it was timed, and from the original run otherwise. Their sum is
+        scaled by the multiplier and by the load of the parallel workers, and
+        the floor is the shortest limit given. The limits given by a
+        coordinator take precedence.
+        """
+        if (source_filename, site) in self.time_limits:
+            return self.time_limits[source_filename, site]
+        total_time = 0.0
+        for test_name in test_coverage.coverage_info[source_filename][
+                site.line]:
+            if self.timings and test_name in self.timings.samples:
+                total_time += self.timings.estimate(test_name)
+            else:
+                total_time += test_coverage.time_info[test_name]
+        return max(self.timeout_floor,
+                   total_time * self.timeout_multiplier * self.load_factor)
+
+    def _run_nose(self, test_names, args):
+        """Runs the tests in a new nose run until the first failure.
+
+        Returns:
+          The KillResult of the run.
+        """
+        nose.core.run(defaultTest=','.join(test_names), argv=args + ['-x'],
+                      addplugins=[self.quiet])
+        return self.quiet.result
+
+    def _covering_tests(self, source_filename):
+        """Returns the names of all the tests covering the source file."""
+        return set().union(
+                *self.test_coverage.coverage_info[source_filename].values())
+
+    def _test_index(self, source_filename):
+        """Returns the TestIndex of the tests using the loaded module of the
+        source file, collecting them again if the module was reimported."""
+        module_name = self.module_source_mapping[source_filename]
+        if self.test_index is None or not self.test_index.is_current(
+                module_name):
+            self.test_index = suite.collect(
+                    self._covering_tests(source_filename))
+        return self.test_index
+
+    def _fork_mutant(self, source_filename, site, test_coverage, args):
+        """Runs the tests against the mutant in a forked child, as
+        _test_mutant.
+
+        This process is the zygote of the mutants of the file: it holds the
+        module and its tests, imported once by MutantLoader.preload, and the
+        children share them copy on write. The mutant only lives in the
+        child, so nothing is restored or unloaded when it exits. The child is
+        stopped when it exceeds the time limit of the mutant.
+
+        Raises:
+          RunnerError: the child failed outside of the tests.
+        """
+        time_limit = self._time_limit(source_filename, site, test_coverage)
+        reader, writer = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(reader)
+            # Python 2 has no gc.freeze, so the collector is disabled instead
+            # of walking, and copying, the objects shared with the zygote.
+            gc.disable()
+            self.supervised = True
+            # The child outlives its time limit only if this process died,
+            # e.g. a remote worker being stopped, and then stops itself.
+            signal.alarm(int(time_limit + KILL_GRACE) + 1)
+            if self.memory_limit:
+                limit_address_space(self.memory_limit)
+            status = 1
+            try:
+                try:
+                    result = self._run_tests(source_filename, site,
+                                             test_coverage, args)
+                except MemoryError:
+                    raise
+                except Exception:
+                    result = RunnerError(traceback.format_exc())
+                with os.fdopen(writer, 'wb') as result_file:
+                    pickle.dump(result, result_file, pickle.HIGHEST_PROTOCOL)
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(writer)
+        deadline = time.time() + time_limit
+        chunks = []
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if (remaining <= 0 or
+                    not select.select([reader], [], [], remaining)[0]):
+                    stop_process(pid)
+                    return TIMEOUT, 'exceeded %.1fs' % time_limit
+                chunk = os.read(reader, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            os.close(reader)
+        data = ''.join(chunks)
+        _, status = os.waitpid(pid, 0)
+        if data:
+            result = pickle.loads(data)
+            if isinstance(result, RunnerError):
+                raise result
+            return result
+        if os.WIFSIGNALED(status):
+            return CRASHED, exit_reason(-os.WTERMSIG(status))
+        return CRASHED, exit_reason(os.WEXITSTATUS(status))
+
+    def _record_result(self, source_filename, site, outcome, detail=None):
+        """Adds the result of a mutant to the totals."""
+        self.total_mutations += 1
+        self.sampled[site.mutator.__name__] += 1
+        if outcome == SURVIVED:
+            self.total_mutations_alive += 1
+        else:
+            self.killed[site.mutator.__name__] += 1
+        for sink in self.sinks:
+            sink.add(source_filename, site, outcome, detail)
+        if outcome not in (SURVIVED, KILLED):
+            self.kill_details[outcome].append((source_filename, site, detail))
+            if self.verbosity > 1:
+                self.stream.writeln('\nMutation killed (%s) at %s:%d using '
+                                    'mutator %s: %s' %
+                                    (outcome, source_filename, site.line,
+                                     site.mutator.__name__, detail))
+
+    def _run_mutant(self, source_filename, site, test_coverage, args):
+        """Runs the mutant of the site and records its result.
+
+        Returns:
+          True if the mutant survived.
+        """
+        outcome, detail = self._test_mutant(source_filename, site,
+                                            test_coverage, args)
+        self._record_result(source_filename, site, outcome, detail)
+        return outcome == SURVIVED
+
+    def _report_survivor(self, source_filename, site, show_filename=False):
+        code_lines = self.sources[source_filename].split('\n')
+        #code_lines = get_lines(source_filename)
+        #code = '\n'.join(code_lines)
+        location = 'line %d' % site.line
+        if show_filename:
+            location = '%s:%d' % (source_filename, site.line)
+        self.stream.writeln('\nMutation survived at %s (%s) '
+                            'using mutator %s:\n\t%s' %
+                            (location, site.position,
+                             site.mutator.__name__,
+                             code_lines[site.line - 1].strip()))
+
+        # The bytecode sites have no node to render.
+        if isinstance(site, mutator.MutationSite):
+            if source_filename not in self.renderers:
+                self.renderers[source_filename] = render.MutantRenderer(
+                        self.sources[source_filename])
+            for line in self.renderers[source_filename].diff(site,
+                                                             source_filename):
+                self.stream.writeln(line)
+
+    def _start_file(self, source_filename, sites):
+        self.mutant_loader.start(self.module_source_mapping[source_filename],
+                                 source_filename,
+                                 self.sources[source_filename], sites,
+                                 self.stored.get(source_filename))
+        if self.fork:
+            self.mutant_loader.preload(self._covering_tests(source_filename))
+            self._test_index(source_filename)
+
+    def _run_mutated_tests(self, source_filename, sites, test_coverage, args):
+        self.stream.write('%s: ' % source_filename)
+        self._start_file(source_filename, sites)
+        for site in sites:
+            if self._run_mutant(source_filename, site, test_coverage, args):
+                self._report_survivor(source_filename, site)
                 # Abort if the tests still pass and the fail fast option is
                 # set.
-                self.total_mutations_alive += 1
-                self.stream.writeln('\nMutation survived at line %d (%s) '
-                                    'using mutator %s:\n\t%s' %
-                                    (line_no, pos,
-                                     mutator_name,
-                                     code_lines[line_no - 1].strip()))
-
-                # TODO: decide how to display the mutation. Codegen has
-                # really many problems and is really hard to fix it
-                #modified_source = codegen.to_source(m_node)
-                # TODO: generate a more accurate new source code, to
-                # resemble the original source code and show a more
-                # compact diff.
-                #for l in difflib.unified_diff(code_lines, modified_source.split('\n'), source_filename + ' (original)', source_filename + ' (mutation-%d)' % pos):
-                #    self.stream.write('%s\n' % l.rstrip())
-
                 if self.failfast:
                     return False
             else:
                 self.stream.write('.')
+        self.mutant_loader.finish()
+        self.stream.writeln()
+        return True
+
+    def _report_result(self, index, source_filename, site, survived):
+        """Reports the result of a mutant run among the mutants of all the
+        files.
+
+        The estimator takes the results in the order the mutants were drawn,
+        up to the first mutant without result: the mutants finishing first
+        are the quickly killed ones, which would bias the estimate.
+
+        Args:
+          index: the index of the mutant in the order of the run.
+        Returns:
+          False if the run must be aborted.
+        """
+        if self.estimator:
+            self.unestimated[index] = not survived
+            while self.estimated in self.unestimated:
+                self.estimator.add(self.unestimated.pop(self.estimated))
+                self.estimated += 1
+        if survived:
+            self._report_survivor(source_filename, site, show_filename=True)
+            # Abort if the tests still pass and the fail fast option is set.
+            if self.failfast:
+                return False
+        else:
+            self.stream.write('.')
+        return True
+
+    def _settled(self):
+        """Returns whether the mutation score is known with the precision."""
+        return bool(self.estimator and
+                    self.estimator.settled(self.precision))
+
+    def _run_sequential(self, mutants, sites_by_file, test_coverage, args):
+        """Runs the mutants of all the files in the given order."""
+        self.mutant_loader.settle()
+        current_filename = None
+        for index, (source_filename, site) in enumerate(mutants):
+            if source_filename != current_filename:
+                if current_filename is not None:
+                    self.mutant_loader.finish()
+                self._start_file(source_filename,
+                                 sites_by_file[source_filename])
+                current_filename = source_filename
+            survived = self._run_mutant(source_filename, site, test_coverage,
+                                        args)
+            if not self._report_result(index, source_filename, site,
+                                       survived):
+                return False
+            if self._settled():
+                break
+        self.mutant_loader.finish()
         self.stream.writeln()
         return True
 
+    def _worker(self, number, mutants, sites_by_file, test_coverage, args,
+                tasks, results, results_lock, running, deadlines):
+        """Runs the mutants whose indexes are read from the tasks queue.
+
+        The worker is a forked process, so it shares the state of the runner
+        at the time of the fork, and uses its own MutantLoader and
+        ModuleImporter. The index of the mutant being run is kept in running,
+        so it is known if the process dies, and the time by which its tests
+        must be done in deadlines, unless they run in forked children which
+        the worker stops itself. The results are sent through a pipe, which
+        unlike a Queue does not buffer them in a thread that would be lost
+        with the process.
+
+        A worn out worker, which ran enough mutants or grew enough, sends
+        (None, number) instead of a result and exits, so the memory leaked by
+        loading the mutants is given back. A worker failing outside of the
+        tests sends a RunnerError as the result and exits.
+        """
+        self.supervised = True
+        try:
+            self.mutant_loader = self._make_loader()
+            self.mutant_loader.settle()
+            current_filename = None
+            tested = 0
+            for index, kills in iter(tasks.get, None):
+                running[number] = index
+                self.prioritizer.merge(kills)
+                source_filename, site = mutants[index]
+                if source_filename != current_filename:
+                    if current_filename is not None:
+                        self.mutant_loader.finish()
+                    self._start_file(source_filename,
+                                     sites_by_file[source_filename])
+                    current_filename = source_filename
+                if not self.fork:
+                    deadlines[number] = time.time() + self._time_limit(
+                            source_filename, site, test_coverage)
+                result = self._test_mutant(source_filename, site,
+                                           test_coverage, args)
+                # The deadline is cleared before taking the lock, so the
+                # worker is never stopped while holding it.
+                deadlines[number] = 0
+                with results_lock:
+                    results.send((index, result))
+                running[number] = -1
+                tested += 1
+                if self._worn_out(tested):
+                    with results_lock:
+                        results.send((None, number))
+                    return
+            self.mutant_loader.finish()
+        except MemoryError:
+            raise
+        except Exception as error:
+            if not isinstance(error, RunnerError):
+                error = RunnerError(traceback.format_exc())
+            deadlines[number] = 0
+            with results_lock:
+                results.send((running[number], error))
+
+    def _worn_out(self, tested):
+        """Returns whether a worker that ran the given number of mutants
+        should be replaced."""
+        if self.recycle_after and tested >= self.recycle_after:
+            return True
+        if self.recycle_rss:
+            usage = memory_usage()
+            return usage is not None and usage[1] > self.recycle_rss * MEGABYTE
+        return False
+
+    def _run_parallel(self, mutants, sites_by_file, test_coverage, args):
+        """Runs the mutants of all the files in a pool of processes.
+
+        The workers pull the mutants from a shared queue, in the given order,
+        and their results are recorded and reported as they arrive. The kills
+        of all the workers are recorded in the TestPrioritizer of this
+        process, which sends those of the line and function of each mutant
+        with it, so every worker orders the tests with them. The queue
+        holds QUEUE_DEPTH mutants per worker, and is refilled as the results
+        come back, so stopping the run leaves little to discard. A worker
+        dying while running a mutant kills the mutant and is replaced. This
+        process is the watchdog of the workers: a worker exceeding the time
+        limit of its mutant is stopped with SIGTERM, then SIGKILL, and the
+        mutant is recorded as timed out. A worn out worker is replaced as
+        soon as it says so.
+
+        Raises:
+          RunnerError: a worker failed outside of the tests of a mutant.
+        """
+        tasks = multiprocessing.Queue()
+        results, worker_results = multiprocessing.Pipe(duplex=False)
+        results_lock = multiprocessing.Lock()
+        processes = min(self.processes, len(mutants))
+        # The arrays have no lock, which a stopped worker could keep.
+        running = multiprocessing.Array('i', [-1] * processes, lock=False)
+        deadlines = multiprocessing.Array('d', [0.0] * processes, lock=False)
+        queued = [0]
+
+        def feed(count):
+            """Queues count more mutants, with the kills recorded so far for
+            their line and function, and the sentinels stopping the workers
+            after the last one."""
+            end = min(queued[0] + count, len(mutants))
+            for index in range(queued[0], end):
+                tasks.put((index, self.prioritizer.kills_for(
+                        self._kill_keys(*mutants[index]))))
+            if queued[0] < end == len(mutants):
+                for _ in range(processes):
+                    tasks.put(None)
+            queued[0] = end
+
+        def start_worker(number):
+            worker = multiprocessing.Process(
+                    target=self._worker,
+                    args=(number, mutants, sites_by_file, test_coverage, args,
+                          tasks, worker_results, results_lock, running,
+                          deadlines))
+            worker.daemon = True
+            worker.start()
+            return worker
+
+        feed(QUEUE_DEPTH * processes)
+        workers = [start_worker(number) for number in range(processes)]
+        pending = len(mutants)
+        success = True
+        try:
+            while pending and success and not self._settled():
+                active_deadlines = [deadline for deadline in deadlines
+                                    if deadline > 0]
+                wait = 1
+                if active_deadlines:
+                    wait = min(max(min(active_deadlines) - time.time(), 0.01),
+                               1)
+                if results.poll(wait):
+                    index, result = results.recv()
+                    if isinstance(result, RunnerError):
+                        raise result
+                    if index is None:
+                        workers[result].join()
+                        workers[result] = start_worker(result)
+                        continue
+                    outcome, detail = result
+                    source_filename, site = mutants[index]
+                    if outcome == KILLED and detail:
+                        self.prioritizer.record(
+                                self._kill_keys(source_filename, site), detail)
+                    self._record_result(source_filename, site, outcome,
+                                        detail)
+                    success = self._report_result(index, source_filename,
+                                                  site, outcome == SURVIVED)
+                    pending -= 1
+                    feed(1)
+                    continue
+                for number, worker in enumerate(workers):
+                    index = running[number]
+                    if worker.is_alive():
+                        with results_lock:
+                            # Checked under the lock, as the worker may have
+                            # finished the mutant meanwhile.
+                            if not 0 < deadlines[number] < time.time():
+                                continue
+                            stop_worker(worker)
+                        outcome = TIMEOUT
+                    elif worker.exitcode == 0:
+                        continue
+                    else:
+                        outcome = CRASHED
+                    if index >= 0:
+                        source_filename, site = mutants[index]
+                        if outcome == TIMEOUT:
+                            detail = 'exceeded %.1fs' % self._time_limit(
+                                    source_filename, site, test_coverage)
+                        else:
+                            detail = exit_reason(worker.exitcode)
+                        self._record_result(source_filename, site, outcome,
+                                            detail)
+                        success = self._report_result(index, source_filename,
+                                                      site, False)
+                        pending -= 1
+                        feed(1)
+                        running[number] = -1
+                    deadlines[number] = 0
+                    workers[number] = start_worker(number)
+                if not any(worker.is_alive() for worker in workers):
+                    break
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    stop_worker(worker)
+                worker.join()
+        self.stream.writeln()
+        return success
+
+    def _run_distributed(self, mutants, test_coverage):
+        """Serves the mutants to remote workers, as a
+        distributed.Coordinator, and records their results as they arrive.
+
+        The items hold the site and time limit of each mutant. The workers
+        get the module, the coverage and the test durations of each file with
+        its first mutant, and the limits of the budget when there is one.
+        """
+        root = self.mutations_path
+        items = OrderedDict()
+        file_info = {}
+        for index, (source_filename, site) in enumerate(mutants):
+            filename = distributed.relative_name(source_filename, root)
+            items[index] = {
+                    'id': index, 'file': filename,
+                    'site': distributed.encode_site(site),
+                    'deadline': self._time_limit(source_filename, site,
+                                                 test_coverage)}
+            if filename not in file_info:
+                coverage_info = test_coverage.coverage_info[source_filename]
+                file_info[filename] = {
+                        'module': self.module_source_mapping[source_filename],
+                        'coverage': dict(
+                                (line, [distributed.relative_name(name, root)
+                                        for name in test_names])
+                                for line, test_names in
+                                coverage_info.iteritems()),
+                        'times': dict(
+                                (distributed.relative_name(name, root),
+                                 test_coverage.time_info[name])
+                                for name in self._covering_tests(
+                                        source_filename))}
+                if self.budget:
+                    file_info[filename]['budget'] = {
+                            'loops': self.budget.loops,
+                            'depth': self.budget.depth}
+        coordinator = distributed.Coordinator(self.serve_address, items,
+                                              file_info)
+        host, port = coordinator.bind()
+        self.stream.writeln('Serving %d mutations on %s:%d' %
+                            (len(mutants), host, port))
+        success = [True]
+
+        def record(index, outcome, detail):
+            source_filename, site = mutants[index]
+            if outcome is None:
+                outcome = CRASHED
+            elif outcome == KILLED and detail:
+                detail = distributed.absolute_name(detail, root)
+            self._record_result(source_filename, site, outcome, detail)
+            success[0] = self._report_result(index, source_filename, site,
+                                             outcome == SURVIVED)
+            return success[0] and not self._settled()
+
+        coordinator.serve(record)
+        self.stream.writeln()
+        return success[0]
+
+    def _work_for(self, address):
+        """Runs the mutants served by the coordinator at the address against
+        this checkout, until it has no more.
+
+        Nothing is known about the files and tests but what the coordinator
+        sends. The mutants run in forked children when possible, so a mutant
+        crashing or hanging does not take the worker with it. A failure
+        outside of the tests of a mutant is sent to the coordinator, and
+        raised.
+        """
+        root = self.mutations_path
+        self.result = self._makeResult()
+        self.test_coverage = coverage_plugin.TestCoverage()
+        self.module_source_mapping = {}
+        self.sources = {}
+        self.stored = {}
+        self.fork = hasattr(os, 'fork')
+        self.mutant_loader = self._make_loader()
+        self.mutant_loader.settle()
+        self.prioritizer = suite.TestPrioritizer(self.test_coverage.time_info)
+        self.quiet = Quiet()
+        self._reset_results()
+        args = clean_args(sys.argv)
+        self.stream.writeln('Running the mutations served on %s' % address)
+        self.stream.writeln('-' * 70)
+        connection = distributed.connect(address)
+        current_filename = None
+        try:
+            connection.send({'ready': socket.gethostname()})
+            for message in iter(connection.receive, None):
+                if 'item' not in message:
+                    break
+                item = message['item']
+                source_filename = distributed.absolute_name(item['file'], root)
+                if 'file_info' in message:
+                    self._add_file(source_filename, message['file_info'])
+                site = distributed.decode_site(item['site'])
+                self.time_limits[source_filename, site] = item['deadline']
+                if source_filename != current_filename:
+                    if current_filename is not None:
+                        self.mutant_loader.finish()
+                    self._start_file(source_filename, [site])
+                    current_filename = source_filename
+                try:
+                    outcome, detail = self._test_mutant(
+                            source_filename, site, self.test_coverage, args)
+                except MemoryError:
+                    raise
+                except Exception:
+                    connection.send({'error': traceback.format_exc()})
+                    raise
+                self._record_result(source_filename, site, outcome, detail)
+                self.stream.write('.')
+                if outcome == KILLED and detail:
+                    detail = distributed.relative_name(detail, root)
+                connection.send({'result': {'id': item['id'],
+                                            'outcome': outcome,
+                                            'detail': detail}})
+        finally:
+            connection.close()
+            self.mutant_loader.finish()
+            if self.budget:
+                self.budget.uninstall()
+        self.stream.writeln()
+        self.stream.writeln('-' * 70)
+        self.stream.writeln('%d mutations run (survived %d)' %
+                            (self.total_mutations, self.total_mutations_alive))
+        return self.result
+
+    def _add_file(self, source_filename, file_info):
+        """Records the file_info a coordinator sent about a source file.
+
+        The mutants are instrumented when the coordinator sends a budget,
+        whatever the options of the worker, and the budget is installed.
+        """
+        root = self.mutations_path
+        budget_info = file_info.get('budget')
+        self.mutant_loader.budgets = budget_info is not None
+        if budget_info and self.budget is None:
+            self.budget = budget.Budget(budget_info['loops'],
+                                        budget_info['depth'])
+            self.budget.install()
+        nose.importer.add_path(os.path.dirname(source_filename))
+        self.module_source_mapping[source_filename] = file_info['module']
+        with open(source_filename) as fd:
+            self.sources[source_filename] = fd.read()
+        coverage_info = self.test_coverage.coverage_info[source_filename]
+        for line, test_names in file_info['coverage'].iteritems():
+            coverage_info[int(line)] = set(
+                    distributed.absolute_name(name, root)
+                    for name in test_names)
+        for name, test_time in file_info['times'].iteritems():
+            self.test_coverage.time_info[
+                    distributed.absolute_name(name, root)] = test_time
+
+    def _run_original_tests(self, test, test_coverage):
+        """Runs the suite collected by nose, measuring the coverage of each
+        test and indexing them for the mutants.
+
+        Returns:
+          True if all the tests passed.
+        """
+        self.test_index = suite.TestIndex()
+        result = suite.IndexingResult(self.test_index, test_coverage,
+                                      self.stream, self.descriptions,
+                                      self.verbosity, self.config)
+        test_coverage.begin()
+        start = time.time()
+        test(result)
+        stop = time.time()
+        result.printErrors()
+        result.printSummary(start, stop)
+        self.test_index.freeze()
+        return result.wasSuccessful()
+
+    def _shard_sites(self, sites_by_file, test_coverage):
+        """Returns the sites of the shard to run.
+
+        The mutants are identified by their filename relative to the
+        mutations path, and their cost is the number of tests covering them,
+        so every checkout makes the same shards whatever the test times it
+        measured.
+        """
+        def key(source_filename, site):
+            return '%s:%d:%s:%d' % (
+                    distributed.relative_name(source_filename,
+                                              self.mutations_path),
+                    site.line, site.mutator.__name__, site.position)
+
+        def cost(source_filename, site):
+            return len(test_coverage.coverage_info[source_filename][
+                    site.line])
+
+        shard, shards = self.shard
+        return sampling.shard_sites(sites_by_file, shard, shards, key, cost)
+
+    def _run_mutants(self, mutants, sites_by_file, test_coverage, args):
+        """Runs the mutants, in supervised processes when possible.
+
+        Returns:
+          False if the run was stopped by failfast, True otherwise.
+        """
+        if mutants and self.serve_address:
+            if self.engine == 'ast':
+                return self._run_distributed(mutants, test_coverage)
+            self.stream.writeln('Warning: the bytecode mutants cannot be '
+                                'served, running them here.')
+        if mutants and (self.processes > 1 or hasattr(os, 'fork')):
+            # The mutants run in supervised processes, even if there is only
+            # one, so a mutant that hangs is stopped without stopping the run.
+            if self.processes > 1 and len(mutants) > 1:
+                self.stream.writeln('Running mutations in %d processes' %
+                                    min(self.processes, len(mutants)))
+                # The tests run slower when the workers outnumber the CPUs.
+                self.load_factor = max(1.0, float(min(self.processes,
+                                                      len(mutants))) /
+                                            default_processes())
+            return self._run_parallel(mutants, sites_by_file, test_coverage,
+                                      args)
+        if self.precision:
+            return self._run_sequential(mutants, sites_by_file, test_coverage,
+                                        args)
+        #collect the by test coverage and mutate the files
+        for source_filename, sites in sites_by_file.iteritems():
+            if not self._run_mutated_tests(source_filename, sites,
+                                           test_coverage, args):
+                return False
+        return True
+
     def run(self, test):
-        test_coverage = coverage_plugin.TestCoverage()
+        if self.worker_address:
+            return self._work_for(self.worker_address)
+        depth_gauge = budget.DepthGauge() if self.budgets else None
+        test_coverage = coverage_plugin.TestCoverage(depth_gauge)
+        self.test_coverage = test_coverage
 
         #TODO: add data to result?
         self.result = self._makeResult()
@@ -204,8 +1309,20 @@ class MutationRunner(TextTestRunner):
 
         args = clean_args(sys.argv)
 
-        #run all specified tests using the by test coverage plugin
-        success = nose.core.run(argv=args, addplugins=[test_coverage])
+        #run all specified tests using the by test coverage plugin, recording
+        #the imports so only the modules depending on a mutated module are
+        #unloaded
+        if not self.unload_all:
+            self.import_graph = importer.ImportGraph()
+            self.import_graph.install()
+        try:
+            if test is None:
+                success = nose.core.run(argv=args, addplugins=[test_coverage])
+            else:
+                success = self._run_original_tests(test, test_coverage)
+        finally:
+            if self.import_graph:
+                self.import_graph.uninstall()
 
         #if one or more tests failed and the fail fast option is True then abort
         if not success:
@@ -219,6 +1336,13 @@ class MutationRunner(TextTestRunner):
 
         self.module_source_mapping = get_module_source_mapping()
 
+        if self.timing_runs and self.test_index:
+            self.stream.writeln('\nTiming the tests without coverage (%d runs)'
+                                % self.timing_runs)
+            self.timings = suite.measure(self.test_index, self.timing_runs)
+        if depth_gauge:
+            self.budget = depth_gauge.budget(self.loop_budget)
+
         self.stream.writeln('\nTesting mutated files')
         self.stream.writeln('-' * 70)
         start_time = time.time()
@@ -228,28 +1352,446 @@ class MutationRunner(TextTestRunner):
         print source_filenames
         print test_coverage.coverage_info.keys()
 
-        self.module_importer = importer.ModuleImporter()
-        self.total_mutations = 0
-        self.total_mutations_alive = 0
+        self.mutator_classes = mutator.discover(self.mutators_modules,
+                                                self.mutators)
+        if self.engine == 'bytecode':
+            unsupported = [mutator_class.__name__
+                           for mutator_class in self.mutator_classes
+                           if mutator_class not in bytecode.RULES]
+            if unsupported:
+                self.stream.writeln('Warning: the bytecode engine does not '
+                                    'support %s.' % ', '.join(unsupported))
+        self.mutant_loader = self._make_loader()
+        self._reset_results()
+        self.prioritizer = suite.TestPrioritizer(test_coverage.time_info)
+        self.quiet = Quiet()
 
-        #collect the by test coverage and mutate the files
-        for source_filename in source_filenames:
-            if not self._run_mutated_tests(source_filename,
-                                           test_coverage,
-                                           args):
+        #collect the mutation sites of all the files before running them, so
+        #they can be sampled
+        self.sources = {}
+        sites_by_file = OrderedDict()
+        for source_filename in sorted(source_filenames):
+            with open(source_filename) as fd:
+                self.sources[source_filename] = fd.read()
+        # The fingerprints of the stored mutants spare compiling them to prune.
+        self.stored = {}
+        mutant_store = None
+        if self.store_directory and self.engine == 'ast':
+            mutant_store = store.MutantStore(self.store_directory)
+            self.stored = mutant_store.read(self.sources,
+                                            self.mutator_classes,
+                                            self.budgets)
+        for source_filename in sorted(source_filenames):
+            sites_by_file[source_filename] = self._mutation_sites(
+                    source_filename, self.sources[source_filename],
+                    test_coverage)
+        if self.sampler:
+            sites_by_file = self.sampler.sample(sites_by_file)
+        total_sites = sum(len(sites) for sites in sites_by_file.itervalues())
+        results_filename = self.results_filename
+        if self.shard:
+            sites_by_file = self._shard_sites(sites_by_file, test_coverage)
+            results_filename = results_filename or os.path.join(
+                    self.mutations_path,
+                    'mutations-shard-%d-of-%d.jsonl' % self.shard)
+
+        if mutant_store:
+            # Only the mutants of the sites left to run are compiled.
+            self.stored = mutant_store.generate(
+                    self.sources, self.mutator_classes, self.processes,
+                    self.budgets, sites_by_file)
+
+        mutants = [(source_filename, site)
+                   for source_filename, sites in sites_by_file.iteritems()
+                   for site in sites]
+        if self.shard:
+            self.stream.writeln('Running shard %d/%d: %d of %d mutations' %
+                                (self.shard + (len(mutants), total_sites)))
+        if self.precision:
+            # The mutants are shuffled, and the run stops as soon as the
+            # confidence interval of the mutation score is narrower than the
+            # requested precision.
+            self.stream.writeln(
+                    'Running mutations at random until the mutation score is '
+                    'known within +/- %.1f%%' % (self.precision * 100))
+            random.Random(self.seed).shuffle(mutants)
+            self.estimator = sampling.SequentialEstimator(len(mutants),
+                                                          self.confidence)
+            self.unestimated = {}
+            self.estimated = 0
+        result_file = None
+        if results_filename:
+            result_file = results.ResultFile(results_filename)
+            info = {'mutations': total_sites,
+                    'files': len(source_filenames),
+                    'pruned': self.total_pruned,
+                    'root': self.mutations_path}
+            if self.shard:
+                info['shard'], info['shards'] = self.shard
+            result_file.add_info(info)
+            self.sinks.append(result_file)
+        if self.budget:
+            self.budget.install()
+        try:
+            if not self._run_mutants(mutants, sites_by_file, test_coverage,
+                                     args):
                 return self.result
+            stop_time = time.time()
+            if result_file:
+                result_file.add_info({'elapsed': stop_time - start_time})
+        finally:
+            if self.budget:
+                self.budget.uninstall()
+            for sink in self.sinks:
+                sink.close()
 
-        stop_time = time.time()
         self.stream.writeln('-' * 70)
-        self.stream.writeln('%d mutations performed (survived %d) on %d files '
-                            'in %.3fs' % (self.total_mutations,
-                                          self.total_mutations_alive,
-                                          len(source_filenames),
-                                          stop_time - start_time))
+        write_summary(self.stream, self.total_mutations,
+                      self.total_mutations_alive, len(source_filenames),
+                      stop_time - start_time,
+                      dict((outcome, len(details)) for outcome, details in
+                           self.kill_details.iteritems()),
+                      self.total_pruned)
+        if self.precision and self.total_mutations:
+            score, half_width = self.estimator.estimate()
+            self.stream.writeln(
+                    'Mutation score: %.1f%% (+/- %.1f%% at %g%% confidence) '
+                    'from %d of %d mutations' % (
+                            score * 100, half_width * 100,
+                            self.confidence * 100, self.estimator.runs,
+                            self.estimator.population))
+        elif self.sampler and self.total_mutations:
+            score, half_width, unsampled = sampling.stratified_estimate(
+                    self.sampler.population, self.sampled, self.killed)
+            self.stream.writeln(
+                    'Estimated mutation score on all the %d mutations: '
+                    '%.1f%% (+/- %.1f%%)' % (
+                            sum(self.sampler.population.values()),
+                            score * 100, half_width * 100))
+            if unsampled:
+                self.stream.writeln(
+                        'The score of the %d mutations of the mutators '
+                        'without runs is unknown, which widens the interval'
+                        % unsampled)
         #TODO: print adjusted coverage stats
         return self.result
 
 
+class MutantImportError(Exception):
+    """Raised when a mutant does not compile or fails to be imported."""
+
+
+class RunnerError(Exception):
+    """Raised when running a mutant fails outside of its tests, e.g. in a
+    worker, with the traceback of the failure. It is an error of the runner,
+    not a kill of the mutant."""
+
+
+class MutantLoader(object):
+    """Makes a mutant the version of its module that the tests will use.
+
+    By default each mutant is compiled, registered in the ModuleImporter and
+    imported again, before running the tests. Mutants inside
+    functions are applied to the loaded module instead, either by replacing
+    the code of the function (hotpatch) or by switching the active mutant of
+    the module schema (schemata). In both cases the module and its
+    dependencies are kept loaded between mutants.
+
+    With the bytecode engine the mutants are BytecodeSites, applied to the
+    module code compiled once per file, and schemata are not used. The
+    MutationSites it falls back to are loaded as with the ast engine.
+
+    When an ImportGraph of the tests is given, importing the module only
+    unloads the module and the modules depending on it, so the unrelated
+    modules stay loaded for all the mutants.
+
+    The base modules, and the modules loaded outside the tested part of the
+    graph when the runner settles the loader, are the modules of the runner.
+    They are never unloaded, and neither are the submodules their packages
+    import lazily, such as multiprocessing.forking.
+
+    With budgets, the loops of the function enclosing each AST mutant are
+    instrumented as in budget.instrument. The schemata and bytecode mutants
+    are left as they are.
+    """
+
+    def __init__(self, module_importer, base_modules, schemata=False,
+                 hotpatch=True, engine='ast', import_graph=None,
+                 budgets=False):
+        self.module_importer = module_importer
+        self.budgets = budgets
+        self.base_modules = base_modules
+        self.runner_modules = set(base_modules)
+        self.import_graph = import_graph
+        self.schemata = schemata
+        self.hotpatch = hotpatch
+        self.engine = engine
+        self._kept_loaded = None
+        self.module_name = None
+        self.source_filename = None
+        self.code = None
+        self.schema = None
+        self.schema_code = None
+        self.module_code = None
+        self.stored = None
+        self._compiled = {}
+
+    def start(self, module_name, source_filename, code, sites, stored=None):
+        """Prepares the loader for the mutants of a source file.
+
+        The compiled module, or schema, of each file is cached, as the mutants
+        of several files may be interleaved. When the StoredFile of the source
+        is given, the mutants are read from it instead of compiled.
+        """
+        self.module_name = module_name
+        self.source_filename = source_filename
+        self.code = code
+        self.stored = stored
+        if source_filename not in self._compiled:
+            self._compiled[source_filename] = self._compile(source_filename,
+                                                            code, sites)
+        self.module_code, self.schema, self.schema_code = \
+                self._compiled[source_filename]
+
+    def _compile(self, source_filename, code, sites):
+        """Returns the module code, schema and schema code of the file."""
+        if self.engine == 'bytecode':
+            return compile(code, source_filename, 'exec'), None, None
+        if self.schemata:
+            schema = mutator.build_schema(code, sites)
+            try:
+                return None, schema, compile(schema.tree, source_filename,
+                                             'exec')
+            except SyntaxError:
+                # Some mutant does not compile, so the mutants of this file are
+                # compiled one by one.
+                pass
+        return None, None, None
+
+    def finish(self):
+        """Unloads the modules and stops replacing the module."""
+        self._kept_loaded = None
+        self._unload()
+        self.module_importer.unregister()
+
+    def settle(self):
+        """Adds the modules loaded outside the tested part of the ImportGraph
+        to the modules of the runner.
+
+        Called once the runner has imported what it uses to run the mutants,
+        e.g. in a worker once the pool has started it. Without a graph the
+        tested modules are not known, and only the base modules are kept.
+        """
+        if self.import_graph is not None:
+            self.runner_modules.update(set(sys.modules) -
+                                       self.import_graph.modules)
+
+    def _loaded_runner_modules(self):
+        """Returns the loaded modules of the runner and their submodules."""
+        return set(name for name in sys.modules
+                   if name in self.runner_modules or
+                   name.partition('.')[0] in self.runner_modules)
+
+    def _unload(self):
+        """Unloads the module, the modules depending on it and the modules
+        the ImportGraph does not know about, but not the modules of the
+        runner.
+
+        Without a graph, all the modules imported after the base modules are
+        unloaded.
+        """
+        if self.import_graph is None:
+            unload_modules(exclude=self._loaded_runner_modules())
+            return
+        unknown = set(sys.modules) - self.import_graph.modules
+        unload_modules(exclude=self._loaded_runner_modules(),
+                       only=unknown |
+                       self.import_graph.dependents(self.module_name))
+
+    def preload(self, test_names):
+        """Imports the module and then the tests, to be shared by the
+        mutants run in forked children.
+
+        The module is imported as for the mutants applied to the loaded
+        module, and the tests are kept loaded with it, so those mutants do
+        not import anything. The garbage is collected before the children
+        are forked.
+        """
+        if self.schema_code:
+            self._keep_loaded(self.schema_code, {mutator.ACTIVE_MUTANT: 0})
+        else:
+            self._keep_loaded()
+        nose.loader.TestLoader().loadTestsFromNames(sorted(test_names))
+        self._kept_loaded = self._kept_loaded[0], sys.modules.keys()
+        gc.collect()
+
+    def _keep_loaded(self, module_code=None, module_globals=None):
+        """Imports the module, or the given code for it, once.
+
+        Only the modules imported after the module are unloaded, so the module
+        and its dependencies are shared by all the mutants using it. With an
+        ImportGraph nothing is unloaded, as the loaded modules depending on
+        the module use the kept module. An original module already loaded,
+        e.g. by the original tests, is kept as is, so the tests collected
+        with it see the mutants applied to it.
+        """
+        key = self.module_name, module_code
+        if self._kept_loaded is None or self._kept_loaded[0] != key:
+            module = sys.modules.get(self.module_name)
+            if (module_code is None and module is not None and
+                getattr(module, '__loader__', None) is not
+                self.module_importer):
+                self._kept_loaded = key, sys.modules.keys()
+            else:
+                self._unload()
+                if module_code:
+                    self.module_importer.register(self.module_name,
+                                                  module_code, module_globals)
+                else:
+                    self.module_importer.unregister()
+                importlib.import_module(self.module_name)
+                self._kept_loaded = key, sys.modules.keys()
+        if self.import_graph is None:
+            unload_modules(exclude=set(self._kept_loaded[1]) |
+                           self._loaded_runner_modules())
+        return sys.modules[self.module_name]
+
+    def load(self, site):
+        """Loads the mutant of the site.
+
+        Returns:
+          A function undoing the changes made to the loaded module, or None if
+          the mutant replaced the module.
+        Raises:
+          MutantImportError: if the mutant does not compile or fails to be
+              imported.
+        """
+        if isinstance(site, bytecode.BytecodeSite):
+            return self._load_bytecode(site)
+        mutant_id = self.schema.ids.get(site) if self.schema else None
+        if mutant_id in (self.schema.on_call if self.schema else ()):
+            module = self._keep_loaded(self.schema_code,
+                                       {mutator.ACTIVE_MUTANT: 0})
+            setattr(module, mutator.ACTIVE_MUTANT, mutant_id)
+            return lambda: setattr(module, mutator.ACTIVE_MUTANT, 0)
+        if mutant_id is None and self.hotpatch:
+            function_mutant = self._function_mutant(site)
+            if function_mutant:
+                names, function_code = function_mutant
+                function = hotpatch.get_function(self._keep_loaded(), names)
+                if hotpatch.can_patch(function, function_code):
+                    original_code = hotpatch.swap_code(function,
+                                                       function_code)
+                    return lambda: hotpatch.swap_code(function, original_code)
+
+        if mutant_id:
+            self._import(self.schema_code, {mutator.ACTIVE_MUTANT: mutant_id})
+        else:
+            self._import(self._mutant_code(site))
+        return None
+
+    def _mutant_code(self, site):
+        """Returns the module code of the mutant of the site.
+
+        Raises:
+          MutantImportError: if the mutant does not compile.
+        """
+        if self.stored:
+            module_code = self.stored.code(site)
+            if module_code is None:
+                raise MutantImportError(self.stored.mutants[site].error)
+            return module_code
+        try:
+            return compile(budget.mutant_tree(self.code, site, self.budgets),
+                           self.source_filename, 'exec')
+        except (SyntaxError, TypeError, ValueError) as error:
+            raise MutantImportError(importer.format_exception(error))
+
+    def _function_mutant(self, site):
+        """Returns the names and code of the mutated function, or None."""
+        if not self.stored:
+            return hotpatch.function_code(
+                    budget.mutant_tree(self.code, site, self.budgets),
+                    site.path, self.source_filename)
+        names = self.stored.mutants[site].names
+        module_code = self.stored.code(site)
+        if names is None or module_code is None:
+            return None
+        return names, hotpatch.find_code(module_code, names)
+
+    def _import(self, module_code, module_globals=None):
+        """Registers the code of the module and imports it.
+
+        The module is imported before any test is scheduled and kept loaded
+        for the tests, so mutants crashing at import time are detected without
+        running the tests.
+
+        Raises:
+          MutantImportError: if the module raises an exception on import.
+        """
+        self._kept_loaded = None
+        self._unload()
+        self.module_importer.register(self.module_name, module_code,
+                                      module_globals)
+        try:
+            importlib.import_module(self.module_name)
+        except (Exception, SystemExit) as error:  # pylint: disable=W0703
+            self._unload()
+            raise MutantImportError(importer.format_exception(error))
+
+    def _load_bytecode(self, site):
+        """Loads the mutant of a BytecodeSite."""
+        module_code = bytecode.mutate(self.module_code, site)
+        if self.hotpatch and site.code_path:
+            module = self._keep_loaded()
+            names = [bytecode.nested_code(self.module_code,
+                                          site.code_path[:depth]).co_name
+                     for depth in range(1, len(site.code_path) + 1)]
+            # The innermost function reachable from the module is patched.
+            for depth in range(len(site.code_path), 0, -1):
+                function = hotpatch.get_function(module, names[:depth])
+                function_code = bytecode.nested_code(module_code,
+                                                     site.code_path[:depth])
+                if hotpatch.can_patch(function, function_code):
+                    original_code = hotpatch.swap_code(function,
+                                                       function_code)
+                    return lambda: hotpatch.swap_code(function, original_code)
+
+        self._import(module_code)
+        return None
+
+
+def write_summary(stream, mutations, survived, files, elapsed, kills,
+                  pruned):
+    """Writes the totals of the mutants of a run.
+
+    Args:
+      stream: the stream to write to.
+      mutations: the number of mutants run.
+      survived: the number of mutants that survived.
+      files: the number of files mutated.
+      elapsed: the seconds the mutants took.
+      kills: mapping from the outcomes of KILL_SUMMARIES to the number of
+          mutants killed that way.
+      pruned: mapping from the equivalence reasons to the number of mutants
+          pruned for them.
+    """
+    stream.writeln('%d mutations performed (survived %d) on %d files in '
+                   '%.3fs' % (mutations, survived, files, elapsed))
+    for outcome, summary in KILL_SUMMARIES:
+        if kills.get(outcome):
+            stream.writeln('%d mutations %s' % (kills[outcome], summary))
+    if sum(pruned.values()):
+        stream.writeln(
+                '%d mutations pruned without running the tests (%d compile '
+                'to the original code, %d duplicate another mutation, %d are '
+                'subsumed by another mutation)' % (
+                        sum(pruned.values()),
+                        pruned.get(equivalence.EQUIVALENT, 0),
+                        pruned.get(equivalence.DUPLICATE, 0),
+                        pruned.get(equivalence.SUBSUMED, 0)))
+
+
 def timeout(seconds, default, function, *args, **kwargs):
     """Runs a function with a timer.
 
@@ -277,9 +1819,80 @@ def timeout(seconds, default, function, *args, **kwargs):
         timer.cancel()
 
 
-def get_total_time(test_set, test_info):
-    """Return the total time that took to run the specifeied tests."""
-    return sum(test_info[test] for test in test_set)
+def exit_reason(exitcode):
+    """Returns the description of the exit code of a process, which is the
+    opposite of the signal that killed it when negative."""
+    if exitcode < 0:
+        return 'killed by signal %d' % -exitcode
+    return 'exited with code %d' % exitcode
+
+
+def stop_worker(worker):
+    """Stops a multiprocessing.Process with SIGTERM, or with SIGKILL if it has
+    not exited after KILL_GRACE seconds."""
+    worker.terminate()
+    worker.join(KILL_GRACE)
+    if worker.is_alive():
+        os.kill(worker.pid, signal.SIGKILL)
+        worker.join()
+
+
+def stop_process(pid):
+    """Stops a child process with SIGTERM, or with SIGKILL if it has not
+    exited after KILL_GRACE seconds, and reaps it."""
+    os.kill(pid, signal.SIGTERM)
+    deadline = time.time() + KILL_GRACE
+    while time.time() < deadline:
+        if os.waitpid(pid, os.WNOHANG)[0]:
+            return
+        time.sleep(0.01)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+
+def memory_usage():
+    """Returns the sizes of the address space and of the resident set of the
+    process, in bytes, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            size, resident = statm.read().split()[:2]
+    except IOError:
+        return None
+    page_size = resource.getpagesize()
+    return int(size) * page_size, int(resident) * page_size
+
+
+def limit_address_space(megabytes):
+    """Lowers the soft RLIMIT_AS of the process to its current address space
+    plus the given megabytes, so larger allocations raise MemoryError.
+
+    Returns:
+      The previous soft limit, for restore_address_space, or None if the
+      limit is not supported.
+    """
+    usage = memory_usage()
+    if resource is None or usage is None:
+        return None
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    limit = usage[0] + megabytes * MEGABYTE
+    if hard_limit != resource.RLIM_INFINITY:
+        limit = min(limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+    return soft_limit
+
+
+def restore_address_space(soft_limit):
+    """Restores the soft RLIMIT_AS returned by limit_address_space."""
+    resource.setrlimit(resource.RLIMIT_AS,
+                       (soft_limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+
+def default_processes():
+    """Returns the number of CPUs, or 1 if it is unknown."""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
 
 
 def clean_args(args):
@@ -302,19 +1915,46 @@ def clean_args(args):
         args.remove(matches[-1])
     return args
 
+
+def parse_callback(parse):
+    """Returns an optparse callback storing the option value parsed by parse.
+
+    The ValueError raised by parse is reported as an error of the option, so
+    that the option parser prints the usage instead of a traceback.
+    """
+    def callback(option, opt_str, value, parser):
+        try:
+            setattr(parser.values, option.dest, parse(value))
+        except ValueError as error:
+            raise optparse.OptionValueError('option %s: %s' % (opt_str,
+                                                                 error))
+    return callback
+
 def get_lines(filename):
     with open(filename) as fd:
         return fd.readlines()
 
-def unload_modules(exclude=None):
+def unload_modules(exclude=None, only=None):
     """Unload all modules in sys.modules that are not found in exclude_modules.
 
+    The unloaded submodules are also removed from the packages that stay
+    loaded, or "from package import module" would still find them there.
+
     Args:
         exclude (list): list of modules not to be unloaded.
+        only (iterable): if given, only these modules are unloaded.
     """
     exclude = set(exclude or [])
-    for k in set(sys.modules.keys()) - exclude:
-        del sys.modules[k]
+    candidates = set(sys.modules.keys())
+    if only is not None:
+        candidates &= set(only)
+    unloaded = dict((k, sys.modules.pop(k)) for k in candidates - exclude)
+    for k, module in unloaded.iteritems():
+        package_name, _, name = k.rpartition('.')
+        package = sys.modules.get(package_name)
+        if (module is not None and package is not None and
+            getattr(package, name, None) is module):
+            delattr(package, name)
 
 
 def get_src_filename(filename):
@@ -0,0 +1,251 @@
+import ast
+import bisect
+import difflib
+from StringIO import StringIO
+import tokenize
+
+import mutator
+
+OPERATOR_SYMBOLS = {ast.Add: '+',
+                    ast.Sub: '-',
+                    ast.Mult: '*',
+                    ast.Div: '/',
+                    ast.FloorDiv: '//',
+                    ast.Mod: '%',
+                    ast.Pow: '**',
+                    ast.LShift: '<<',
+                    ast.RShift: '>>',
+                    ast.BitOr: '|',
+                    ast.BitXor: '^',
+                    ast.BitAnd: '&',
+                    ast.And: 'and',
+                    ast.Or: 'or',
+                    ast.Eq: '==',
+                    ast.NotEq: '!=',
+                    ast.Lt: '<',
+                    ast.LtE: '<=',
+                    ast.Gt: '>',
+                    ast.GtE: '>=',
+                    ast.Is: 'is',
+                    ast.IsNot: 'is not',
+                    ast.In: 'in',
+                    ast.NotIn: 'not in',
+                    ast.Not: 'not',
+                    ast.UAdd: '+',
+                    ast.USub: '-',
+                    ast.Invert: '~'}
+
+# Keywords starting the statements a mutator may replace by another one.
+STATEMENT_KEYWORDS = {ast.Break: 'break',
+                      ast.Continue: 'continue',
+                      ast.Return: 'return',
+                      ast.Pass: 'pass'}
+
+# Tokens that do not take part in expressions. NEWLINE is kept, as it ends
+# the statements.
+LAYOUT_TOKENS = (tokenize.NL, tokenize.COMMENT, tokenize.INDENT,
+                 tokenize.DEDENT, tokenize.ENDMARKER)
+
+OPEN_BRACKETS = '([{'
+CLOSE_BRACKETS = ')]}'
+
+
+class MutantRenderer(object):
+    """Renders the source of the mutants of a module.
+
+    Instead of regenerating the whole module from the mutated tree, the text
+    of the mutated node is spliced into the original source, so the rest of
+    the module keeps its formatting. The node is located through its lineno
+    and col_offset, and the tokens of the source. Operators are replaced in
+    place, literals, names and statement keywords are rewritten. Other
+    mutations are not rendered.
+    """
+
+    def __init__(self, code):
+        self.code = code
+        self.tree = ast.parse(code)
+        self.line_offsets = [0]
+        for line in code.splitlines(True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.tokens = [token for token in
+                       tokenize.generate_tokens(StringIO(code).readline)
+                       if token[0] not in LAYOUT_TOKENS]
+        self.token_starts = [token[2] for token in self.tokens]
+
+    def _offset(self, position):
+        """Returns the offset in the code of a (row, col) position."""
+        row, col = position
+        return self.line_offsets[row - 1] + col
+
+    def _token_at(self, position):
+        """Returns the index of the first token starting at position or
+        after it."""
+        return bisect.bisect_left(self.token_starts, position)
+
+    def _start(self, node):
+        """Returns the index of the first token of the node, or None."""
+        if getattr(node, 'col_offset', -1) < 0:
+            return None
+        index = self._token_at((node.lineno, node.col_offset))
+        if (index == len(self.tokens) or
+            self.token_starts[index] != (node.lineno, node.col_offset)):
+            return None
+        return index
+
+    def _operator_before(self, node):
+        """Returns the indexes of the first and last tokens of the operator
+        preceding the node, or None."""
+        index = self._start(node)
+        if index is None:
+            return None
+        index -= 1
+        while index >= 0 and self.tokens[index][1] == '(':
+            index -= 1
+        if index < 1:
+            return None
+        first = index
+        if ((self.tokens[index][1], self.tokens[index - 1][1]) in
+            (('not', 'is'), ('in', 'not'))):
+            first = index - 1
+        return first, index
+
+    def _operator_spans(self, node, modified_node):
+        """Returns the (first, last, text) replacements of the operators."""
+        if isinstance(node, ast.BinOp):
+            operators = [(node.right, node.op, modified_node.op)]
+        elif isinstance(node, ast.BoolOp):
+            operators = [(value, node.op, modified_node.op)
+                         for value in node.values[1:]]
+        elif isinstance(node, ast.Compare):
+            operators = zip(node.comparators, node.ops, modified_node.ops)
+        else:
+            return None
+        spans = []
+        for operand, op, modified_op in operators:
+            if type(op) is type(modified_op):
+                continue
+            operator_tokens = self._operator_before(operand)
+            if operator_tokens is None:
+                return None
+            spans.append(operator_tokens +
+                         (OPERATOR_SYMBOLS[type(modified_op)],))
+        return spans
+
+    def _end(self, node, first):
+        """Returns the index of the last token of an expression, or None.
+
+        The end of a node is not recorded in the tree, so it is the first
+        token after which the source of the node parses to the same tree.
+        """
+        if not isinstance(node, ast.expr):
+            return None
+        expected = ast.dump(node)
+        start = self._offset(self.tokens[first][2])
+        depth = 0
+        for index in range(first, len(self.tokens)):
+            token_type, text = self.tokens[index][:2]
+            if token_type == tokenize.NEWLINE:
+                break
+            if text in OPEN_BRACKETS:
+                depth += 1
+            elif text in CLOSE_BRACKETS:
+                depth -= 1
+                if depth < 0:
+                    break
+            source = self.code[start:self._offset(self.tokens[index][3])]
+            try:
+                expression = ast.parse('(%s\n)' % source, mode='eval').body
+            except SyntaxError:
+                continue
+            if ast.dump(expression) == expected:
+                return index
+        return None
+
+    def _literal_span(self, node):
+        """Returns the indexes of the first and last tokens of a literal."""
+        if isinstance(node, ast.Str) and node.col_offset < 0:
+            # The position of multiline strings is the one of their end.
+            for index, token in enumerate(self.tokens):
+                if token[0] == tokenize.STRING and token[3][0] == node.lineno:
+                    return index, index
+            return None
+        first = self._start(node)
+        if first is None:
+            return None
+        last = first
+        if isinstance(node, ast.Num):
+            while (last + 1 < len(self.tokens) and
+                   self.tokens[last][0] != tokenize.NUMBER):
+                last += 1
+        elif isinstance(node, ast.Str):
+            while (last + 1 < len(self.tokens) and
+                   self.tokens[last + 1][0] == tokenize.STRING):
+                last += 1
+        return first, last
+
+    def _replacements(self, node, modified_node):
+        """Returns the (first, last, text) replacements rendering the
+        mutation of node into modified_node, or None."""
+        if (type(node) is type(modified_node) and
+            isinstance(node, (ast.BinOp, ast.BoolOp, ast.Compare))):
+            return self._operator_spans(node, modified_node)
+        if isinstance(modified_node, (ast.Num, ast.Str, ast.Name)):
+            if isinstance(modified_node, ast.Name):
+                text = modified_node.id
+            elif isinstance(modified_node, ast.Num):
+                text = repr(modified_node.n)
+            else:
+                text = repr(modified_node.s)
+            if isinstance(node, (ast.Num, ast.Str, ast.Name)):
+                span = self._literal_span(node)
+            else:
+                first = self._start(node)
+                span = None
+                if first is not None:
+                    last = self._end(node, first)
+                    if last is not None:
+                        span = first, last
+            return span and [span + (text,)]
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Yield):
+            keyword = STATEMENT_KEYWORDS.get(type(modified_node))
+            first = self._start(node)
+            if keyword is None or first is None:
+                return None
+            return [(first, first, keyword)]
+        if (type(node) in STATEMENT_KEYWORDS and
+            type(modified_node) in STATEMENT_KEYWORDS):
+            first = self._start(node)
+            if first is None:
+                return None
+            return [(first, first, STATEMENT_KEYWORDS[type(modified_node)])]
+        return None
+
+    def render(self, site):
+        """Returns the source of the mutant of a MutationSite, or None if the
+        mutation cannot be rendered."""
+        parent, field, index = mutator.get_node(self.tree, site.path)
+        node = getattr(parent, field)
+        if index is not None:
+            node = node[index]
+        replacements = self._replacements(node,
+                                          site.mutator().visit(node))
+        if not replacements:
+            return None
+        code = self.code
+        for first, last, text in sorted(replacements, reverse=True):
+            start = self._offset(self.tokens[first][2])
+            end = self._offset(self.tokens[last][3])
+            code = code[:start] + text + code[end:]
+        return code
+
+    def diff(self, site, filename):
+        """Returns the lines of the unified diff of the mutant of the site,
+        or an empty list if it cannot be rendered."""
+        mutated_code = self.render(site)
+        if mutated_code is None:
+            return []
+        return list(difflib.unified_diff(
+                self.code.splitlines(), mutated_code.splitlines(),
+                '%s (original)' % filename,
+                '%s (mutation %d)' % (filename, site.position),
+                n=1, lineterm=''))
@@ -0,0 +1,66 @@
+import json
+
+import mutator
+
+
+class ResultFile(object):
+    """A result sink writing the result of each mutant to a file, as a JSON
+    line, as soon as it is known.
+
+    Each line holds the 'file', 'line', 'mutator', 'position', 'outcome' and
+    'detail' of a mutant, and its 'path' when it is a MutationSite. The file
+    is flushed after every line, so it can be followed while the mutants
+    run, and a run that is interrupted keeps the results it got.
+
+    Lines holding an 'info' mapping describe the run itself, such as its
+    totals and its shard, so the files of several shards can be merged.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'w')
+
+    def add(self, source_filename, site, outcome, detail):
+        """Writes the result of the mutant of the site."""
+        record = {'file': source_filename,
+                  'line': site.line,
+                  'mutator': site.mutator.__name__,
+                  'position': site.position,
+                  'outcome': outcome,
+                  'detail': detail}
+        if isinstance(site, mutator.MutationSite):
+            record['path'] = site.path
+        self._write(record)
+
+    def add_info(self, info):
+        """Writes a mapping of information about the run."""
+        self._write({'info': info})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def load_results(filename):
+    """Reads a file written by ResultFile, skipping a last line left
+    incomplete by an interrupted run.
+
+    Returns:
+      A tuple (info, records) with the information about the run, merged in
+      the order it was written, and the records of the mutants.
+    """
+    info = {}
+    records = []
+    with open(filename) as result_file:
+        for line in result_file:
+            if not line.endswith('\n'):
+                continue
+            record = json.loads(line)
+            if 'info' in record:
+                info.update(record['info'])
+            else:
+                records.append(record)
+    return info, records
@@ -0,0 +1,249 @@
+from collections import defaultdict
+import math
+import random
+
+# Normal quantile used for the 95% confidence intervals.
+Z_95 = 1.96
+
+# Runs before a sequential estimate may be settled, as the intervals of fewer
+# runs are not reliable.
+MIN_RUNS = 20
+
+
+def z_score(confidence):
+    """Returns the normal quantile of a two-sided confidence level."""
+    low, high = 0.0, 10.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def parse_sample(value):
+    """Parses the --mutations-sample option.
+
+    Returns:
+      A tuple (fraction, count). Values lower than 1 are a fraction of the
+      mutations, greater ones an absolute number of mutations.
+    """
+    if not value:
+        return None, None
+    number = float(value)
+    if number <= 0:
+        raise ValueError('The sample must be positive: %s' % value)
+    if number < 1:
+        return number, None
+    return None, int(number)
+
+
+def parse_shard(value):
+    """Parses the --mutations-shard option.
+
+    Returns:
+      A tuple (shard, shards), or None if there is no value. The shards are
+      numbered from 1.
+    """
+    if not value:
+        return None
+    shard, _, shards = value.partition('/')
+    shard, shards = int(shard), int(shards)
+    if not 1 <= shard <= shards:
+        raise ValueError('The shard must be I/N with 1 <= I <= N: %s' % value)
+    return shard, shards
+
+
+def shard_sites(sites_by_file, shard, shards, key, cost):
+    """Selects the sites of one shard of the mutants.
+
+    The mutants are taken in the order of their keys, and each one goes to
+    the shard with the lowest cost so far, the first one on ties. As the keys
+    and the costs are the same on every machine, the shards are disjoint and
+    cover all the mutants, and they have about the same cost.
+
+    Args:
+      sites_by_file: an OrderedDict mapping filenames to their sites.
+      shard: the number of the shard, from 1 to shards.
+      shards: the number of shards.
+      key: function returning a string identifying a (filename, site) pair
+          on every machine.
+      cost: function returning the cost of running the mutant of a
+          (filename, site) pair, which is the same on every machine.
+    Returns:
+      An OrderedDict with the same keys and the sites of the shard, in their
+      original order.
+    """
+    mutants = sorted((key(filename, site), filename, site)
+                     for filename, sites in sites_by_file.iteritems()
+                     for site in sites)
+    costs = [0] * shards
+    selected = set()
+    for _, filename, site in mutants:
+        lightest = costs.index(min(costs))
+        costs[lightest] += cost(filename, site)
+        if lightest == shard - 1:
+            selected.add((filename, site))
+    return type(sites_by_file)(
+            (filename, [site for site in sites
+                        if (filename, site) in selected])
+            for filename, sites in sites_by_file.iteritems())
+
+
+class MutantSampler(object):
+    """Selects a reproducible random sample of the mutation sites.
+
+    At most max_per_line sites are kept for each line. The sample is then
+    stratified by mutator: the budget is split evenly among the mutators, and
+    the part a mutator cannot use goes to the others, so the mutators with
+    many sites do not crowd out the rest. Every mutator gets at least one
+    site, even beyond the budget, so the estimate covers all of them.
+    """
+
+    def __init__(self, fraction=None, count=None, max_per_line=None, seed=0):
+        self.fraction = fraction
+        self.count = count
+        self.max_per_line = max_per_line
+        self.seed = seed
+        self.population = defaultdict(int)
+
+    def _cap_lines(self, rng, sites_by_file):
+        """Returns the (filename, site) pairs respecting max_per_line."""
+        selected = []
+        for filename, sites in sites_by_file.iteritems():
+            sites_by_line = defaultdict(list)
+            for site in sites:
+                sites_by_line[site.line].append(site)
+            for line in sorted(sites_by_line):
+                line_sites = sites_by_line[line]
+                if self.max_per_line and len(line_sites) > self.max_per_line:
+                    line_sites = rng.sample(line_sites, self.max_per_line)
+                selected.extend((filename, site) for site in line_sites)
+        return selected
+
+    def sample(self, sites_by_file):
+        """Returns a sample of the sites.
+
+        Args:
+          sites_by_file: an OrderedDict mapping filenames to their sites.
+        Returns:
+          An OrderedDict with the same keys and the selected sites, in their
+          original order.
+        """
+        rng = random.Random(self.seed)
+        self.population = defaultdict(int)
+        for sites in sites_by_file.itervalues():
+            for site in sites:
+                self.population[site.mutator.__name__] += 1
+
+        strata = defaultdict(list)
+        for filename, site in self._cap_lines(rng, sites_by_file):
+            strata[site.mutator.__name__].append((filename, site))
+        total = sum(len(stratum) for stratum in strata.itervalues())
+        budget = total
+        if self.count is not None:
+            budget = min(self.count, total)
+        elif self.fraction is not None:
+            budget = int(round(self.fraction * total))
+        budget = max(budget, len(strata))
+
+        selected = set()
+        names = sorted(strata, key=lambda name: (len(strata[name]), name))
+        for index, name in enumerate(names):
+            share = budget // (len(names) - index)
+            chosen = rng.sample(strata[name], min(share, len(strata[name])))
+            selected.update(chosen)
+            budget -= len(chosen)
+
+        return type(sites_by_file)(
+                (filename, [site for site in sites
+                            if (filename, site) in selected])
+                for filename, sites in sites_by_file.iteritems())
+
+
+def stratified_estimate(population, sampled, killed):
+    """Estimates the mutation score of the population from a sample.
+
+    The variance of each stratum is the Agresti-Coull one, which does not
+    vanish when a stratum has a single run or when all its runs agree. The
+    score of the strata without runs is unknown, so the interval is widened
+    to cover any score for them.
+
+    Args:
+      population: mapping from stratum to the number of mutations in it.
+      sampled: mapping from stratum to the number of mutations run.
+      killed: mapping from stratum to the number of mutations killed.
+    Returns:
+      A tuple (score, half_width, unsampled) with the estimated ratio of
+      killed mutations, the half width of its 95% confidence interval, and
+      the number of mutations in the strata without runs.
+    """
+    total = sum(population.itervalues())
+    if not total:
+        return 0.0, 0.0, 0
+    z2 = Z_95 ** 2
+    score = 0.0
+    variance = 0.0
+    unsampled = 0
+    for name, size in population.iteritems():
+        runs = sampled.get(name, 0)
+        if not runs:
+            unsampled += size
+            continue
+        weight = float(size) / total
+        score += weight * killed.get(name, 0) / runs
+        adjusted = (killed.get(name, 0) + z2 / 2) / (runs + z2)
+        correction = 1 - float(runs) / max(size, runs)
+        variance += (weight ** 2 * correction * adjusted * (1 - adjusted) /
+                     (runs + z2))
+    unknown = float(unsampled) / total
+    return (score + unknown / 2, Z_95 * math.sqrt(variance) + unknown / 2,
+            unsampled)
+
+
+class SequentialEstimator(object):
+    """Running estimate of the mutation score of a finite population.
+
+    The mutants must be drawn in random order. The confidence interval is
+    the Wilson score interval, with the finite population correction applied
+    to the number of runs, so the interval always contains the observed
+    ratio and shrinks to it once the whole population ran.
+    """
+
+    def __init__(self, population, confidence=0.95):
+        self.population = population
+        self.confidence = confidence
+        self.z = z_score(confidence)
+        self.runs = 0
+        self.killed = 0
+
+    def add(self, killed):
+        """Records the result of a mutant."""
+        self.runs += 1
+        if killed:
+            self.killed += 1
+
+    def estimate(self):
+        """Returns the estimated score and the half width of its interval."""
+        if not self.runs:
+            return 0.0, 1.0
+        ratio = float(self.killed) / self.runs
+        if self.runs >= self.population:
+            return ratio, 0.0
+        correction = (float(self.population - self.runs) /
+                      max(self.population - 1, 1))
+        runs = self.runs / correction
+        z2 = self.z ** 2
+        denominator = 1 + z2 / runs
+        center = (ratio + z2 / (2 * runs)) / denominator
+        half_width = (self.z / denominator *
+                      math.sqrt(ratio * (1 - ratio) / runs +
+                                z2 / (4 * runs ** 2)))
+        return center, half_width
+
+    def settled(self, precision):
+        """Returns whether the interval is narrower than +/- precision, after
+        at least MIN_RUNS runs."""
+        return (self.runs >= min(MIN_RUNS, self.population) and
+                self.estimate()[1] <= precision)
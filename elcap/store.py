@@ -0,0 +1,282 @@
+import ast
+import cPickle as pickle
+from collections import namedtuple
+from collections import OrderedDict
+import hashlib
+import imp
+import inspect
+import marshal
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import budget
+import equivalence
+import hotpatch
+import importer
+import mutator
+
+# Version of the layout of the stored files.
+STORE_VERSION = 1
+
+
+class StoredMutant(namedtuple('StoredMutant',
+                              'site names fingerprints offset size error')):
+    """Metadata of a mutant in the store.
+
+    Attributes:
+      site: the MutationSite of the mutant, with its line, column and mutator.
+      names: the names of the function enclosing the site, as returned by
+          hotpatch.function_names, or None.
+      fingerprints: the fingerprints of the unit holding the site, as returned
+          by MutantPruner.fingerprints.
+      offset: offset of the marshalled code of the mutant in the data file.
+      size: size of the marshalled code of the mutant.
+      error: the error raised when compiling the mutant, or None.
+    """
+    __slots__ = ()
+
+
+def source_hash(code):
+    """Returns the hash identifying a version of the source code."""
+    return hashlib.sha1(code).hexdigest()
+
+
+def mutators_hash(mutator_classes):
+    """Returns a hash of the source of the modules making the mutants: the
+    modules of the mutators, and the modules applying them."""
+    modules = set([mutator, budget])
+    modules.update(sys.modules[mutator_class.__module__]
+                   for mutator_class in mutator_classes)
+    digest = hashlib.sha1()
+    for module in sorted(modules, key=lambda module: module.__name__):
+        try:
+            source = inspect.getsource(module)
+        except (IOError, TypeError):
+            source = ''
+        digest.update('%s\0%s\0' % (module.__name__, source))
+    return digest.hexdigest()
+
+
+def store_key(mutator_classes, budgets=False):
+    """Returns what the compiled mutants depend on, besides the source."""
+    return (STORE_VERSION, imp.get_magic(), sys.flags.optimize,
+            tuple('%s.%s' % (mutator_class.__module__, mutator_class.__name__)
+                  for mutator_class in mutator_classes),
+            mutators_hash(mutator_classes), budgets)
+
+
+def write_file(filename, data):
+    """Writes the file atomically, so readers never see it half written."""
+    fd, temporary_filename = tempfile.mkstemp(
+            dir=os.path.dirname(filename),
+            prefix=os.path.basename(filename))
+    with os.fdopen(fd, 'wb') as temporary_file:
+        temporary_file.write(data)
+    os.rename(temporary_filename, filename)
+
+
+def generate_file(index_filename, data_filename, filename, code,
+                  mutator_classes, budgets=False, sites=None, mutants=()):
+    """Compiles the mutants of sites of a source file and stores them with
+    the mutants already stored.
+
+    Args:
+      index_filename: the file where the index of the mutants is written.
+      data_filename: the file where the marshalled mutants are written.
+      filename: the filename of the source file.
+      code: the source code of the file.
+      mutator_classes: the classes of the mutators to apply.
+      budgets: whether the loops of the mutated functions are instrumented
+          with budget checks.
+      sites: the MutationSites to compile, by default all the sites of the
+          mutators.
+      mutants: the StoredMutants already in the data file, which are kept.
+    Returns:
+      The index of the file.
+    """
+    if sites is None:
+        sites = mutator.mutation_sites(mutator_classes, code,
+                                       lambda line, line_no: True)
+    tree = ast.parse(code)
+    pruner = equivalence.MutantPruner(code, filename)
+    mutants = list(mutants)
+    chunks = []
+    if mutants:
+        with open(data_filename, 'rb') as data_file:
+            chunks.append(data_file.read())
+    offset = sum(len(chunk) for chunk in chunks)
+    for site in sites:
+        try:
+            module_code = compile(budget.mutant_tree(code, site, budgets),
+                                  filename, 'exec')
+            # The instrumented code differs from the code of the mutant.
+            fingerprints = pruner.fingerprints(
+                    site, None if budgets else module_code)
+            data = marshal.dumps(module_code)
+            error = None
+        except (SyntaxError, TypeError, ValueError) as compile_error:
+            fingerprints = None
+            data = ''
+            error = importer.format_exception(compile_error)
+        mutants.append(StoredMutant(site,
+                                    hotpatch.function_names(tree, site.path),
+                                    fingerprints, offset, len(data), error))
+        chunks.append(data)
+        offset += len(data)
+    index = {'key': store_key(mutator_classes, budgets),
+             'filename': filename,
+             'source_hash': source_hash(code),
+             'mutants': mutants}
+    write_file(data_filename, ''.join(chunks))
+    write_file(index_filename, pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+    return index
+
+
+def _generate_file(args):
+    """Unpacks the arguments of generate_file for Pool.map."""
+    return generate_file(*args)
+
+
+class StoredFile(object):
+    """The stored mutants of a source file, whose code is read on demand."""
+
+    def __init__(self, data_filename, mutants):
+        self.data_filename = data_filename
+        self.mutants = OrderedDict((mutant.site, mutant) for mutant in mutants)
+
+    @property
+    def sites(self):
+        """The stored MutationSites of the file, in the order they were
+        compiled."""
+        return self.mutants.keys()
+
+    def fingerprints(self):
+        """Returns the mapping from site to the fingerprints of its unit."""
+        return dict((site, mutant.fingerprints)
+                    for site, mutant in self.mutants.iteritems())
+
+    def code(self, site):
+        """Returns the module code of the mutant, or None on compile errors."""
+        mutant = self.mutants[site]
+        if mutant.error:
+            return None
+        with open(self.data_filename, 'rb') as data_file:
+            data_file.seek(mutant.offset)
+            return marshal.loads(data_file.read(mutant.size))
+
+
+class MutantStore(object):
+    """Compiled mutants of the source files, kept on disk between runs.
+
+    Each source file has an index, with the metadata of its mutants, and a
+    data file, with their marshalled module code. Only the mutants that are
+    run get compiled, and the mutants of the next runs are added to them. The
+    files are reused while the source, the mutators and the Python version do
+    not change.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.generated = 0
+
+    def _filenames(self, filename):
+        """Returns the index and data filenames of a source file."""
+        digest = hashlib.sha1(os.path.abspath(filename)).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + '.index', base + '.mutants'
+
+    def _read_index(self, filename, code, mutator_classes, budgets):
+        """Returns the stored index of the file, or None if it is stale."""
+        index_filename, data_filename = self._filenames(filename)
+        try:
+            with open(index_filename, 'rb') as index_file:
+                index = pickle.load(index_file)
+        except (IOError, EOFError, ValueError, AttributeError, ImportError,
+                pickle.UnpicklingError):
+            return None
+        if (index.get('key') != store_key(mutator_classes, budgets) or
+            index.get('source_hash') != source_hash(code) or
+            not os.path.exists(data_filename)):
+            return None
+        return index
+
+    def _stored_file(self, filename, index):
+        """Returns the StoredFile of the index of a source file."""
+        return StoredFile(self._filenames(filename)[1], index['mutants'])
+
+    def read(self, sources, mutator_classes, budgets=False):
+        """Returns the mutants of the files already stored, without compiling
+        any.
+
+        Args:
+          sources: mapping from filename to source code.
+          mutator_classes: the classes of the mutators to apply.
+          budgets: whether the loops of the mutated functions are instrumented
+              with budget checks.
+        Returns:
+          A mapping from filename to StoredFile, for the files having stored
+          mutants.
+        """
+        stored = {}
+        for filename, code in sources.iteritems():
+            index = self._read_index(filename, code, mutator_classes,
+                                     budgets)
+            if index:
+                stored[filename] = self._stored_file(filename, index)
+        return stored
+
+    def generate(self, sources, mutator_classes, processes=None,
+                 budgets=False, sites_by_file=None):
+        """Compiles the mutants of the sites that are not stored yet.
+
+        The files are compiled in parallel by a pool of processes.
+
+        Args:
+          sources: mapping from filename to source code.
+          mutator_classes: the classes of the mutators to apply.
+          processes: the number of processes, by default the number of CPUs.
+          budgets: whether the loops of the mutated functions are instrumented
+              with budget checks.
+          sites_by_file: mapping from filename to the MutationSites whose
+              mutants are needed, by default all the sites of the mutators.
+        Returns:
+          A mapping from filename to StoredFile.
+        """
+        indexes = {}
+        missing = []
+        for filename, code in sources.iteritems():
+            index = self._read_index(filename, code, mutator_classes,
+                                     budgets)
+            mutants = index['mutants'] if index else []
+            if sites_by_file is None:
+                sites = mutator.mutation_sites(mutator_classes, code,
+                                               lambda line, line_no: True)
+            else:
+                sites = sites_by_file.get(filename, [])
+            stored_sites = set(mutant.site for mutant in mutants)
+            sites = [site for site in sites if site not in stored_sites]
+            if not sites:
+                if index:
+                    indexes[filename] = index
+                continue
+            missing.append(self._filenames(filename) +
+                           (filename, code, mutator_classes, budgets, sites,
+                            mutants))
+        if missing and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        if len(missing) > 1 and processes != 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                generated = pool.map(_generate_file, missing)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            generated = [_generate_file(args) for args in missing]
+        for index in generated:
+            indexes[index['filename']] = index
+        self.generated = len(generated)
+        return dict((filename, self._stored_file(filename, index))
+                    for filename, index in indexes.iteritems())
@@ -0,0 +1,250 @@
+from collections import defaultdict
+from collections import OrderedDict
+import sys
+import time
+import unittest
+
+import nose.loader
+import nose.result
+import nose.suite
+
+import budget
+from coverage_plugin import make_name
+
+
+class TestIndex(object):
+    """The collected tests, indexed by the names coverage_plugin.make_name
+    gives them, so any subset of them runs without collecting them again.
+
+    The tests refer to the modules loaded when they were collected, so they
+    only see the mutants applied to those modules in place. The modules are
+    kept referenced by the index, as Python clears the globals of the
+    modules that are freed.
+    """
+
+    def __init__(self):
+        self.tests = OrderedDict()
+        self.modules = {}
+        self.test_modules = set()
+
+    def add(self, test):
+        """Adds a nose.case.Test to the index."""
+        self.tests.setdefault(get_test_name(test), []).append(test)
+        if hasattr(test, 'address'):
+            self.test_modules.add(test.address()[1])
+
+    def add_suite(self, test_suite):
+        """Adds all the tests of a suite to the index."""
+        if isinstance(test_suite, unittest.TestSuite):
+            for test in test_suite:
+                self.add_suite(test)
+        elif hasattr(test_suite, 'address'):
+            self.add(test_suite)
+
+    def freeze(self):
+        """Records the modules the tests use, once they are all collected."""
+        self.modules = dict(sys.modules)
+
+    def is_current(self, module_name):
+        """Returns whether the loaded module is the one the tests use, and
+        the modules of the tests are still the loaded ones."""
+        return all(name in self.modules and
+                   self.modules[name] is sys.modules.get(name)
+                   for name in [module_name] + sorted(self.test_modules))
+
+    def covers(self, test_names):
+        """Returns whether all the tests are in the index."""
+        return all(name in self.tests for name in test_names)
+
+    def run(self, test_names):
+        """Runs the tests with the given names until the first failure.
+
+        The tests are grouped again by their context, so the fixtures of
+        their modules and classes run as in a nose run. Otherwise they run in
+        the given order.
+
+        Returns:
+          The KillResult of the run.
+        """
+        tests = [test for name in test_names for test in self.tests[name]]
+        result = KillResult()
+        nose.suite.ContextSuiteFactory()(tests)(result)
+        return result
+
+
+class KillResult(unittest.TestResult):
+    """Result of running the tests against a mutant, which only records the
+    test killing it.
+
+    The run stops at the first failure or error, and its traceback is never
+    formatted.
+
+    Attributes:
+      killer: the name of the test killing the mutant, or None.
+      elapsed: the seconds from the start of the run to the kill.
+      hung: whether the killer exceeded a loop or recursion budget.
+      out_of_memory: whether the killer raised MemoryError.
+    """
+
+    def __init__(self):
+        super(KillResult, self).__init__()
+        self.killer = None
+        self.elapsed = 0.0
+        self.hung = False
+        self.out_of_memory = False
+        self._start_time = time.time()
+
+    def _kill(self, test, err=None):
+        if self.killer is None:
+            self.killer = get_test_name(test)
+            self.elapsed = time.time() - self._start_time
+            self.hung = budget.is_hang(err)
+            self.out_of_memory = bool(err) and issubclass(err[0],
+                                                          MemoryError)
+        self.stop()
+
+    def addError(self, test, err):  # pylint: disable=C0103
+        self._kill(test, err)
+
+    def addFailure(self, test, err):  # pylint: disable=C0103
+        self._kill(test, err)
+
+    def addUnexpectedSuccess(self, test):  # pylint: disable=C0103
+        self._kill(test)
+
+    def wasSuccessful(self):  # pylint: disable=C0103
+        return self.killer is None
+
+
+class TestPrioritizer(object):
+    """Orders the tests covering a mutant so the likely killers run first.
+
+    The tests that killed more mutants of the same line earlier in the run go
+    first, then the ones that killed more mutants of the same function, and
+    the faster ones in the original run break the ties. As the run stops at
+    the first failure, this shortens the runs of the killed mutants.
+    """
+
+    def __init__(self, time_info):
+        self.time_info = time_info
+        self.kills = defaultdict(lambda: defaultdict(int))
+
+    def record(self, keys, killer):
+        """Records that the test killed a mutant with the given keys, such as
+        its line and function."""
+        for key in keys:
+            if key is not None:
+                self.kills[key][killer] += 1
+
+    def kills_for(self, keys):
+        """Returns the kills recorded under the given keys, as a mapping from
+        key to the kills of each test."""
+        return dict((key, dict(self.kills[key])) for key in keys
+                    if key in self.kills)
+
+    def merge(self, kills):
+        """Merges the kills recorded by the prioritizer of another process
+        of the run, as returned by kills_for, keeping the highest count of
+        each test."""
+        for key, key_kills in kills.iteritems():
+            for killer, count in key_kills.iteritems():
+                self.kills[key][killer] = max(self.kills[key][killer], count)
+
+    def order(self, test_names, keys):
+        """Returns the test names sorted by priority for a mutant with the
+        given keys, from the most to the least significant."""
+        kills = [self.kills.get(key, {}) for key in keys]
+
+        def priority(name):
+            return (tuple(-key_kills.get(name, 0) for key_kills in kills) +
+                    (self.time_info.get(name, 0.0), name))
+        return sorted(test_names, key=priority)
+
+
+class TestTimings(object):
+    """Durations of the tests measured several times without coverage, whose
+    tracing slows the tests unevenly.
+
+    Attributes:
+      samples: mapping from test name to the list of its durations.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def add(self, name, duration):
+        """Adds a duration of the test."""
+        self.samples[name].append(duration)
+
+    def median(self, name):
+        """Returns the median duration of the test."""
+        samples = sorted(self.samples[name])
+        middle = len(samples) // 2
+        if len(samples) % 2:
+            return samples[middle]
+        return (samples[middle - 1] + samples[middle]) / 2.0
+
+    def spread(self, name):
+        """Returns the difference between the longest and the shortest
+        durations of the test."""
+        return max(self.samples[name]) - min(self.samples[name])
+
+    def estimate(self, name):
+        """Returns a high estimate of the duration of the test, its median
+        plus its spread."""
+        return self.median(name) + self.spread(name)
+
+
+class IndexingResult(nose.result.TextTestResult):
+    """Result of a nose run that indexes the tests it runs and reports them
+    to the TestCoverage plugin."""
+
+    def __init__(self, test_index, test_coverage, *args, **kwargs):
+        super(IndexingResult, self).__init__(*args, **kwargs)
+        self.test_index = test_index
+        self.test_coverage = test_coverage
+
+    def beforeTest(self, test):  # pylint: disable=C0103
+        self.test_coverage.beforeTest(test)
+
+    def afterTest(self, test):  # pylint: disable=C0103
+        self.test_coverage.afterTest(test)
+        self.test_index.add(test)
+
+
+def get_test_name(test):
+    """Returns the name coverage_plugin.make_name gives to a test, or its id
+    for the tests not wrapped by nose."""
+    if hasattr(test, 'address'):
+        return make_name(test.address())
+    return test.id()
+
+
+def measure(test_index, runs):
+    """Runs each test of the index alone, several times, and returns their
+    TestTimings.
+
+    Args:
+      test_index: the TestIndex of the tests.
+      runs: the number of times each test is run.
+    """
+    timings = TestTimings()
+    for _ in range(runs):
+        for name in test_index.tests:
+            start_time = time.time()
+            test_index.run([name])
+            timings.add(name, time.time() - start_time)
+    return timings
+
+
+def collect(test_names):
+    """Returns a TestIndex of the modules holding the given tests.
+
+    Args:
+      test_names: names of tests as given by coverage_plugin.make_name.
+    """
+    test_index = TestIndex()
+    modules = sorted(set(name.split(':', 1)[0] for name in test_names))
+    test_index.add_suite(nose.loader.TestLoader().loadTestsFromNames(modules))
+    test_index.freeze()
+    return test_index
@@ -14,6 +14,9 @@ setup(
     entry_points={
         'nose.plugins.0.10': [
             'mutations = elcap.plugins:Mutations',
+        ],
+        'console_scripts': [
+            'elcap-merge = elcap.merge:main',
         ]
         },
     py_modules=['plugins'],
@@ -0,0 +1,107 @@
+import ast
+import sys
+
+from unittest2 import TestCase
+
+from elcap import budget
+from elcap import hotpatch
+from elcap import mutator
+
+CODE = """def countdown(n):
+    steps = 0
+    while n > 0:
+        n = n - 1
+        steps += 1
+    return steps
+class A(object):
+    def pairs(self, n):
+        for i in range(n):
+            for j in range(n):
+                yield i * 1, j
+def fact(n):
+    if n <= 1:
+        return 1
+    return n * fact(n - 1)
+"""
+
+
+def get_site(mutator_class, line):
+    return [site for site in mutator.index_sites([mutator_class()],
+                                                 ast.parse(CODE))
+            if site.line == line][0]
+
+
+class TestInstrument(TestCase):
+    def setUp(self):
+        self.budget = budget.Budget(100, 0)
+        self.budget.install()
+
+    def tearDown(self):
+        self.budget.uninstall()
+
+    def _function(self, site):
+        names, function_code = hotpatch.function_code(
+                budget.mutant_tree(CODE, site, True), site.path, 'module.py')
+        namespace = {}
+        exec compile(CODE, 'module.py', 'exec') in namespace
+        function = hotpatch.get_function(
+                type('Module', (object,), namespace), names)
+        self.assertTrue(hotpatch.can_patch(function, function_code))
+        hotpatch.swap_code(function, function_code)
+        return namespace
+
+    def test_loop_within_budget(self):
+        namespace = self._function(get_site(mutator.NumberMutator, 2))
+        self.assertEquals(101, namespace['countdown'](100))
+
+    def test_loop_exceeding_budget(self):
+        namespace = self._function(get_site(mutator.ArithmeticMutator, 4))
+        with self.assertRaisesRegexp(budget.BudgetExceeded, '100 iterations'):
+            namespace['countdown'](3)
+
+    def test_nested_loops(self):
+        namespace = self._function(get_site(mutator.ArithmeticMutator, 11))
+        self.assertEquals(99 * 99, len(list(namespace['A']().pairs(99))))
+        with self.assertRaises(budget.BudgetExceeded):
+            list(namespace['A']().pairs(101))
+
+    def test_module_level_site(self):
+        tree = ast.parse('for i in x:\n    y = 1\n')
+        site = mutator.index_sites([mutator.NumberMutator()], tree)[0]
+        self.assertEquals(ast.dump(tree),
+                          ast.dump(budget.instrument(tree, site.path)))
+
+    def test_uninstall(self):
+        self.budget.uninstall()
+        self.assertFalse(hasattr(__builtins__, budget.BUDGET_NAME))
+
+
+class TestBudget(TestCase):
+    def test_recursion_budget(self):
+        namespace = {}
+        exec compile(CODE, 'module.py', 'exec') in namespace
+        recursion_limit = sys.getrecursionlimit()
+        self.assertEquals(120, budget.Budget(0, 20).run(namespace['fact'], 5))
+        with self.assertRaises(RuntimeError) as context:
+            budget.Budget(0, 20).run(namespace['fact'], 50)
+        self.assertEquals(recursion_limit, sys.getrecursionlimit())
+        self.assertTrue(budget.is_hang((RuntimeError, context.exception,
+                                        None)))
+
+    def test_is_hang(self):
+        self.assertTrue(budget.is_hang((budget.BudgetExceeded,
+                                        budget.BudgetExceeded(), None)))
+        self.assertFalse(budget.is_hang((RuntimeError, RuntimeError('x'),
+                                         None)))
+        self.assertFalse(budget.is_hang(None))
+
+    def test_depth_gauge(self):
+        namespace = {}
+        exec compile(CODE, 'module.py', 'exec') in namespace
+        gauge = budget.DepthGauge()
+        gauge.start()
+        namespace['fact'](10)
+        gauge.stop()
+        self.assertEquals(10, gauge.max_depth)
+        self.assertEquals(2 * 10 + budget.DEPTH_MARGIN,
+                          gauge.budget(5).depth)
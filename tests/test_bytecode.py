@@ -0,0 +1,103 @@
+import ast
+
+from unittest2 import TestCase
+
+from elcap import bytecode
+from elcap import mutator
+
+
+def get_sites(mutator_classes, code):
+    return bytecode.mutation_sites(mutator_classes, code, '<string>',
+                                   lambda line, line_no: True)
+
+
+def run(module_code, expression='result'):
+    namespace = {}
+    exec module_code in namespace
+    return eval(expression, namespace)
+
+
+class TestBytecodeSites(TestCase):
+    def test_same_results_as_ast_engine(self):
+        code = '\n'.join(['a, b = 7, 2',
+                          'result = [a + b, a * b, a // b, a % b, a ** b,',
+                          '          a == b, a < b, a is b, a in [b],',
+                          '          a and b, a or b, True, "s", 3.5]'])
+        mutator_classes = list(bytecode.RULES)
+        module_code = compile(code, '<string>', 'exec')
+
+        # The compiler folds the tuple of constants in the first line.
+        def line_filter(line, line_no):
+            return line_no > 1
+
+        bytecode_results = sorted(
+                run(bytecode.mutate(module_code, site))
+                for site in bytecode.mutation_sites(mutator_classes, code,
+                                                    '<string>', line_filter))
+        ast_results = sorted(
+                run(compile(mutator.mutate(code, site), '<string>', 'exec'))
+                for site in mutator.mutation_sites(mutator_classes, code,
+                                                   line_filter))
+        self.assertEquals(ast_results, bytecode_results)
+
+    def test_sites(self):
+        code = 'import os\nx = 1\ny = x < 2'
+        sites = get_sites([mutator.NumberMutator, mutator.ComparisonMutator],
+                          code)
+        self.assertEquals([(2, 'NumberMutator', 1),
+                           (3, 'NumberMutator', 2),
+                           (3, 'ComparisonMutator', 1)],
+                          [(site.line, site.mutator.__name__, site.position)
+                           for site in sites])
+
+    def test_folded_constants_are_skipped(self):
+        sites = get_sites([mutator.NumberMutator], 'x = 2 * 3')
+        self.assertEquals([], sites)
+
+    def test_unsupported_mutators_are_skipped(self):
+        code = 'for i in x:\n    continue'
+        self.assertEquals([], get_sites([mutator.FlowMutator], code))
+
+    def test_logical_in_conditions(self):
+        code = '\n'.join(['x = a and b',
+                          'if a and b:',
+                          '    pass',
+                          'while a or b or c:',
+                          '    pass'])
+        sites = get_sites([mutator.LogicalMutator], code)
+        self.assertEquals([(1, bytecode.BytecodeSite),
+                           (2, mutator.MutationSite),
+                           (4, mutator.MutationSite)],
+                          [(site.line, type(site)) for site in sites])
+        self.assertEquals(len(mutator.mutation_sites(
+                                  [mutator.LogicalMutator], code,
+                                  lambda line, line_no: True)),
+                          len(sites))
+
+    def test_line_filter(self):
+        code = 'x = 1\ny = 2'
+        sites = bytecode.mutation_sites([mutator.NumberMutator], code,
+                                        '<string>',
+                                        lambda line, line_no: line_no == 2)
+        self.assertEquals([2], [site.line for site in sites])
+
+
+class TestBytecodeMutate(TestCase):
+    def test_future_division(self):
+        code = 'from __future__ import division\nresult = 3 * x'
+        site = get_sites([mutator.ArithmeticMutator], code)[0]
+        module_code = compile(code, '<string>', 'exec')
+        namespace = {'x': 2}
+        exec bytecode.mutate(module_code, site) in namespace
+        self.assertEquals(1.5, namespace['result'])
+
+    def test_nested_code(self):
+        code = 'class A(object):\n    def f(self):\n        return False'
+        site = get_sites([mutator.BooleanMutator], code)[0]
+        self.assertEquals(3, site.line)
+        module_code = compile(code, '<string>', 'exec')
+        mutated_code = bytecode.mutate(module_code, site)
+        self.assertTrue(run(mutated_code, 'A().f()'))
+        self.assertFalse(run(module_code, 'A().f()'))
+        self.assertEquals('f', bytecode.nested_code(mutated_code,
+                                                    site.code_path).co_name)
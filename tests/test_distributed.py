@@ -0,0 +1,120 @@
+import ast
+import socket
+import threading
+
+from unittest2 import TestCase
+
+from elcap import distributed
+from elcap import mutator
+
+
+class TestEncoding(TestCase):
+    def test_names(self):
+        name = distributed.relative_name('/work/src/test_a.py:test_f',
+                                         '/work')
+        self.assertEquals('<root>/src/test_a.py:test_f', name)
+        self.assertEquals('/home/ci/src/test_a.py:test_f',
+                          distributed.absolute_name(name, '/home/ci'))
+        self.assertEquals('package.test_a:test_f',
+                          distributed.relative_name('package.test_a:test_f',
+                                                    '/work'))
+
+    def test_site(self):
+        sites = mutator.index_sites([mutator.ArithmeticMutator()],
+                                    ast.parse('def f(a):\n    return a + 1'))
+        encoded = distributed.json.loads(distributed.json.dumps(
+                distributed.encode_site(sites[0])))
+        self.assertEquals(sites[0], distributed.decode_site(encoded))
+
+    def test_parse_address(self):
+        self.assertEquals(('10.0.0.1', 8000),
+                          distributed.parse_address('10.0.0.1:8000'))
+        self.assertEquals(('localhost', 8000),
+                          distributed.parse_address(':8000'))
+
+
+class TestCoordinator(TestCase):
+    def setUp(self):
+        self.items = dict((item_id, {'id': item_id, 'file': 'a.py',
+                                     'deadline': 1.0})
+                          for item_id in range(3))
+        self.coordinator = distributed.Coordinator(
+                '127.0.0.1:0', self.items, {'a.py': {'module': 'a'}})
+        self.address = '127.0.0.1:%d' % self.coordinator.bind()[1]
+        self.results = []
+        self.served = []
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.start()
+
+    def tearDown(self):
+        self.thread.join(10)
+
+    def _serve(self):
+        try:
+            self.served.append(self.coordinator.serve(self.record))
+        except distributed.WorkerError as error:
+            self.served.append(error)
+
+    def record(self, item_id, outcome, detail):
+        self.results.append((item_id, outcome, detail))
+        return True
+
+    def _work(self, count=None):
+        """Runs the items as a worker, or only receives count of them and
+        leaves, once the coordinator knows. Returns the messages received."""
+        connection = distributed.connect(self.address)
+        connection.send({'ready': 'test'})
+        messages = []
+        for message in iter(connection.receive, None):
+            messages.append(message)
+            if 'item' not in message:
+                break
+            if len(messages) == count:
+                connection.socket.shutdown(socket.SHUT_WR)
+                connection.socket.recv(1)
+                break
+            connection.send({'result': {'id': message['item']['id'],
+                                        'outcome': 'killed',
+                                        'detail': 'test_%d' %
+                                                  message['item']['id']}})
+        connection.close()
+        return messages
+
+    def test_serve(self):
+        messages = self._work()
+        self.assertEquals({'done': True}, messages[-1])
+        self.assertEquals({'module': 'a'}, messages[0]['file_info'])
+        self.assertNotIn('file_info', messages[1])
+        self.thread.join(10)
+        self.assertEquals([True], self.served)
+        self.assertEquals([(item_id, 'killed', 'test_%d' % item_id)
+                           for item_id in range(3)], self.results)
+
+    def test_lost_worker(self):
+        lost = self._work(count=1)
+        messages = self._work()
+        self.assertEquals(lost[0], messages[0])
+        self.thread.join(10)
+        self.assertEquals([0, 1, 2], [item_id for item_id, _, _ in
+                                      self.results])
+
+    def test_worker_error(self):
+        connection = distributed.connect(self.address)
+        connection.send({'ready': 'test'})
+        connection.receive()
+        connection.send({'error': 'Traceback'})
+        connection.receive()
+        connection.close()
+        self.thread.join(10)
+        self.assertEquals(1, len(self.served))
+        self.assertIsInstance(self.served[0], distributed.WorkerError)
+        self.assertEquals('Traceback', str(self.served[0]))
+        self.assertEquals([], self.results)
+
+    def test_item_lost_too_many_times(self):
+        for _ in range(distributed.MAX_LOSSES):
+            self._work(count=1)
+        self._work()
+        self.thread.join(10)
+        self.assertEquals((0, None, 'lost 2 workers'), self.results[0])
+        self.assertEquals(3, len(self.results))
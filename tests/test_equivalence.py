@@ -0,0 +1,78 @@
+import ast
+
+from unittest2 import TestCase
+
+from elcap import bytecode
+from elcap import equivalence
+from elcap import mutator
+
+
+def get_sites(mutator_classes, code):
+    mutators = [mutator_class() for mutator_class in mutator_classes]
+    return mutator.index_sites(mutators, ast.parse(code))
+
+
+class TestMutantPruner(TestCase):
+    def test_unique_mutants(self):
+        code = 'def f(x):\n    return x + 1\ny = 2'
+        pruner = equivalence.MutantPruner(code, '<string>')
+        sites = get_sites([mutator.NumberMutator, mutator.ArithmeticMutator],
+                          code)
+        self.assertEquals([None, None, None],
+                          [pruner.check(site) for site in sites])
+
+    def test_equivalent_mutant(self):
+        code = 'def f(x):\n    if 0:\n        return 1 + 1\n    return x'
+        pruner = equivalence.MutantPruner(code, '<string>')
+        sites = get_sites([mutator.NumberMutator], code)
+        # The compiler removes the dead code of the if statement.
+        self.assertEquals([None, equivalence.EQUIVALENT,
+                           equivalence.EQUIVALENT],
+                          [pruner.check(site) for site in sites])
+
+    def test_duplicate_mutant(self):
+        code = 'x = y * 2'
+        pruner = equivalence.MutantPruner(code, '<string>')
+
+        class DivisionMutator(mutator.BaseMutator):
+            def visit_BinOp(self, node):
+                return ast.BinOp(node.left, ast.Div(), node.right)
+
+        sites = get_sites([mutator.ArithmeticMutator, DivisionMutator], code)
+        self.assertEquals([None, equivalence.DUPLICATE],
+                          [pruner.check(site) for site in sites])
+
+    def test_bytecode_sites(self):
+        code = 'def f(x):\n    return x + 1'
+        pruner = equivalence.MutantPruner(code, '<string>')
+        sites = bytecode.mutation_sites([mutator.NumberMutator], code,
+                                        '<string>', lambda line, no: True)
+        self.assertEquals([None], [pruner.check(site) for site in sites])
+        self.assertEquals(equivalence.DUPLICATE, pruner.check(sites[0]))
+
+    def test_mutant_not_compiling(self):
+        code = 'for x in y:\n    try:\n        pass\n    finally:\n        break'
+        pruner = equivalence.MutantPruner(code, '<string>')
+        sites = get_sites([mutator.FlowMutator], code)
+        self.assertEquals([None], [pruner.check(site) for site in sites])
+
+    def test_invalid_mutant_tree(self):
+        code = 'x = 1'
+        pruner = equivalence.MutantPruner(code, '<string>')
+
+        class MissingNumberMutator(mutator.BaseMutator):
+            def visit_Num(self, node):
+                return ast.Num(None)
+
+        sites = get_sites([MissingNumberMutator], code)
+        self.assertIsNone(pruner.fingerprints(sites[0]))
+        self.assertEquals([None], [pruner.check(site) for site in sites])
+
+    def test_fingerprints_of_compiled_module(self):
+        code = 'x = 1\nclass A(object):\n    def f(self):\n        return 2'
+        pruner = equivalence.MutantPruner(code, '<string>')
+        for site in get_sites([mutator.NumberMutator], code):
+            module_code = compile(mutator.mutate(code, site), '<string>',
+                                  'exec')
+            self.assertEquals(pruner.fingerprints(site),
+                              pruner.fingerprints(site, module_code))
@@ -0,0 +1,87 @@
+import ast
+
+from unittest2 import TestCase
+
+from elcap import hotpatch
+from elcap import mutator
+
+CODE = """from __future__ import division
+x = 1 + 2
+def f(a):
+    return a / 2
+class A(object):
+    @staticmethod
+    def g(a):
+        return a - 3
+    def __h(self):
+        return self.__v + 4
+"""
+
+
+def get_sites(mutator_class):
+    return mutator.index_sites([mutator_class()], ast.parse(CODE))
+
+
+class TestFunctionMutant(TestCase):
+    def setUp(self):
+        self.namespace = {}
+        exec compile(CODE, 'module.py', 'exec') in self.namespace
+
+    def test_module_level_site(self):
+        site = get_sites(mutator.NumberMutator)[0]
+        self.assertIsNone(hotpatch.function_mutant(CODE, site, 'module.py'))
+
+    def test_function_site(self):
+        site = get_sites(mutator.ArithmeticMutator)[1]
+        names, function_code = hotpatch.function_mutant(CODE, site,
+                                                        'module.py')
+        self.assertEquals(['f'], names)
+        function = self.namespace['f']
+        self.assertTrue(hotpatch.can_patch(function, function_code))
+        original_code = hotpatch.swap_code(function, function_code)
+        self.assertEquals(6, function(3))
+        hotpatch.swap_code(function, original_code)
+        # The __future__ division is kept.
+        self.assertEquals(1.5, function(3))
+
+    def test_static_method_site(self):
+        site = get_sites(mutator.ArithmeticMutator)[2]
+        names, function_code = hotpatch.function_mutant(CODE, site,
+                                                        'module.py')
+        self.assertEquals(['A', 'g'], names)
+        function = hotpatch.get_function(self.namespace['A'], names[1:])
+        hotpatch.swap_code(function, function_code)
+        self.assertEquals(6, self.namespace['A'].g(3))
+
+    def test_private_names_are_mangled(self):
+        site = get_sites(mutator.ArithmeticMutator)[3]
+        names, function_code = hotpatch.function_mutant(CODE, site,
+                                                        'module.py')
+        self.assertEquals(['A', '__h'], names)
+        self.assertIn('_A__v', function_code.co_names)
+
+    def test_can_patch_other_function(self):
+        site = get_sites(mutator.ArithmeticMutator)[1]
+        names, function_code = hotpatch.function_mutant(CODE, site,
+                                                        'module.py')
+        self.assertFalse(hotpatch.can_patch(None, function_code))
+        self.assertFalse(hotpatch.can_patch(lambda a: a, function_code))
+
+
+class TestGetFunction(TestCase):
+    def test_get_function(self):
+        class A(object):
+            def f(self):
+                pass
+
+            @classmethod
+            def g(cls):
+                pass
+
+            h = property(f)
+
+        self.assertEquals(A.__dict__['f'], hotpatch.get_function(A, ['f']))
+        self.assertEquals(A.__dict__['g'].__func__,
+                          hotpatch.get_function(A, ['g']))
+        self.assertIsNone(hotpatch.get_function(A, ['h']))
+        self.assertIsNone(hotpatch.get_function(A, ['i']))
@@ -1,5 +1,7 @@
 import os
+import shutil
 import sys
+import tempfile
 
 from unittest2 import TestCase
 
@@ -24,6 +26,17 @@ class TestImporter(TestCase):
         import testmodule
         self.assertEquals(testmodule.pi, "3.141592...")
 
+    def test_register_module_with_globals(self):
+        self.importer.register('testmodule', compile('pi = e + 1', os.path.join(os.path.dirname(__file__), 'testmodule.py'), 'exec'), {'e': 2})
+        import testmodule
+        self.assertEquals(testmodule.pi, 3)
+
+    def test_unregister(self):
+        self.importer.register('testmodule', compile('pi = "3.141592..."', os.path.join(os.path.dirname(__file__), 'testmodule.py'), 'exec'))
+        self.importer.unregister()
+        import testmodule
+        self.assertEquals(testmodule.pi, 3.1415926535)
+
     def test_uninstall(self):
         self.importer.register('testmodule', compile('pi = "3.141592..."', os.path.join(os.path.dirname(__file__), 'testmodule.py'), 'exec'))
         self.importer.uninstall()
@@ -74,3 +87,50 @@ class TestImporter(TestCase):
         self.assertEquals('a.b', get_package('a.b.c', False))
         self.assertEquals('a.b.c', get_package('a.b.c', True))
         self.assertEquals('', get_package('a', False))
+
+
+class TestImportGraph(TestCase):
+    modules = {'graphbase.py': 'x = 1\n',
+               'graphuser.py': 'from graphbase import x\n',
+               'graphtop.py': 'import graphuser\n',
+               'graphother.py': 'import os\n',
+               'graphpkg/__init__.py': '',
+               'graphpkg/a.py': 'import graphbase\n',
+               'graphpkg/b.py': 'from . import a\n'}
+
+    def setUp(self):
+        self.base_modules = sys.modules.keys()
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'graphpkg'))
+        for filename, code in self.modules.iteritems():
+            with open(os.path.join(self.directory, filename), 'w') as fd:
+                fd.write(code)
+        sys.path.insert(0, self.directory)
+        self.graph = importer.ImportGraph()
+        self.graph.install()
+        try:
+            import graphtop, graphother, graphpkg.b
+        finally:
+            self.graph.uninstall()
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        unload_modules(exclude=self.base_modules)
+        shutil.rmtree(self.directory)
+
+    def test_uninstall(self):
+        import __builtin__
+        self.assertNotEqual(self.graph._import, __builtin__.__import__)
+
+    def test_dependents(self):
+        self.assertEquals(set(['graphbase', 'graphuser', 'graphtop',
+                               'graphpkg.a', 'graphpkg.b', __name__]),
+                          self.graph.dependents('graphbase'))
+        self.assertEquals(set(['graphother', __name__]),
+                          self.graph.dependents('graphother'))
+
+    def test_dependents_of_package(self):
+        self.assertEquals(set(['graphpkg', 'graphpkg.a', 'graphpkg.b',
+                               __name__]),
+                          self.graph.dependents('graphpkg'))
+        self.assertIn('graphpkg.a', self.graph.modules)
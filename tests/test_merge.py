@@ -0,0 +1,83 @@
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+from unittest.runner import _WritelnDecorator
+
+from unittest2 import TestCase
+
+from elcap import merge
+from elcap import mutator
+from elcap import plugins
+from elcap import results
+
+
+class TestMerge(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'a.py')
+        with open(self.source, 'w') as source_file:
+            source_file.write('x = 1\ny = x + 2\n')
+        self.output = StringIO()
+        self.stream = _WritelnDecorator(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _shard(self, shard, outcomes, root='/ci/job', elapsed=2.0):
+        filename = os.path.join(self.directory, 'shard-%d.jsonl' %
+                                len(os.listdir(self.directory)))
+        result_file = results.ResultFile(filename)
+        result_file.add_info({'shard': shard, 'shards': 2, 'mutations': 4,
+                              'files': 1, 'root': root,
+                              'pruned': {'equivalent': 1, 'duplicate': 0,
+                                         'subsumed': 0}})
+        for position, outcome in outcomes:
+            result_file.add(os.path.join(root, 'a.py'), mutator.MutationSite(
+                    2, 4, (), mutator.NumberMutator, position), outcome,
+                    None)
+        if elapsed is not None:
+            result_file.add_info({'elapsed': elapsed})
+        result_file.close()
+        return filename
+
+    def test_merge(self):
+        filenames = [
+                self._shard(1, [(1, plugins.KILLED), (2, plugins.SURVIVED)]),
+                self._shard(2, [(3, plugins.TIMEOUT), (4, plugins.KILLED)],
+                            root='/ci/other', elapsed=3.0)]
+        self.assertTrue(merge.merge(filenames, self.stream, self.directory))
+        output = self.output.getvalue()
+        self.assertIn('Mutation survived at %s:2 (2) using mutator '
+                      'NumberMutator:\n\ty = x + 2\n' % self.source, output)
+        self.assertIn('4 mutations performed (survived 1) on 1 files in '
+                      '3.000s\n1 mutations timed out\n1 mutations pruned',
+                      output)
+        self.assertNotIn('Warning', output)
+
+    def test_incomplete(self):
+        filenames = [
+                self._shard(1, [(1, plugins.KILLED), (2, plugins.SURVIVED)],
+                            elapsed=None),
+                self._shard(1, [(2, plugins.SURVIVED)])]
+        self.assertFalse(merge.merge(filenames, self.stream,
+                                     '/nonexistent'))
+        output = self.output.getvalue()
+        self.assertIn('2 mutations performed (survived 1)', output)
+        self.assertIn('Warning: 1 mutations were run by several shards',
+                      output)
+        self.assertIn('Warning: missing shards 2 of 2', output)
+        self.assertIn('Warning: 1 of the runs were interrupted', output)
+        self.assertIn('Warning: 2 of the 4 mutations have no result', output)
+
+    def test_main(self):
+        filename = self._shard(1, [])
+        self.assertEquals(1, merge.main([filename]))
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            with self.assertRaises(SystemExit):
+                merge.main([])
+        finally:
+            sys.stderr = stderr
@@ -1,8 +1,34 @@
+import ast
+from collections import OrderedDict
+import imp
+import importlib
+import multiprocessing
+import os
+import shutil
+import signal
+from StringIO import StringIO
+import sys
+import tempfile
+import threading
+import time
+
 from unittest2 import TestCase
 from ludibrio import Stub
 from ludibrio import any
 
+from elcap import budget
+from elcap import bytecode
+from elcap import distributed
+from elcap import importer
+from elcap import mutator
+from elcap import store
+from elcap import suite
+from elcap import plugins
+from elcap import sampling
+from elcap.plugins import MutantImportError
+from elcap.plugins import MutantLoader
 from elcap.plugins import MutationRunner
+from elcap.plugins import unload_modules
 
 class TestMutationRunner(TestCase):
     def test_init(self):
@@ -58,3 +84,593 @@ class TestMutationRunner(TestCase):
             run(argv=any(), addplugins=any()) >> True
         runner = MutationRunner(mutations_path='/mutations/path', test_selector=selector)
         runner.run(None)
+
+    def test_time_limit(self):
+        site = mutator.MutationSite(3, 0, (), mutator.NumberMutator, 3)
+        with Stub() as test_coverage:
+            test_coverage.coverage_info >> {'a.py': {3: ['timed', 'untimed']}}
+            test_coverage.time_info >> {'timed': 5.0, 'untimed': 0.5}
+        runner = MutationRunner(test_selector=None, timeout_multiplier=2.0,
+                                timeout_floor=0.5)
+        self.assertAlmostEquals(11.0, runner._time_limit('a.py', site,
+                                                         test_coverage))
+        runner.timings = suite.TestTimings()
+        runner.timings.add('timed', 1.0)
+        runner.timings.add('timed', 1.5)
+        runner.load_factor = 2.0
+        self.assertAlmostEquals(9.0, runner._time_limit('a.py', site,
+                                                        test_coverage))
+        runner.timeout_floor = 20.0
+        self.assertAlmostEquals(20.0, runner._time_limit('a.py', site,
+                                                         test_coverage))
+
+    def test_estimate_in_draw_order(self):
+        runner = MutationRunner(test_selector=None,
+                                stream=plugins.NullStream())
+        runner._report_survivor = lambda *args, **kwargs: None
+        runner.estimator = sampling.SequentialEstimator(4)
+        site = mutator.MutationSite(1, 0, (), mutator.NumberMutator, 1)
+        # The mutant 0 survives, but the mutants 1 and 2 are killed first.
+        runner._report_result(2, 'a.py', site, False)
+        runner._report_result(1, 'a.py', site, False)
+        self.assertEquals(0, runner.estimator.runs)
+        runner._report_result(0, 'a.py', site, True)
+        self.assertEquals(3, runner.estimator.runs)
+        self.assertEquals(2, runner.estimator.killed)
+        self.assertEquals({}, runner.unestimated)
+
+    def test_shard_sites(self):
+        sites = [mutator.MutationSite(line, 0, (), mutator.NumberMutator,
+                                      line) for line in range(1, 41)]
+        shards = []
+        for root in ('/ci/job', '/home/ci/other'):
+            sites_by_file = OrderedDict([(root + '/a.py', sites)])
+            with Stub() as test_coverage:
+                test_coverage.coverage_info >> {root + '/a.py': dict(
+                        (line, ['test_%d' % test for test in range(line % 3)])
+                        for line in range(1, 41))}
+            shards.append([
+                    MutationRunner(test_selector=None, mutations_path=root,
+                                   shard=(shard, 4))._shard_sites(
+                            sites_by_file, test_coverage).values()[0]
+                    for shard in range(1, 5)])
+        self.assertEquals(shards[0], shards[1])
+        self.assertEquals(sites, sorted(site for shard in shards[0]
+                                        for site in shard))
+
+
+class TestParallelRunner(TestCase):
+    def setUp(self):
+        self.runner = MutationRunner(processes=2, stream=StringIO(),
+                                     test_selector=None)
+        self.runner._reset_results()
+        self.runner._make_loader = lambda: Stub()
+        self.runner._start_file = lambda source_filename, sites: None
+        self.runner._report_survivor = lambda *args, **kwargs: None
+        self.runner._time_limit = lambda *args: 0.5
+        self.mutants = [('a.py', mutator.MutationSite(line, 0, (),
+                                                      mutator.NumberMutator,
+                                                      line))
+                        for line in range(1, 7)]
+        self.sites_by_file = {'a.py': [site for _, site in self.mutants]}
+        self.runner.sources = {'a.py': 'x = 1\n' * 6}
+
+    def test_run_parallel(self):
+        self.runner._test_mutant = lambda source_filename, site, *args: (
+                plugins.SURVIVED if site.line % 3 == 0 else plugins.KILLED,
+                None)
+        self.assertTrue(self.runner._run_parallel(
+                self.mutants, self.sites_by_file, None, []))
+        self.assertEquals(6, self.runner.total_mutations)
+        self.assertEquals(2, self.runner.total_mutations_alive)
+
+    def test_run_parallel_sinks(self):
+        class Sink(object):
+            def __init__(self):
+                self.results = []
+
+            def add(self, source_filename, site, outcome, detail):
+                self.results.append((site.line, outcome))
+        sink = Sink()
+        self.runner.sinks.append(sink)
+        self.runner._test_mutant = lambda source_filename, site, *args: (
+                plugins.SURVIVED if site.line % 3 == 0 else plugins.KILLED,
+                None)
+        self.assertTrue(self.runner._run_parallel(
+                self.mutants, self.sites_by_file, None, []))
+        self.assertEquals([(line, plugins.SURVIVED if line % 3 == 0 else
+                            plugins.KILLED) for line in range(1, 7)],
+                          sorted(sink.results))
+
+    def test_run_parallel_failfast(self):
+        self.runner.failfast = True
+        self.runner._test_mutant = lambda source_filename, site, *args: (
+                plugins.SURVIVED if site.line == 1 else plugins.KILLED, None)
+        self.assertFalse(self.runner._run_parallel(
+                self.mutants, self.sites_by_file, None, []))
+        self.assertEquals(1, self.runner.total_mutations_alive)
+
+    def test_run_parallel_shares_kills(self):
+        self.runner._kill_keys = lambda source_filename, site: (
+                (source_filename, 1), None)
+        seen = multiprocessing.Array('i', [-1] * len(self.mutants))
+
+        def test_mutant(source_filename, site, *args):
+            seen[site.line - 1] = self.runner.prioritizer.kills[
+                    source_filename, 1]['test_a']
+            return plugins.KILLED, 'test_a'
+        self.runner._test_mutant = test_mutant
+        self.assertTrue(self.runner._run_parallel(
+                self.mutants, self.sites_by_file, None, []))
+        self.assertEquals({('a.py', 1): {'test_a': 6}},
+                          self.runner.prioritizer.kills_for([('a.py', 1)]))
+        # The last mutants are queued once the first results are recorded.
+        self.assertTrue(seen[4] >= 1 and seen[5] >= 2, list(seen))
+
+    def test_run_parallel_worker_crash(self):
+        def test_mutant(source_filename, site, *args):
+            if site.line == 2:
+                os._exit(3)
+            return plugins.KILLED, None
+        self.runner._test_mutant = test_mutant
+        self.assertTrue(self.runner._run_parallel(
+                self.mutants, self.sites_by_file, None, []))
+        self.assertEquals(6, self.runner.total_mutations)
+        self.assertEquals([('a.py', self.mutants[1][1],
+                            'exited with code 3')],
+                          self.runner.kill_details[plugins.CRASHED])
+
+    def test_run_parallel_runner_error(self):
+        def test_mutant(source_filename, site, *args):
+            if site.line == 2:
+                raise AttributeError('harness')
+            return plugins.KILLED, None
+        self.runner._test_mutant = test_mutant
+        with self.assertRaises(plugins.RunnerError) as context:
+            self.runner._run_parallel(self.mutants, self.sites_by_file, None,
+                                      [])
+        self.assertIn("AttributeError: harness", str(context.exception))
+        self.assertEquals([], self.runner.kill_details[plugins.CRASHED])
+
+    def test_run_parallel_timeout(self):
+        def test_mutant(source_filename, site, *args):
+            if site.line == 3:
+                signal.signal(signal.SIGTERM, signal.SIG_IGN)
+                time.sleep(60)
+            return plugins.KILLED, None
+        self.runner._test_mutant = test_mutant
+        self.assertTrue(self.runner._run_parallel(
+                self.mutants, self.sites_by_file, None, []))
+        self.assertEquals(6, self.runner.total_mutations)
+        self.assertEquals([('a.py', self.mutants[2][1], 'exceeded 0.5s')],
+                          self.runner.kill_details[plugins.TIMEOUT])
+
+    def test_run_parallel_recycle(self):
+        self.runner.recycle_after = 2
+        self.runner._test_mutant = lambda source_filename, site, *args: (
+                plugins.CRASHED, os.getpid())
+        self.assertTrue(self.runner._run_parallel(
+                self.mutants, self.sites_by_file, None, []))
+        self.assertEquals(6, self.runner.total_mutations)
+        pids = [pid for _, _, pid in
+                self.runner.kill_details[plugins.CRASHED]]
+        self.assertTrue(all(pids.count(pid) <= 2 for pid in pids))
+
+
+class TestWorkerFiles(TestCase):
+    modules = OrderedDict([('workerflags', 'unused_flag = True\n'),
+                           ('workeruser', 'import workerflags\n'
+                                          'def f():\n'
+                                          '    return 1\n')])
+
+    def setUp(self):
+        self.base_modules = sys.modules.keys()
+        self.directory = tempfile.mkdtemp()
+        sys.path.insert(0, self.directory)
+        self.runner = MutationRunner(processes=1, stream=StringIO(),
+                                     test_selector=None,
+                                     base_modules=self.base_modules)
+        self.runner._reset_results()
+        self.runner._time_limit = lambda *args: 5.0
+        self.runner._report_survivor = lambda *args, **kwargs: None
+        self.runner.sources = {}
+        self.runner.module_source_mapping = {}
+        self.sites_by_file = OrderedDict()
+        mutators = {'workerflags': mutator.BooleanMutator(),
+                    'workeruser': mutator.NumberMutator()}
+        for module_name, code in self.modules.iteritems():
+            filename = os.path.join(self.directory, module_name + '.py')
+            with open(filename, 'w') as fd:
+                fd.write(code)
+            self.runner.sources[filename] = code
+            self.runner.module_source_mapping[filename] = module_name
+            self.sites_by_file[filename] = mutator.index_sites(
+                    [mutators[module_name]], ast.parse(code))
+        self.runner.import_graph = importer.ImportGraph()
+        self.runner.import_graph.install()
+        try:
+            importlib.import_module('workeruser')
+        finally:
+            self.runner.import_graph.uninstall()
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        unload_modules(exclude=self.base_modules)
+        shutil.rmtree(self.directory)
+
+    def test_file_change_unloads_the_previous_mutant(self):
+        def test_mutant(source_filename, site, *args):
+            self.runner.mutant_loader.load(site)
+            user = importlib.import_module('workeruser')
+            return plugins.KILLED, repr(user.workerflags.unused_flag)
+
+        class Sink(object):
+            def __init__(self):
+                self.flags = []
+
+            def add(self, source_filename, site, outcome, detail):
+                self.flags.append(detail)
+        sink = Sink()
+        self.runner.sinks.append(sink)
+        self.runner._test_mutant = test_mutant
+        mutants = [(filename, site)
+                   for filename, sites in self.sites_by_file.iteritems()
+                   for site in sites]
+        self.assertTrue(self.runner._run_parallel(
+                mutants, self.sites_by_file, None, []))
+        self.assertEquals(['False', 'True'], sink.flags)
+
+
+class TestDistributedWorker(TestCase):
+    modules = {'looper.py': 'def countdown(n):\n'
+                            '    while n > 0:\n'
+                            '        n = n - 1\n'
+                            '    return n\n',
+               'test_looper.py': 'from looper import countdown\n'
+                                 'def test_countdown():\n'
+                                 '    assert countdown(3) == 0\n'}
+
+    def setUp(self):
+        self.base_modules = sys.modules.keys()
+        self.path = list(sys.path)
+        self.directory = tempfile.mkdtemp()
+        for filename, code in self.modules.iteritems():
+            with open(os.path.join(self.directory, filename), 'w') as fd:
+                fd.write(code)
+        self.site = [site for site in mutator.index_sites(
+                             [mutator.ArithmeticMutator()],
+                             ast.parse(self.modules['looper.py']))
+                     if site.line == 3][0]
+        test_name = '<root>/test_looper.py:test_countdown'
+        self.file_info = {'module': 'looper',
+                          'coverage': {'3': [test_name]},
+                          'times': {test_name: 0.01}}
+        self.results = []
+
+    def tearDown(self):
+        sys.path[:] = self.path
+        unload_modules(exclude=self.base_modules)
+        shutil.rmtree(self.directory)
+
+    def _serve(self, **kwargs):
+        items = {0: {'id': 0, 'file': '<root>/looper.py',
+                     'site': distributed.encode_site(self.site),
+                     'deadline': 1.0}}
+        coordinator = distributed.Coordinator(
+                '127.0.0.1:0', items, {'<root>/looper.py': self.file_info})
+        address = '127.0.0.1:%d' % coordinator.bind()[1]
+        thread = threading.Thread(target=coordinator.serve, args=(
+                lambda *result: self.results.append(result) or True,))
+        thread.start()
+        runner = MutationRunner(mutations_path=self.directory,
+                                stream=StringIO(), test_selector=None,
+                                base_modules=self.base_modules, **kwargs)
+        runner._work_for(address)
+        thread.join(10)
+        return runner
+
+    def test_budget(self):
+        self.file_info['budget'] = {'loops': 1000, 'depth': 100}
+        runner = self._serve()
+        self.assertEquals(
+                [(0, plugins.HANG, os.path.join(self.directory,
+                                                'test_looper.py') +
+                  ':test_countdown')],
+                [(item_id, outcome, distributed.absolute_name(
+                          detail, self.directory))
+                 for item_id, outcome, detail in self.results])
+        self.assertFalse(hasattr(__builtins__, budget.BUDGET_NAME))
+        self.assertTrue(runner.mutant_loader.budgets)
+
+    def test_no_budget(self):
+        runner = self._serve(budgets=True)
+        self.assertEquals([(0, plugins.TIMEOUT)],
+                          [result[:2] for result in self.results])
+        self.assertFalse(runner.mutant_loader.budgets)
+
+
+class TestMemoryLimit(TestCase):
+    def test_limit_address_space(self):
+        if plugins.memory_usage() is None:
+            self.skipTest('/proc is not available')
+        soft_limit = plugins.limit_address_space(64)
+        try:
+            with self.assertRaises(MemoryError):
+                'x' * (128 * plugins.MEGABYTE)
+        finally:
+            plugins.restore_address_space(soft_limit)
+        self.assertEquals(soft_limit,
+                          plugins.resource.getrlimit(
+                                  plugins.resource.RLIMIT_AS)[0])
+
+    def test_out_of_memory(self):
+        runner = MutationRunner(test_selector=None)
+        with Stub() as loader:
+            loader.load(any()) >> None
+        runner.mutant_loader = loader
+        runner._kill_keys = lambda source_filename, site: (None, None)
+
+        class Result(object):
+            hung = False
+            out_of_memory = True
+            killer = 'test_buffer'
+
+            def wasSuccessful(self):
+                return False
+        runner._run_nose = lambda test_names, args: Result()
+        runner.supervised = True
+        with Stub() as test_coverage:
+            test_coverage.coverage_info >> {'a.py': {1: ['test_buffer']}}
+        site = mutator.MutationSite(1, 0, (), mutator.NumberMutator, 1)
+        self.assertEquals((plugins.OUT_OF_MEMORY, 'test_buffer'),
+                          runner._test_mutant('a.py', site, test_coverage,
+                                              []))
+
+
+class TestForkRunner(TestCase):
+    def setUp(self):
+        self.runner = MutationRunner(fork=True, test_selector=None)
+        self.runner._time_limit = lambda *args: 0.5
+        self.site = mutator.MutationSite(1, 0, (), mutator.NumberMutator, 1)
+
+    def test_fork_mutant(self):
+        def run_tests(source_filename, site, *args):
+            self.runner.changed = True
+            return plugins.SURVIVED, None
+        self.runner._run_tests = run_tests
+        self.assertEquals((plugins.SURVIVED, None),
+                          self.runner._test_mutant('a.py', self.site, None,
+                                                   []))
+        self.assertFalse(hasattr(self.runner, 'changed'))
+
+    def test_fork_mutant_crash(self):
+        def run_tests(source_filename, site, *args):
+            os._exit(3)
+        self.runner._run_tests = run_tests
+        self.assertEquals((plugins.CRASHED, 'exited with code 3'),
+                          self.runner._test_mutant('a.py', self.site, None,
+                                                   []))
+
+    def test_fork_mutant_runner_error(self):
+        def run_tests(source_filename, site, *args):
+            raise AttributeError('harness')
+        self.runner._run_tests = run_tests
+        with self.assertRaises(plugins.RunnerError) as context:
+            self.runner._test_mutant('a.py', self.site, None, [])
+        self.assertIn("AttributeError: harness", str(context.exception))
+
+    def test_fork_mutant_timeout(self):
+        def run_tests(source_filename, site, *args):
+            time.sleep(60)
+        self.runner._run_tests = run_tests
+        self.assertEquals((plugins.TIMEOUT, 'exceeded 0.5s'),
+                          self.runner._test_mutant('a.py', self.site, None,
+                                                   []))
+
+
+class TestMutantLoader(TestCase):
+    def setUp(self):
+        self.base_modules = sys.modules.keys()
+        self.module_importer = importer.ModuleImporter()
+        self.filename = os.path.join(os.path.dirname(__file__),
+                                     'testmodule.py')
+        with open(self.filename) as fd:
+            self.code = fd.read()
+        mutators = [mutator.NumberMutator(), mutator.StringMutator()]
+        self.sites = mutator.index_sites(mutators, ast.parse(self.code))
+
+    def tearDown(self):
+        unload_modules(exclude=self.base_modules)
+        self.module_importer.uninstall()
+
+    def _make_loader(self, sites=None, **kwargs):
+        loader = MutantLoader(self.module_importer, self.base_modules,
+                              **kwargs)
+        loader.start('testmodule', self.filename, self.code,
+                     sites or self.sites)
+        return loader
+
+    def test_load_module_level_mutant(self):
+        loader = self._make_loader()
+        self.assertIsNone(loader.load(self.sites[0]))
+        import testmodule
+        self.assertAlmostEquals(4.1415926535, testmodule.pi)
+        loader.finish()
+        self.assertNotIn('testmodule', sys.modules)
+
+    def test_load_module_level_mutant_with_import_graph(self):
+        graph = importer.ImportGraph()
+        graph.imported_by['testmodule'].add('dependent_module')
+        graph.modules.update(['testmodule', 'dependent_module',
+                              'unrelated_module'])
+        for module_name in ('dependent_module', 'unrelated_module',
+                            'unknown_module'):
+            sys.modules[module_name] = imp.new_module(module_name)
+        loader = self._make_loader(import_graph=graph)
+        self.assertIsNone(loader.load(self.sites[0]))
+        self.assertAlmostEquals(4.1415926535, sys.modules['testmodule'].pi)
+        self.assertIn('unrelated_module', sys.modules)
+        self.assertNotIn('dependent_module', sys.modules)
+        self.assertNotIn('unknown_module', sys.modules)
+
+    def test_runner_modules_stay_loaded(self):
+        graph = importer.ImportGraph()
+        graph.modules.update(['testmodule', 'tested_module'])
+        for module_name in ('tested_module', 'runner_module'):
+            sys.modules[module_name] = imp.new_module(module_name)
+        loader = self._make_loader(import_graph=graph)
+        loader.settle()
+        # Imported lazily by the runner, or by the tests of a mutant.
+        for module_name in ('runner_module.lazy', 'unknown_module'):
+            sys.modules[module_name] = imp.new_module(module_name)
+        loader.finish()
+        self.assertIn('runner_module', sys.modules)
+        self.assertIn('runner_module.lazy', sys.modules)
+        self.assertIn('tested_module', sys.modules)
+        self.assertNotIn('unknown_module', sys.modules)
+
+    def test_submodules_of_base_modules_stay_loaded(self):
+        self.base_modules.append('base_module')
+        sys.modules['base_module'] = imp.new_module('base_module')
+        sys.modules['base_module.lazy'] = imp.new_module('base_module.lazy')
+        loader = self._make_loader()
+        loader.finish()
+        self.assertIn('base_module.lazy', sys.modules)
+        del sys.modules['base_module.lazy']
+        del sys.modules['base_module']
+
+    def test_load_submodule_mutant_with_import_graph(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(directory, 'scalepkg'))
+            for filename, code in (
+                    ('__init__.py', ''),
+                    ('a.py', 'SCALE = 2\n'),
+                    ('b.py', 'from scalepkg import a\n'
+                             'def scaled(x):\n'
+                             '    return x * a.SCALE\n')):
+                with open(os.path.join(directory, 'scalepkg', filename),
+                          'w') as fd:
+                    fd.write(code)
+            sys.path.insert(0, directory)
+            graph = importer.ImportGraph()
+            graph.install()
+            try:
+                import scalepkg.b
+            finally:
+                graph.uninstall()
+            self.assertEquals(6, scalepkg.b.scaled(3))
+            filename = os.path.join(directory, 'scalepkg', 'a.py')
+            sites = mutator.index_sites([mutator.NumberMutator()],
+                                        ast.parse('SCALE = 2\n'))
+            loader = MutantLoader(self.module_importer, self.base_modules,
+                                  import_graph=graph)
+            loader.start('scalepkg.a', filename, 'SCALE = 2\n', sites)
+            self.assertIsNone(loader.load(sites[0]))
+            from scalepkg import b
+            self.assertEquals(9, b.scaled(3))
+            loader.finish()
+            self.assertNotIn('a', vars(sys.modules['scalepkg']))
+        finally:
+            sys.path.remove(directory)
+            shutil.rmtree(directory)
+
+    def test_load_function_mutant(self):
+        loader = self._make_loader()
+        restore = loader.load(self.sites[1])
+        import testmodule
+        self.assertIn('XXf', testmodule.f.func_code.co_consts)
+        restore()
+        self.assertNotIn('XXf', testmodule.f.func_code.co_consts)
+        self.assertEquals(3.1415926535, testmodule.pi)
+
+    def test_load_function_mutant_reimport(self):
+        loader = self._make_loader(hotpatch=False)
+        self.assertIsNone(loader.load(self.sites[1]))
+        import testmodule
+        self.assertIn('XXf', testmodule.f.func_code.co_consts)
+
+    def test_load_schema_mutant(self):
+        loader = self._make_loader(schemata=True)
+        restore = loader.load(self.sites[2])
+        import testmodule
+        self.assertEquals(3, getattr(testmodule, mutator.ACTIVE_MUTANT))
+        restore()
+        self.assertEquals(0, getattr(testmodule, mutator.ACTIVE_MUTANT))
+
+    def test_load_bytecode_mutants(self):
+        sites = bytecode.mutation_sites([mutator.StringMutator], self.code,
+                                        self.filename,
+                                        lambda line, line_no: True)
+        loader = self._make_loader(sites, engine='bytecode')
+        restore = loader.load(sites[0])
+        import testmodule
+        self.assertIn('XXf', testmodule.f.func_code.co_consts)
+        restore()
+        self.assertNotIn('XXf', testmodule.f.func_code.co_consts)
+
+    def test_load_ast_site_with_bytecode_engine(self):
+        code = 'def f(a, b):\n    if a and b:\n        return 1\n'
+        sites = bytecode.mutation_sites([mutator.LogicalMutator], code,
+                                        self.filename,
+                                        lambda line, line_no: True)
+        self.assertIsInstance(sites[0], mutator.MutationSite)
+        loader = MutantLoader(self.module_importer, self.base_modules,
+                              engine='bytecode', hotpatch=False)
+        loader.start('testmodule', self.filename, code, sites)
+        self.assertIsNone(loader.load(sites[0]))
+        import testmodule
+        self.assertEquals(1, testmodule.f(True, False))
+
+    def test_preload(self):
+        directory = tempfile.mkdtemp()
+        try:
+            test_filename = os.path.join(directory, 'test_preloaded.py')
+            with open(test_filename, 'w') as fd:
+                fd.write('import testmodule\n')
+            loader = self._make_loader()
+            loader.preload([test_filename])
+            self.assertIn('test_preloaded', sys.modules)
+            restore = loader.load(self.sites[1])
+            self.assertIn('XXf', sys.modules['test_preloaded'].testmodule.f
+                          .func_code.co_consts)
+            restore()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_mutant_failing_on_import(self):
+        code = "d = {1: 'a'}\nx = d[1]"
+        sites = mutator.index_sites([mutator.NumberMutator()],
+                                    ast.parse(code))
+        loader = MutantLoader(self.module_importer, self.base_modules)
+        loader.start('testmodule', self.filename, code, sites)
+        with self.assertRaisesRegexp(MutantImportError, 'KeyError: 1'):
+            loader.load(sites[0])
+        self.assertNotIn('testmodule', sys.modules)
+
+    def test_load_mutant_failing_to_compile(self):
+        code = "def f():\n    yield 1\n    yield 2"
+        sites = mutator.index_sites([mutator.YieldMutator()], ast.parse(code))
+        loader = MutantLoader(self.module_importer, self.base_modules)
+        loader.start('testmodule', self.filename, code, sites)
+        with self.assertRaisesRegexp(MutantImportError, 'SyntaxError'):
+            loader.load(sites[0])
+
+    def test_load_stored_mutants(self):
+        directory = tempfile.mkdtemp()
+        try:
+            stored = store.MutantStore(directory).generate(
+                    {self.filename: self.code},
+                    [mutator.NumberMutator, mutator.StringMutator])
+            loader = MutantLoader(self.module_importer, self.base_modules)
+            loader.start('testmodule', self.filename, self.code, self.sites,
+                         stored[self.filename])
+            restore = loader.load(self.sites[1])
+            import testmodule
+            self.assertIn('XXf', testmodule.f.func_code.co_consts)
+            restore()
+            self.assertIsNone(loader.load(self.sites[0]))
+            self.assertAlmostEquals(4.1415926535,
+                                    sys.modules['testmodule'].pi)
+        finally:
+            shutil.rmtree(directory)
@@ -117,6 +117,182 @@ def g(x, y, z):
         compile(node, '<string>', 'exec')
 
 
+class TestMutationSites(TestCase):
+    def test_index_sites(self):
+        code = "x = 1\ny = 'a' + f(2)"
+        sites = mutator.index_sites([mutator.NumberMutator()],
+                                    ast.parse(code))
+        self.assertEquals([(1, 4, 1), (2, 12, 2)],
+                          [(s.line, s.col_offset, s.position) for s in sites])
+        self.assertEquals((('body', 0), ('value', None)), sites[0].path)
+        self.assertEquals(mutator.NumberMutator, sites[0].mutator)
+
+    def test_index_sites_skips_unmodified_nodes(self):
+        code = "x = y\nz = True"
+        sites = mutator.index_sites([mutator.BooleanMutator()],
+                                    ast.parse(code))
+        self.assertEquals([(2, 4)], [(s.line, s.position) for s in sites])
+
+    def test_index_sites_nested_nodes(self):
+        code = "x * i + y"
+        sites = mutator.index_sites([mutator.ArithmeticMutator()],
+                                    ast.parse(code))
+        self.assertEquals(["x * i - y", "x / i + y"],
+                          [codegen.to_source(mutator.mutate(code, s))
+                           for s in sites])
+
+    def test_index_sites_multiple_mutators(self):
+        code = "x = True\ny = 1 + 2"
+        mutators = [mutator.NumberMutator(), mutator.ArithmeticMutator(),
+                    mutator.BooleanMutator()]
+        sites = mutator.index_sites(mutators, ast.parse(code))
+        self.assertEquals([(1, 'BooleanMutator', 2),
+                           (2, 'ArithmeticMutator', 1),
+                           (2, 'NumberMutator', 1),
+                           (2, 'NumberMutator', 2)],
+                          [(s.line, s.mutator.__name__, s.position)
+                           for s in sites])
+
+    def test_mutate_does_not_modify_other_sites(self):
+        code = "x = 1\ny = 2"
+        sites = mutator.index_sites([mutator.NumberMutator()],
+                                    ast.parse(code))
+        self.assertEquals("x = 1\ny = 3",
+                          codegen.to_source(mutator.mutate(code, sites[1])))
+
+    def test_mutate_sets_missing_locations(self):
+        class NegateMutator(mutator.BaseMutator):
+            def visit_Num(self, node):
+                return ast.UnaryOp(ast.USub(), ast.Num(node.n))
+
+        code = "x = 1"
+        sites = mutator.index_sites([NegateMutator()], ast.parse(code))
+        namespace = {}
+        exec compile(mutator.mutate(code, sites[0]), '<string>', 'exec') in \
+            namespace
+        self.assertEquals(-1, namespace['x'])
+
+
+class BoundaryMutator(mutator.ComparisonMutator):
+    mapping = {ast.Gt: ast.GtE,
+               ast.Lt: ast.LtE}
+
+
+class FalseConditionMutator(mutator.BaseMutator):
+    def visit_Compare(self, node):  # pylint: disable=W0613
+        return ast.Name('False', ast.Load())
+
+
+class SwapOperandsMutator(mutator.BaseMutator):
+    def visit_Compare(self, node):
+        return ast.Compare(node.comparators[0], [ast.GtE()], [node.left])
+
+
+class TestSubsumption(TestCase):
+    def test_relational_sufficient_set(self):
+        table = mutator.ComparisonMutator.subsumption[ast.Gt]
+        self.assertEquals(set([ast.GtE, ast.NotEq, 'False']),
+                          set(replacement for replacement in table
+                              if replacement is not ast.Gt and
+                                 not table[replacement]))
+        self.assertEquals(set([ast.NotEq, 'False']), table[ast.Lt])
+        self.assertEquals(set([ast.Lt, ast.GtE, ast.Eq, ast.NotEq, 'True',
+                               'False']),
+                          table[ast.LtE])
+
+    def test_bitwise_subsumption(self):
+        table = mutator.ArithmeticMutator.subsumption
+        self.assertEquals(set([ast.BitOr]), table[ast.BitAnd][ast.BitXor])
+        self.assertEquals(set(), table[ast.BitOr][ast.BitXor])
+        self.assertEquals(set([ast.BitOr]), table[ast.BitXor][ast.BitAnd])
+        self.assertNotIn(ast.Add, table)
+
+    def test_mutation_operators(self):
+        node = ast.parse('x > y').body[0].value
+        self.assertEquals((ast.Gt, ast.LtE),
+                          mutator.mutation_operators(
+                                  node, mutator.ComparisonMutator().visit(node)))
+        self.assertEquals((ast.Gt, 'False'),
+                          mutator.mutation_operators(
+                                  node, FalseConditionMutator().visit(node)))
+        self.assertIsNone(mutator.mutation_operators(
+                node, SwapOperandsMutator().visit(node)))
+
+    def test_remove_subsumed(self):
+        code = "a = x > y\nb = x < y"
+        mutators = [mutator.ComparisonMutator(), BoundaryMutator(),
+                    FalseConditionMutator(), SwapOperandsMutator()]
+        sites = mutator.index_sites(mutators, ast.parse(code))
+        self.assertEquals([(1, 'BoundaryMutator'),
+                           (1, 'FalseConditionMutator'),
+                           (1, 'SwapOperandsMutator'),
+                           (2, 'BoundaryMutator'),
+                           (2, 'FalseConditionMutator'),
+                           (2, 'SwapOperandsMutator')],
+                          [(site.line, site.mutator.__name__) for site in
+                           mutator.remove_subsumed(code, sites)])
+
+    def test_remove_subsumed_keeps_single_mutants(self):
+        code = "x = a & b > c"
+        sites = mutator.index_sites([mutator.ArithmeticMutator(),
+                                     mutator.ComparisonMutator()],
+                                    ast.parse(code))
+        self.assertEquals(sites, mutator.remove_subsumed(code, sites))
+
+
+class TestMutantSchema(TestCase):
+    code = """def f(x, y):
+    for i in range(3):
+        if i == x and True:
+            continue
+        return x * y + i
+    return 'done'
+c = f(1, 2)"""
+
+    def _run(self, code_object, globals_dict):
+        exec code_object in globals_dict
+        return globals_dict['f'](0, 2), globals_dict['f'](1, 3)
+
+    def test_schema_runs_each_mutant(self):
+        mutators = [m() for m in mutator.discover()]
+        sites = mutator.index_sites(mutators, ast.parse(self.code))
+        schema = mutator.build_schema(self.code, sites)
+        schema_code = compile(schema.tree, '<string>', 'exec')
+        self.assertEquals(len(sites), len(schema.ids))
+        self.assertEquals(self._run(compile(self.code, '<string>', 'exec'),
+                                    {}),
+                          self._run(schema_code, {mutator.ACTIVE_MUTANT: 0}))
+        for site in sites:
+            code_object = compile(mutator.mutate(self.code, site), '<string>',
+                                  'exec')
+            self.assertEquals(
+                    self._run(code_object, {}),
+                    self._run(schema_code,
+                              {mutator.ACTIVE_MUTANT: schema.ids[site]}))
+
+    def test_schema_on_call_sites(self):
+        mutators = [mutator.NumberMutator()]
+        sites = mutator.index_sites(mutators, ast.parse(self.code))
+        schema = mutator.build_schema(self.code, sites)
+        self.assertEquals([False, False, True],
+                          [schema.ids[site] in schema.on_call
+                           for site in sites if site.line == 7] +
+                          [schema.ids[site] in schema.on_call
+                           for site in sites if site.line == 2])
+
+    def test_schema_skips_docstrings_and_returns(self):
+        code = """def f():
+    'docstring'
+    yield 'value'"""
+        mutators = [mutator.StringMutator(), mutator.YieldMutator()]
+        sites = mutator.index_sites(mutators, ast.parse(code))
+        schema = mutator.build_schema(code, sites)
+        self.assertEquals([(3, 'StringMutator')],
+                          [(site.line, site.mutator.__name__)
+                           for site in schema.ids])
+        compile(schema.tree, '<string>', 'exec')
+
+
 class TestCodeMutator(TestCase):
     def test_code_mutator_multiple_classes(self):
         def line_filter(line, line_no):
@@ -140,6 +316,30 @@ class TestCodeMutator(TestCase):
                            "x = 1\ny = 2\nz = 4\nw = 4"],
                           [codegen.to_source(m) for line_no, pos, m, class_name in mutations])
 
+    def test_code_mutator_keeps_line_numbers(self):
+        def line_filter(line, line_no):
+            return line == 'y = 2'
+
+        code = "\nx = 1\ny = 2"
+        mutators = [mutator.NumberMutator]
+        mutations = list(mutator.code_mutator(mutators, code, line_filter))
+        self.assertEquals([(3, 2)],
+                          [(line_no, pos) for line_no, pos, m, class_name in mutations])
+
+    def test_code_mutator_filters_before_mutating(self):
+        def line_filter(line, line_no):
+            return False
+
+        def mutate(code, site):
+            self.fail('Mutated a filtered site')
+
+        code = "x = 1\ny = 2"
+        self.addCleanup(setattr, mutator, 'mutate', mutator.mutate)
+        mutator.mutate = mutate
+        mutations = list(mutator.code_mutator([mutator.NumberMutator], code,
+                                              line_filter))
+        self.assertEquals([], mutations)
+
 class TestMutatorDiscoverer(TestCase):
     def test_discoverer_no_arguments(self):
         mutators = [mutator.ArithmeticMutator,
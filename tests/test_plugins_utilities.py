@@ -1,12 +1,24 @@
+import optparse
 import os
+from StringIO import StringIO
 import sys
 
 from unittest2 import TestCase
 
 from elcap import plugins
+from elcap import sampling
 
 
 class TestUtilities(TestCase):
+    def setUp(self):
+        self.modules = sys.modules
+        self.old_modules = dict(sys.modules)
+
+    def tearDown(self):
+        # The interpreter keeps importing into the dict it started with.
+        sys.modules = self.modules
+        sys.modules.update(self.old_modules)
+
     def test_unload_all_modules(self):
         old_modules = dict(sys.modules)
         plugins.unload_modules()
@@ -38,3 +50,31 @@ class TestUtilities(TestCase):
         self.assertEquals(plugins.get_src_filename(filename), filename)
         self.assertEquals(plugins.get_src_filename(filename + 'c'), filename)
 
+    def test_parse_callback(self):
+        parser = optparse.OptionParser()
+        parser.add_option('--shard', action='callback', type='string',
+                          callback=plugins.parse_callback(
+                                  sampling.parse_shard),
+                          dest='shard')
+        options, _ = parser.parse_args(['--shard', '2/3'])
+        self.assertEquals((2, 3), options.shard)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            with self.assertRaises(SystemExit):
+                parser.parse_args(['--shard', '4/3'])
+            self.assertIn('error: option --shard: The shard must be I/N',
+                          sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+
+    def test_sample_and_shard_options(self):
+        parser = optparse.OptionParser()
+        plugins.Mutations().options(parser, {})
+        options, _ = parser.parse_args([])
+        self.assertEquals((None, None), options.mutations_sample)
+        self.assertIsNone(options.mutations_shard)
+        options, _ = parser.parse_args(['--mutations-sample', '0.5',
+                                        '--mutations-shard', '1/2'])
+        self.assertEquals((0.5, None), options.mutations_sample)
+        self.assertEquals((1, 2), options.mutations_shard)
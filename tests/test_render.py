@@ -0,0 +1,84 @@
+import ast
+
+from unittest2 import TestCase
+
+from elcap import mutator
+from elcap import render
+
+
+class FalseConditionMutator(mutator.BaseMutator):
+    def visit_Compare(self, node):  # pylint: disable=W0613
+        return ast.Name('False', ast.Load())
+
+
+class TestMutantRenderer(TestCase):
+    code = '''x = (a + b) * c  # comment
+y = -1 + 2
+z = a.b < (c) and x is not y
+def f():
+    """doc
+    string"""
+    for i in x:
+        continue
+    yield 'a' 'b'
+w = not a in b or f() > g(1)[2]
+'''
+
+    def _render(self, mutator_class, line):
+        renderer = render.MutantRenderer(self.code)
+        sites = mutator.index_sites([mutator_class()], ast.parse(self.code))
+        return [renderer.render(site).split('\n')[line - 1]
+                for site in sites if site.line == line]
+
+    def test_operators(self):
+        self.assertEquals(['x = (a + b) / c  # comment',
+                           'x = (a - b) * c  # comment'],
+                          self._render(mutator.ArithmeticMutator, 1))
+        self.assertEquals(['z = a.b >= (c) and x is not y',
+                           'z = a.b < (c) and x is y'],
+                          self._render(mutator.ComparisonMutator, 3))
+        self.assertEquals(['w = not a not in b or f() > g(1)[2]',
+                           'w = not a in b or f() <= g(1)[2]'],
+                          self._render(mutator.ComparisonMutator, 10))
+        self.assertEquals(['z = a.b < (c) or x is not y'],
+                          self._render(mutator.LogicalMutator, 3))
+
+    def test_literals(self):
+        self.assertEquals(['y = 0 + 2', 'y = -1 + 3'],
+                          self._render(mutator.NumberMutator, 2))
+        self.assertEquals(["    yield 'XXab'"],
+                          self._render(mutator.StringMutator, 9))
+
+    def test_multiline_string(self):
+        renderer = render.MutantRenderer(self.code)
+        site = mutator.index_sites([mutator.StringMutator()],
+                                   ast.parse(self.code))[0]
+        self.assertEquals("    'XXdoc\\n    string'",
+                          renderer.render(site).split('\n')[4])
+
+    def test_statements(self):
+        self.assertEquals(['        break'],
+                          self._render(mutator.FlowMutator, 8))
+        self.assertEquals(["    return 'a' 'b'"],
+                          self._render(mutator.YieldMutator, 9))
+
+    def test_whole_expression(self):
+        self.assertEquals(['z = False and x is not y',
+                           'z = a.b < (c) and False'],
+                          self._render(FalseConditionMutator, 3))
+        self.assertEquals(['w = not False or f() > g(1)[2]',
+                           'w = not a in b or False'],
+                          self._render(FalseConditionMutator, 10))
+
+    def test_diff(self):
+        renderer = render.MutantRenderer(self.code)
+        site = mutator.index_sites([mutator.NumberMutator()],
+                                   ast.parse(self.code))[0]
+        self.assertEquals(['--- m.py (original)',
+                           '+++ m.py (mutation 1)',
+                           '@@ -1,3 +1,3 @@',
+                           ' x = (a + b) * c  # comment',
+                           '-y = -1 + 2',
+                           '+y = 0 + 2',
+                           ' z = a.b < (c) and x is not y'],
+                          renderer.diff(site, 'm.py'))
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+
+from unittest2 import TestCase
+
+from elcap import bytecode
+from elcap import mutator
+from elcap import results
+
+
+class TestResultFile(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'results.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_add(self):
+        result_file = results.ResultFile(self.filename)
+        result_file.add('a.py', mutator.MutationSite(
+                3, 4, (('body', 0),), mutator.NumberMutator, 2),
+                'killed', 'test_a.py:test_f')
+        self.assertEquals(1, len(results.load_results(self.filename)[1]))
+        result_file.add('a.py', bytecode.BytecodeSite(
+                5, 6, (), mutator.StringMutator, 1, ('const', 'XX')),
+                'survived', None)
+        result_file.close()
+        self.assertEquals(
+                [{'file': 'a.py', 'line': 3, 'mutator': 'NumberMutator',
+                  'position': 2, 'outcome': 'killed',
+                  'detail': 'test_a.py:test_f', 'path': [['body', 0]]},
+                 {'file': 'a.py', 'line': 5, 'mutator': 'StringMutator',
+                  'position': 1, 'outcome': 'survived', 'detail': None}],
+                results.load_results(self.filename)[1])
+
+    def test_read_interrupted(self):
+        with open(self.filename, 'w') as result_file:
+            result_file.write('{"outcome": "killed"}\n{"outco')
+        self.assertEquals([{'outcome': 'killed'}],
+                          results.load_results(self.filename)[1])
+
+    def test_info(self):
+        result_file = results.ResultFile(self.filename)
+        result_file.add_info({'shard': 1, 'shards': 2})
+        result_file.add('a.py', mutator.MutationSite(
+                3, 4, (), mutator.NumberMutator, 2), 'survived', None)
+        result_file.add_info({'elapsed': 1.5})
+        result_file.close()
+        info, records = results.load_results(self.filename)
+        self.assertEquals({'shard': 1, 'shards': 2, 'elapsed': 1.5}, info)
+        self.assertEquals(['survived'],
+                          [record['outcome'] for record in records])
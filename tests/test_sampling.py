@@ -0,0 +1,243 @@
+from collections import OrderedDict
+
+from unittest2 import TestCase
+
+from elcap import mutator
+from elcap import sampling
+
+
+def make_sites(mutator_class, lines):
+    return [mutator.MutationSite(line, 0, (), mutator_class, position)
+            for position, line in enumerate(lines, 1)]
+
+
+class TestParseSample(TestCase):
+    def test_parse_sample(self):
+        self.assertEquals((None, None), sampling.parse_sample(None))
+        self.assertEquals((0.25, None), sampling.parse_sample('0.25'))
+        self.assertEquals((None, 30), sampling.parse_sample('30'))
+        with self.assertRaises(ValueError):
+            sampling.parse_sample('-1')
+
+
+class TestShard(TestCase):
+    def setUp(self):
+        self.sites_by_file = OrderedDict([
+                ('a.py', make_sites(mutator.NumberMutator, range(1, 61))),
+                ('b.py', make_sites(mutator.ComparisonMutator, range(1, 41)))])
+
+    def _key(self, filename, site):
+        return '%s:%d:%d' % (filename, site.line, site.position)
+
+    def _cost(self, filename, site):
+        return site.line % 5 + 1
+
+    def _mutants(self, sites_by_file):
+        return [(filename, site)
+                for filename, sites in sites_by_file.iteritems()
+                for site in sites]
+
+    def test_parse_shard(self):
+        self.assertEquals(None, sampling.parse_shard(None))
+        self.assertEquals((2, 3), sampling.parse_shard('2/3'))
+        for value in ('0/3', '4/3', '3'):
+            with self.assertRaises(ValueError):
+                sampling.parse_shard(value)
+
+    def test_shards_are_a_partition(self):
+        shards = [sampling.shard_sites(self.sites_by_file, shard, 3,
+                                       self._key, self._cost)
+                  for shard in range(1, 4)]
+        mutants = [mutant for shard in shards
+                   for mutant in self._mutants(shard)]
+        self.assertEquals(sorted(self._mutants(self.sites_by_file)),
+                          sorted(mutants))
+        costs = [sum(self._cost(*mutant) for mutant in self._mutants(shard))
+                 for shard in shards]
+        # Each shard is within the largest cost of the others.
+        self.assertTrue(max(costs) - min(costs) <= 5, costs)
+        for shard in shards:
+            self.assertEquals(['a.py', 'b.py'], shard.keys())
+            self.assertEquals(sorted(shard['a.py']), shard['a.py'])
+
+    def test_shards_do_not_depend_on_the_order(self):
+        # Each job may see the mutants in another order.
+        reordered = OrderedDict((filename, list(reversed(sites)))
+                                for filename, sites in
+                                reversed(self.sites_by_file.items()))
+        for shard in range(1, 4):
+            self.assertEquals(
+                    set(self._mutants(sampling.shard_sites(
+                            self.sites_by_file, shard, 3, self._key,
+                            self._cost))),
+                    set(self._mutants(sampling.shard_sites(
+                            reordered, shard, 3, self._key, self._cost))))
+
+    def test_costly_mutants_are_spread(self):
+        sites_by_file = OrderedDict([
+                ('a.py', make_sites(mutator.NumberMutator, range(1, 5)))])
+        costs = {1: 10, 2: 1, 3: 1, 4: 1}
+        shards = [sampling.shard_sites(
+                          sites_by_file, shard, 2, self._key,
+                          lambda filename, site: costs[site.line])['a.py']
+                  for shard in (1, 2)]
+        self.assertEquals([[1], [2, 3, 4]],
+                          [[site.line for site in shard] for shard in shards])
+
+
+class TestMutantSampler(TestCase):
+    def setUp(self):
+        self.sites_by_file = OrderedDict([
+                ('a.py', make_sites(mutator.NumberMutator, range(1, 101)) +
+                         make_sites(mutator.BooleanMutator, [1, 2])),
+                ('b.py', make_sites(mutator.ComparisonMutator, [1, 1, 1]))])
+
+    def _count(self, sites_by_file):
+        counts = {}
+        for sites in sites_by_file.itervalues():
+            for site in sites:
+                name = site.mutator.__name__
+                counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def test_sample_is_stratified(self):
+        sampler = sampling.MutantSampler(count=9)
+        sample = sampler.sample(self.sites_by_file)
+        self.assertEquals({'BooleanMutator': 2, 'ComparisonMutator': 3,
+                           'NumberMutator': 4},
+                          self._count(sample))
+        self.assertEquals(['a.py', 'b.py'], sample.keys())
+        self.assertEquals({'BooleanMutator': 2, 'ComparisonMutator': 3,
+                           'NumberMutator': 100},
+                          dict(sampler.population))
+
+    def test_sample_covers_every_stratum(self):
+        sample = sampling.MutantSampler(count=2).sample(self.sites_by_file)
+        self.assertEquals({'BooleanMutator': 1, 'ComparisonMutator': 1,
+                           'NumberMutator': 1},
+                          self._count(sample))
+
+    def test_sample_fraction(self):
+        sampler = sampling.MutantSampler(fraction=0.5)
+        sample = sampler.sample(self.sites_by_file)
+        self.assertEquals(53, sum(self._count(sample).values()))
+
+    def test_sample_is_reproducible(self):
+        samples = [sampling.MutantSampler(count=10, seed=seed).sample(
+                           self.sites_by_file)
+                   for seed in (1, 1, 2)]
+        self.assertEquals(samples[0], samples[1])
+        self.assertNotEquals(samples[0], samples[2])
+
+    def test_sample_keeps_order(self):
+        sample = sampling.MutantSampler(count=20).sample(self.sites_by_file)
+        for filename, sites in sample.iteritems():
+            original = self.sites_by_file[filename]
+            self.assertEquals(sorted(sites, key=original.index), sites)
+
+    def test_max_per_line(self):
+        sampler = sampling.MutantSampler(max_per_line=1)
+        sample = sampler.sample(self.sites_by_file)
+        self.assertEquals(100, len(sample['a.py']))
+        self.assertEquals(range(1, 101),
+                          sorted(site.line for site in sample['a.py']))
+        self.assertEquals(1, len(sample['b.py']))
+
+
+class TestStratifiedEstimate(TestCase):
+    def test_full_population(self):
+        score, half_width, unsampled = sampling.stratified_estimate(
+                {'A': 10, 'B': 30}, {'A': 10, 'B': 30}, {'A': 5, 'B': 30})
+        self.assertAlmostEquals(35 / 40.0, score)
+        self.assertAlmostEquals(0.0, half_width)
+        self.assertEquals(0, unsampled)
+
+    def test_weights_strata(self):
+        score, half_width, _ = sampling.stratified_estimate(
+                {'A': 100, 'B': 300}, {'A': 10, 'B': 10}, {'A': 0, 'B': 10})
+        self.assertAlmostEquals(0.75, score)
+        self.assertTrue(0.1 < half_width < 0.2)
+        score, half_width, _ = sampling.stratified_estimate(
+                {'A': 100}, {'A': 10}, {'A': 5})
+        self.assertAlmostEquals(0.5, score)
+        self.assertTrue(0.2 < half_width < 0.3)
+
+    def test_uniform_strata_keep_a_margin(self):
+        for killed in (0, 1):
+            _, half_width, _ = sampling.stratified_estimate(
+                    {'A': 23}, {'A': 1}, {'A': killed})
+            self.assertTrue(half_width > 0.3)
+        _, half_width, _ = sampling.stratified_estimate(
+                {'A': 23}, {'A': 5}, {'A': 5})
+        self.assertTrue(half_width > 0.1)
+
+    def test_unsampled_strata(self):
+        score, half_width, unsampled = sampling.stratified_estimate(
+                {'A': 30, 'B': 10}, {'A': 30}, {'A': 30})
+        self.assertEquals(10, unsampled)
+        # B may score anything between 0 and 1.
+        self.assertAlmostEquals(0.75, score - half_width)
+        self.assertAlmostEquals(1.0, score + half_width)
+
+    def test_empty(self):
+        self.assertEquals((0.0, 0.0, 0),
+                          sampling.stratified_estimate({}, {}, {}))
+
+
+class TestSequentialEstimator(TestCase):
+    def test_z_score(self):
+        self.assertAlmostEquals(1.96, sampling.z_score(0.95), places=2)
+        self.assertAlmostEquals(2.576, sampling.z_score(0.99), places=3)
+
+    def test_no_runs(self):
+        estimator = sampling.SequentialEstimator(100)
+        self.assertEquals((0.0, 1.0), estimator.estimate())
+        self.assertFalse(estimator.settled(0.5))
+
+    def test_interval_narrows(self):
+        estimator = sampling.SequentialEstimator(10000)
+        widths = []
+        for i in range(400):
+            estimator.add(i % 5 != 0)
+            widths.append(estimator.estimate()[1])
+        self.assertTrue(widths[9] > widths[99] > widths[399])
+        score, half_width = estimator.estimate()
+        self.assertAlmostEquals(0.8, score, places=2)
+        self.assertTrue(estimator.settled(0.04))
+        self.assertFalse(estimator.settled(0.03))
+
+    def test_first_runs_are_not_settled(self):
+        estimator = sampling.SequentialEstimator(10000)
+        estimator.add(True)
+        self.assertFalse(estimator.settled(0.1))
+
+    def test_whole_population(self):
+        estimator = sampling.SequentialEstimator(3)
+        for killed in (True, True, False):
+            estimator.add(killed)
+        self.assertEquals((2 / 3.0, 0.0), estimator.estimate())
+
+    def test_interval_contains_the_ratio(self):
+        estimator = sampling.SequentialEstimator(23)
+        for _ in range(5):
+            estimator.add(True)
+        score, half_width = estimator.estimate()
+        self.assertTrue(score - half_width <= 1.0 <=
+                        score + half_width + 1e-9)
+        self.assertFalse(estimator.settled(0.2))
+        for runs in range(1, 23):
+            estimator = sampling.SequentialEstimator(23)
+            for run in range(runs):
+                estimator.add(run % 3 != 0)
+            score, half_width = estimator.estimate()
+            ratio = float(estimator.killed) / runs
+            self.assertTrue(score - half_width - 1e-9 <= ratio <=
+                            score + half_width + 1e-9)
+
+    def test_minimum_runs(self):
+        estimator = sampling.SequentialEstimator(10000)
+        for _ in range(sampling.MIN_RUNS - 1):
+            estimator.add(True)
+        self.assertFalse(estimator.settled(0.5))
+        estimator.add(True)
+        self.assertTrue(estimator.settled(0.5))
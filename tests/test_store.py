@@ -0,0 +1,113 @@
+import shutil
+import tempfile
+
+from unittest2 import TestCase
+
+from elcap import equivalence
+from elcap import mutator
+from elcap import store
+
+
+class TestMutantStore(TestCase):
+    code = "x = 1\ndef f():\n    yield 'a'\n    yield 'b'"
+    mutator_classes = [mutator.NumberMutator, mutator.YieldMutator]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = store.MutantStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_generate(self):
+        stored = self.store.generate({'a.py': self.code},
+                                     self.mutator_classes)['a.py']
+        self.assertEquals(
+                mutator.mutation_sites(self.mutator_classes, self.code,
+                                       lambda line, line_no: True),
+                stored.sites)
+        namespace = {}
+        exec stored.code(stored.sites[0]) in namespace
+        self.assertEquals(2, namespace['x'])
+        self.assertEquals([None, ['f'], ['f']],
+                          [stored.mutants[site].names
+                           for site in stored.sites])
+
+    def test_mutant_not_compiling(self):
+        stored = self.store.generate({'a.py': self.code},
+                                     self.mutator_classes)['a.py']
+        site = stored.sites[1]
+        self.assertIsNone(stored.code(site))
+        self.assertIn('SyntaxError', stored.mutants[site].error)
+
+    def test_fingerprints(self):
+        code = "def f():\n    if 0:\n        return 1\n    return 2"
+        stored = self.store.generate({'a.py': code},
+                                     [mutator.NumberMutator])['a.py']
+        pruner = equivalence.MutantPruner(code, 'a.py', stored.fingerprints())
+        self.assertEquals([None, equivalence.EQUIVALENT, None],
+                          [pruner.check(site) for site in stored.sites])
+
+    def test_unchanged_files_are_reused(self):
+        self.store.generate({'a.py': self.code, 'b.py': 'y = 2'},
+                            self.mutator_classes, processes=2)
+        self.assertEquals(2, self.store.generated)
+        stored = self.store.generate({'a.py': self.code, 'b.py': 'y = 3'},
+                                     self.mutator_classes)
+        self.assertEquals(1, self.store.generated)
+        namespace = {}
+        exec stored['b.py'].code(stored['b.py'].sites[0]) in namespace
+        self.assertEquals(4, namespace['y'])
+
+    def test_other_mutators_are_not_reused(self):
+        self.store.generate({'a.py': self.code}, self.mutator_classes)
+        stored = self.store.generate({'a.py': self.code},
+                                     [mutator.NumberMutator])
+        self.assertEquals(1, self.store.generated)
+        self.assertEquals(1, len(stored['a.py'].sites))
+
+    def test_only_given_sites_are_compiled(self):
+        sites = mutator.mutation_sites(self.mutator_classes, self.code,
+                                       lambda line, line_no: True)
+        stored = self.store.generate({'a.py': self.code},
+                                     self.mutator_classes,
+                                     sites_by_file={'a.py': sites[:1]})
+        self.assertEquals(sites[:1], stored['a.py'].sites)
+        self.assertEquals(sites[:1], self.store.read(
+                {'a.py': self.code}, self.mutator_classes)['a.py'].sites)
+        stored = self.store.generate({'a.py': self.code},
+                                     self.mutator_classes,
+                                     sites_by_file={'a.py': sites[:1]})
+        self.assertEquals(0, self.store.generated)
+        stored = self.store.generate({'a.py': self.code},
+                                     self.mutator_classes,
+                                     sites_by_file={'a.py': sites[2:]})
+        self.assertEquals(1, self.store.generated)
+        self.assertEquals([sites[0], sites[2]], stored['a.py'].sites)
+        namespace = {}
+        exec stored['a.py'].code(sites[0]) in namespace
+        self.assertEquals(2, namespace['x'])
+        self.assertIn('SyntaxError', stored['a.py'].mutants[sites[2]].error)
+
+    def test_read_without_store(self):
+        self.assertEquals({}, self.store.read({'a.py': self.code},
+                                              self.mutator_classes))
+
+    def test_changed_mutators_are_not_reused(self):
+        self.store.generate({'a.py': self.code}, self.mutator_classes)
+        mutators_hash = store.mutators_hash
+        store.mutators_hash = lambda mutator_classes: 'changed'
+        try:
+            self.store.generate({'a.py': self.code}, self.mutator_classes)
+        finally:
+            store.mutators_hash = mutators_hash
+        self.assertEquals(1, self.store.generated)
+
+    def test_mutators_hash(self):
+        class OtherMutator(mutator.NumberMutator):
+            pass
+
+        self.assertEquals(store.mutators_hash(self.mutator_classes),
+                          store.mutators_hash([mutator.NumberMutator]))
+        self.assertNotEquals(store.mutators_hash(self.mutator_classes),
+                             store.mutators_hash([OtherMutator]))
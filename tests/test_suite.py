@@ -0,0 +1,186 @@
+import os
+from StringIO import StringIO
+import shutil
+import sys
+import tempfile
+
+import nose.suite
+from unittest2 import TestCase
+
+from elcap import budget
+from elcap import suite
+from elcap.plugins import unload_modules
+
+
+class TestTestIndex(TestCase):
+    test_code = '''import indexed_module
+
+def test_value():
+    assert indexed_module.value == 1
+
+def test_other():
+    pass
+'''
+
+    def setUp(self):
+        self.base_modules = sys.modules.keys()
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'indexed_module.py'),
+                  'w') as fd:
+            fd.write('value = 1\n')
+        self.test_filename = os.path.join(self.directory, 'test_indexed.py')
+        with open(self.test_filename, 'w') as fd:
+            fd.write(self.test_code)
+        sys.path.insert(0, self.directory)
+        self.value_test = self.test_filename + ':test_value'
+        self.other_test = self.test_filename + ':test_other'
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        unload_modules(exclude=self.base_modules)
+        shutil.rmtree(self.directory)
+
+    def test_collect(self):
+        test_index = suite.collect([self.value_test])
+        self.assertEquals([self.value_test, self.other_test],
+                          test_index.tests.keys())
+        self.assertTrue(test_index.covers([self.value_test]))
+        self.assertFalse(test_index.covers([self.value_test + '_2']))
+
+    def test_run(self):
+        test_index = suite.collect([self.value_test])
+        self.assertTrue(test_index.run([self.value_test,
+                                        self.other_test]).wasSuccessful())
+        sys.modules['indexed_module'].value = 2
+        result = test_index.run([self.value_test, self.other_test])
+        self.assertFalse(result.wasSuccessful())
+        self.assertEquals(self.value_test, result.killer)
+        self.assertEquals([], result.failures)
+        self.assertTrue(result.shouldStop)
+        self.assertTrue(test_index.run([self.other_test]).wasSuccessful())
+
+    def test_is_current(self):
+        test_index = suite.collect([self.value_test])
+        self.assertTrue(test_index.is_current('indexed_module'))
+        del sys.modules['indexed_module']
+        import indexed_module  # pylint: disable=W0612
+        self.assertFalse(test_index.is_current('indexed_module'))
+        self.assertFalse(test_index.is_current('unknown_module'))
+
+    def test_is_current_with_test_modules(self):
+        test_index = suite.collect([self.value_test])
+        self.assertEquals(set(['test_indexed']), test_index.test_modules)
+        del sys.modules['test_indexed']
+        self.assertFalse(test_index.is_current('indexed_module'))
+        import test_indexed  # pylint: disable=W0612
+        self.assertFalse(test_index.is_current('indexed_module'))
+
+    def test_kill_result_hang(self):
+        test = suite.collect([self.value_test]).tests[self.value_test][0]
+        result = suite.KillResult()
+        result.addError(test, (budget.BudgetExceeded,
+                               budget.BudgetExceeded(), None))
+        self.assertEquals(self.value_test, result.killer)
+        self.assertTrue(result.hung)
+        result = suite.KillResult()
+        result.addFailure(test, (AssertionError, AssertionError(), None))
+        self.assertFalse(result.hung)
+        self.assertFalse(result.out_of_memory)
+        result = suite.KillResult()
+        result.addError(test, (MemoryError, MemoryError(), None))
+        self.assertTrue(result.out_of_memory)
+
+    def test_measure(self):
+        test_index = suite.collect([self.value_test])
+        timings = suite.measure(test_index, 3)
+        self.assertEquals(sorted([self.value_test, self.other_test]),
+                          sorted(timings.samples))
+        self.assertEquals(3, len(timings.samples[self.value_test]))
+
+    def test_indexing_result(self):
+        class Coverage(object):
+            def __init__(self):
+                self.measured = []
+
+            def beforeTest(self, test):
+                pass
+
+            def afterTest(self, test):
+                self.measured.append(test)
+
+        test_coverage = Coverage()
+        test_index = suite.TestIndex()
+        result = suite.IndexingResult(test_index, test_coverage, StringIO(),
+                                      False, 0)
+        collected = suite.collect([self.value_test])
+        nose_suite = nose.suite.ContextSuiteFactory()(
+                [test for tests in collected.tests.values()
+                 for test in tests])
+        nose_suite(result)
+        self.assertTrue(result.wasSuccessful())
+        self.assertEquals(collected.tests.keys(), test_index.tests.keys())
+        self.assertEquals(2, len(test_coverage.measured))
+
+
+class TestTestPrioritizer(TestCase):
+    def setUp(self):
+        self.prioritizer = suite.TestPrioritizer({'fast': 0.1, 'slow': 2.0,
+                                                  'medium': 1.0})
+        self.line = ('a.py', 3)
+        self.function = ('a.py', ('f',))
+
+    def test_order_by_time(self):
+        self.assertEquals(['fast', 'medium', 'slow'],
+                          self.prioritizer.order(set(['slow', 'fast',
+                                                      'medium']),
+                                                 [self.line, self.function]))
+
+    def test_killers_first(self):
+        self.prioritizer.record([('a.py', 4), self.function], 'slow')
+        self.prioritizer.record([self.line, self.function], 'medium')
+        self.assertEquals(['medium', 'slow', 'fast'],
+                          self.prioritizer.order(['fast', 'medium', 'slow'],
+                                                 [self.line, self.function]))
+        self.assertEquals(['slow', 'fast', 'medium'],
+                          self.prioritizer.order(['fast', 'medium', 'slow'],
+                                                 [('a.py', 4), None]))
+
+    def test_merge(self):
+        other = suite.TestPrioritizer({})
+        other.record([self.line, self.function], 'slow')
+        other.record([self.line, None], 'slow')
+        self.prioritizer.record([self.line, None], 'medium')
+        self.prioritizer.record([self.line, None], 'slow')
+        self.prioritizer.merge(other.kills_for([self.line, self.function,
+                                                None]))
+        self.assertEquals({self.line: {'slow': 2, 'medium': 1},
+                           self.function: {'slow': 1}},
+                          self.prioritizer.kills_for([self.line,
+                                                      self.function]))
+        self.assertEquals({}, self.prioritizer.kills_for([('a.py', 4)]))
+
+    def test_line_kills_before_function_kills(self):
+        self.prioritizer.record([('a.py', 4), self.function], 'fast')
+        self.prioritizer.record([('a.py', 5), self.function], 'fast')
+        self.prioritizer.record([self.line, self.function], 'slow')
+        self.assertEquals(['slow', 'fast', 'medium'],
+                          self.prioritizer.order(['fast', 'medium', 'slow'],
+                                                 [self.line, self.function]))
+
+
+class TestTestTimings(TestCase):
+    def setUp(self):
+        self.timings = suite.TestTimings()
+        for duration in (0.3, 0.1, 0.2):
+            self.timings.add('odd', duration)
+        for duration in (0.4, 0.1, 0.2, 0.3):
+            self.timings.add('even', duration)
+
+    def test_median(self):
+        self.assertAlmostEquals(0.2, self.timings.median('odd'))
+        self.assertAlmostEquals(0.25, self.timings.median('even'))
+
+    def test_estimate(self):
+        self.assertAlmostEquals(0.2, self.timings.spread('odd'))
+        self.assertAlmostEquals(0.4, self.timings.estimate('odd'))
+        self.assertAlmostEquals(0.55, self.timings.estimate('even'))
@@ -0,0 +1,9 @@
+from elcap.mutator import BaseMutator
+
+
+class MutatorA(BaseMutator):
+    pass
+
+
+class MutatorB(BaseMutator):
+    pass